@@ -1,7 +1,7 @@
-from groq_client import groq_client
+from groq_client import get_async_groq_client
 from config import MODEL_NAME
 from schemas import ChatMessage
-from typing import List, Optional, Dict
+from typing import AsyncIterator, List, Optional, Dict, Tuple
 from document_cache import document_cache
 from document_handler import get_document_segments_for_context
 import logging
@@ -10,6 +10,100 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Sampling parameters shared by the streaming and non-streaming advisor calls
+ADVISOR_COMPLETION_OPTIONS = {
+    "model": MODEL_NAME,
+    "temperature": 0.7,
+    "frequency_penalty": 0.7,
+    "presence_penalty": 0.6,
+    "max_tokens": 500
+}
+
+ADVISOR_ERROR_RESPONSE = "I'm sorry, I encountered an error processing your request. Please try again or contact support if the issue persists."
+
+def build_advisor_conversation(
+    message: str,
+    history: Optional[List[ChatMessage]] = None,
+    doc_id: Optional[str] = None
+) -> Tuple[List[Dict[str, str]], Optional[Dict], str]:
+    """
+    Build the messages sent to the model for an advisor turn
+    
+    Args:
+        message: The current user message
+        history: Optional list of previous chat messages
+        doc_id: Optional document ID to retrieve context from cache
+        
+    Returns:
+        Tuple of the conversation messages, the document metadata (if any) and the
+        user message enhanced with document context
+    """
+    # Get document context if available
+    document_context = ""
+    document_metadata = None
+    
+    if doc_id:
+        document_metadata = document_cache.get_document_metadata(doc_id)
+        if document_metadata:
+            # Get the segments relevant to the question for context
+            document_context = get_document_segments_for_context(doc_id, query=message)
+            logger.info(f"Retrieved document context for doc_id: {doc_id}, length: {len(document_context)}")
+    
+    # System message with enhanced instructions based on document presence
+    system_content = "You are a helpful, friendly, and expert career advisor. Ask questions, give personalized advice, and guide the user to reflect on their interests and strengths."
+    
+    # Add document awareness to system message if document exists
+    if document_metadata:
+        doc_type = document_metadata.get("document_type", "document")
+        file_name = document_metadata.get("file_name", "uploaded document")
+        system_content += f" The user has uploaded a {doc_type} file named '{file_name}' which you can reference in your responses."
+    
+    system_message = {
+        "role": "system", 
+        "content": system_content
+    }
+    
+    conversation = [system_message]
+    
+    # Add conversation history if it exists
+    if history:
+        # Convert ChatMessage objects to dict format expected by API
+        for msg in history:
+            # Skip system messages that contain document references
+            if msg.role == "system" and msg.content.startswith("DOCUMENT_REFERENCE:"):
+                continue
+                
+            # Ensure role is one of the valid values: 'system', 'user', or 'assistant'
+            role = msg.role
+            if role not in ['system', 'user', 'assistant']:
+                # Default to 'user' if from user, otherwise 'assistant'
+                role = 'user' if 'user' in role.lower() else 'assistant'
+            
+            conversation.append({"role": role, "content": msg.content})
+    
+    # Enhance user message with document context if available
+    enhanced_message = message
+    if document_context:
+        enhanced_message = f"{message}\n\nContext from the uploaded {document_metadata.get('document_type', 'document')}:\n{document_context}"
+    
+    # Add the enhanced user message
+    conversation.append({"role": "user", "content": enhanced_message})
+    return conversation, document_metadata, enhanced_message
+
+def simple_conversation(enhanced_message: str, document_metadata: Optional[Dict]) -> List[Dict[str, str]]:
+    """
+    Just the system message and current user message, for retrying after role validation errors
+    """
+    system_content = "You are a helpful, friendly, and expert career advisor."
+    if document_metadata:
+        doc_type = document_metadata.get("document_type", "document")
+        system_content += f" The user has uploaded a {doc_type} which you can reference in your responses."
+    
+    return [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": enhanced_message}
+    ]
+
 async def career_advisor_response(
     message: str, 
     history: Optional[List[ChatMessage]] = None,
@@ -27,68 +121,17 @@ async def career_advisor_response(
     Returns:
         String containing the AI response
     """
+    document_metadata = None
+    enhanced_message = message
     try:
-        # Get document context if available
-        document_context = ""
-        document_metadata = None
-        
-        if doc_id:
-            document_metadata = document_cache.get_document_metadata(doc_id)
-            if document_metadata:
-                # Get document summary or relevant segments for context
-                document_context = get_document_segments_for_context(doc_id)
-                logger.info(f"Retrieved document context for doc_id: {doc_id}, length: {len(document_context)}")
-        
-        # System message with enhanced instructions based on document presence
-        system_content = "You are a helpful, friendly, and expert career advisor. Ask questions, give personalized advice, and guide the user to reflect on their interests and strengths."
-        
-        # Add document awareness to system message if document exists
-        if document_metadata:
-            doc_type = document_metadata.get("document_type", "document")
-            file_name = document_metadata.get("file_name", "uploaded document")
-            system_content += f" The user has uploaded a {doc_type} file named '{file_name}' which you can reference in your responses."
-        
-        system_message = {
-            "role": "system", 
-            "content": system_content
-        }
-        
-        conversation = [system_message]
-        
-        # Add conversation history if it exists
-        if history:
-            # Convert ChatMessage objects to dict format expected by API
-            for msg in history:
-                # Skip system messages that contain document references
-                if msg.role == "system" and msg.content.startswith("DOCUMENT_REFERENCE:"):
-                    continue
-                    
-                # Ensure role is one of the valid values: 'system', 'user', or 'assistant'
-                role = msg.role
-                if role not in ['system', 'user', 'assistant']:
-                    # Default to 'user' if from user, otherwise 'assistant'
-                    role = 'user' if 'user' in role.lower() else 'assistant'
-                
-                conversation.append({"role": role, "content": msg.content})
-        
-        # Enhance user message with document context if available
-        enhanced_message = message
-        if document_context:
-            enhanced_message = f"{message}\n\nContext from the uploaded {document_metadata.get('document_type', 'document')}:\n{document_context}"
-        
-        # Add the enhanced user message
-        conversation.append({"role": "user", "content": enhanced_message})
+        conversation, document_metadata, enhanced_message = build_advisor_conversation(message, history, doc_id)
         
         logger.info(f"Sending request to Groq with {len(conversation)} messages")
         
-        # Add repetition penalties to the model parameters
-        completion =groq_client.chat.completions.create(
+        # Await the async client so the event loop keeps serving other conversations meanwhile
+        completion = await get_async_groq_client().chat.completions.create(
             messages=conversation,
-            model=MODEL_NAME,
-            temperature=0.7,
-            frequency_penalty=0.7,
-            presence_penalty=0.6,
-            max_tokens=500
+            **ADVISOR_COMPLETION_OPTIONS
         )
         
         response = completion.choices[0].message.content.strip()
@@ -105,24 +148,9 @@ async def career_advisor_response(
             try:
                 logger.info("Retrying with simplified message structure")
                 
-                # Just use system message and current user message
-                system_content = "You are a helpful, friendly, and expert career advisor."
-                if document_metadata:
-                    doc_type = document_metadata.get("document_type", "document")
-                    system_content += f" The user has uploaded a {doc_type} which you can reference in your responses."
-                
-                simple_conversation = [
-                    {"role": "system", "content": system_content},
-                    {"role": "user", "content": enhanced_message if document_context else message}
-                ]
-                
-                completion = await groq_client.chat.completions.create(
-                    messages=simple_conversation,
-                    model=MODEL_NAME,
-                    temperature=0.7,
-                    frequency_penalty=0.7,
-                    presence_penalty=0.6,
-                    max_tokens=500
+                completion = await get_async_groq_client().chat.completions.create(
+                    messages=simple_conversation(enhanced_message, document_metadata),
+                    **ADVISOR_COMPLETION_OPTIONS
                 )
                 
                 return completion.choices[0].message.content.strip()
@@ -130,4 +158,46 @@ async def career_advisor_response(
             except Exception as retry_error:
                 logger.error(f"Retry also failed: {str(retry_error)}")
                 
-        return "I'm sorry, I encountered an error processing your request. Please try again or contact support if the issue persists."
\ No newline at end of file
+        return ADVISOR_ERROR_RESPONSE
+
+async def career_advisor_stream(
+    message: str,
+    history: Optional[List[ChatMessage]] = None,
+    doc_id: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Stream a career advisor response token by token as the model produces it.
+    
+    Args:
+        message: The current user message
+        history: Optional list of previous chat messages
+        doc_id: Optional document ID to retrieve context from cache
+        
+    Yields:
+        Pieces of the response text; on failure, the error response instead
+    """
+    started = False
+    try:
+        conversation, _, _ = build_advisor_conversation(message, history, doc_id)
+        logger.info(f"Streaming request to Groq with {len(conversation)} messages")
+        
+        stream = await get_async_groq_client().chat.completions.create(
+            messages=conversation,
+            stream=True,
+            **ADVISOR_COMPLETION_OPTIONS
+        )
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                # Leading whitespace is stripped like in non-streaming responses
+                if not started:
+                    token = token.lstrip()
+                    if not token:
+                        continue
+                    started = True
+                yield token
+        
+    except Exception as e:
+        logger.error(f"Error in career_advisor_stream: {str(e)}")
+        if not started:
+            yield ADVISOR_ERROR_RESPONSE
@@ -0,0 +1,126 @@
+import hashlib
+import threading
+import time
+import zlib
+from typing import Dict, Any, Optional
+from config import ANALYSIS_CACHE_MAX_BYTES, ANALYSIS_CACHE_PATH, ANALYSIS_CACHE_TTL_HOURS, DOCUMENT_CACHE_BACKEND
+from document_store import DocumentStore, create_document_store
+
+# Analyses live apart from the documents, in their own file or key prefix of the same backend
+ANALYSIS_STORE_OPTIONS = {
+    "sqlite": {"path": ANALYSIS_CACHE_PATH},
+    "redis": {"prefix": "advisor:analyses"},
+}
+
+class AnalysisCache:
+    """
+    Cache of document analyses keyed by a hash of the document text, document type
+    and prompt version, so re-uploading the same document skips the AI analysis.
+
+    Entries are kept in a DocumentStore on the document cache's backend: an entry's
+    metadata holds the document ID and its only segment the compressed analysis. With
+    the sqlite or redis backend, an analysis made by one worker is reused by all of
+    them; the memory backend keeps a cache per worker. Entries expire after ttl_seconds,
+    and the least recently used ones are evicted beyond max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = ANALYSIS_CACHE_MAX_BYTES, ttl_seconds: float = ANALYSIS_CACHE_TTL_HOURS * 3600,
+                 store: Optional[DocumentStore] = None):
+        """
+        Initialize the analysis cache
+
+        Args:
+            max_bytes: Maximum compressed size of the cached analyses
+            ttl_seconds: Seconds after which a cached analysis expires
+            store: Storage backend (defaults to the configured DOCUMENT_CACHE_BACKEND)
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.store = store if store is not None else create_document_store(
+            DOCUMENT_CACHE_BACKEND, **ANALYSIS_STORE_OPTIONS.get(DOCUMENT_CACHE_BACKEND, {})
+        )
+        self._lock = threading.Lock()
+        # Hit and eviction counts are per worker
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, document_type: str, prompt_version: str) -> str:
+        """
+        Hash what an analysis depends on
+
+        Args:
+            text: Extracted document text
+            document_type: Detected document type
+            prompt_version: Version of the analysis prompts
+
+        Returns:
+            Hex digest identifying the analysis
+        """
+        payload = "\x00".join([prompt_version, document_type, text])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _record(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached analysis
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            Dictionary with doc_id and analysis, or None if missing or expired
+        """
+        metadata = self.store.get_metadata(key)
+        segment = self.store.get_segment(key, 0) if metadata else None
+        if segment is None:
+            self._record("misses")
+            return None
+        self._record("hits")
+        return {**metadata, "analysis": zlib.decompress(segment).decode("utf-8")}
+
+    def _put(self, key: str, metadata: Dict[str, Any], segment: bytes) -> None:
+        self.store.put(key, metadata, [segment], metadata["created_at"] + self.ttl_seconds)
+        self.store.remove_expired(time.time())
+        self._record("evictions", self.store.evict_to_budget(self.max_bytes))
+
+    def put(self, key: str, doc_id: str, analysis: str) -> None:
+        """
+        Cache an analysis together with the document it was made for
+
+        Args:
+            key: Key from make_key
+            doc_id: Document ID in the document cache
+            analysis: Analysis text
+        """
+        self._put(key, {"doc_id": doc_id, "created_at": time.time()}, zlib.compress(analysis.encode("utf-8"), 6))
+
+    def set_doc_id(self, key: str, doc_id: str) -> None:
+        """
+        Point a cached analysis at a new copy of its document, keeping its age
+        """
+        metadata = self.store.get_metadata(key)
+        segment = self.store.get_segment(key, 0) if metadata else None
+        if segment is not None:
+            self._put(key, {**metadata, "doc_id": doc_id}, segment)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache size and hit statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            counters = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+        return {**self.store.stats(), "max_bytes": self.max_bytes, **counters}
+
+# Create a singleton instance
+analysis_cache = AnalysisCache()
@@ -1,15 +1,17 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import asyncio
 import tempfile
 import os
-import uuid
 import json
 import logging
 from werkzeug.utils import secure_filename
 from schemas import ChatMessage
-from advisor import career_advisor_response
+from advisor import career_advisor_response, career_advisor_stream
 from document_handler import process_document, get_document_segments_for_context
 from document_cache import document_cache
+from analysis_cache import analysis_cache
+from session_store import session_store
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,8 +20,8 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Enable CORS for cross-origin requests from your React frontend
 
-# In-memory storage for chat sessions
-chat_sessions = {}
+# Clear expired documents in the background instead of waiting for them to be looked up
+document_cache.start_sweeper()
 
 # Configure upload folder
 UPLOAD_FOLDER = tempfile.gettempdir()
@@ -30,6 +32,49 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def iterate_async(async_iterator):
+    """
+    Drive an async iterator from a synchronous generator, so Flask can stream it
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(async_iterator.aclose())
+        loop.close()
+
+def server_sent_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+def record_turn(session_id, message, response):
+    session_store.add_messages(session_id, [
+        ChatMessage(role="user", content=message),
+        ChatMessage(role="assistant", content=response)
+    ])
+
+def seed_session(session_id, history):
+    """
+    Start a session from a client-side history, as sent by older clients
+    """
+    messages = []
+    for msg in history:
+        # Document references become entries in the session's document index
+        if msg.get('role') == "system" and msg.get('content', '').startswith("DOCUMENT_REFERENCE:"):
+            try:
+                doc_info = json.loads(msg['content'].replace("DOCUMENT_REFERENCE:", "").strip())
+                if doc_info.get("doc_id"):
+                    session_store.attach_document(session_id, doc_info["doc_id"],
+                                                  doc_info.get("document_type", "general"), doc_info.get("file_name", ""))
+            except ValueError:
+                pass
+        else:
+            messages.append(ChatMessage(role=msg['role'], content=msg['content']))
+    session_store.add_messages(session_id, messages)
+
 @app.route('/api/advisor', methods=['POST'])
 async def advisor():
     """
@@ -39,29 +84,21 @@ async def advisor():
         data = request.get_json()
         message = data.get('message', '')
         history = data.get('history', [])
-        session_id = data.get('session_id', str(uuid.uuid4()))
-        
-        # Convert history to ChatMessage objects
-        chat_history = [ChatMessage(role=msg['role'], content=msg['content']) for msg in history]
+        session_id = data.get('session_id') or session_store.new_id()
+        stream = bool(data.get('stream', False))
         
-        # Store in session if not already there
-        if session_id not in chat_sessions:
-            chat_sessions[session_id] = chat_history
+        # Clients send only the new message; a history is only used to start a session the server doesn't know
+        if history and not session_store.exists(session_id):
+            seed_session(session_id, history)
         
-        # Check if we have a document reference in the history
-        doc_id = None
-        document_metadata = None
+        chat_history = session_store.get_history(session_id)
         
-        for msg in chat_history:
-            if msg.role == "system" and msg.content.startswith("DOCUMENT_REFERENCE:"):
-                try:
-                    doc_info = json.loads(msg.content.replace("DOCUMENT_REFERENCE:", "").strip())
-                    doc_id = doc_info.get("doc_id")
-                    if doc_id:
-                        document_metadata = document_cache.get_document_metadata(doc_id)
-                        break
-                except:
-                    pass
+        # Use the requested document, or the latest one uploaded in this session
+        doc_id = data.get('doc_id')
+        if not doc_id:
+            latest_document = session_store.latest_document(session_id)
+            doc_id = latest_document["doc_id"] if latest_document else None
+        document_metadata = document_cache.get_document_metadata(doc_id) if doc_id else None
         
         # Check for document-specific commands
         document_command = None
@@ -132,28 +169,40 @@ async def advisor():
                     response = f"Here's the full content of the document:\n\n{document_content}"
             
             # Add to chat history
-            chat_sessions[session_id].append(ChatMessage(role="user", content=message))
-            chat_sessions[session_id].append(ChatMessage(role="assistant", content=response))
+            record_turn(session_id, message, response)
             
             return jsonify({"response": response, "session_id": session_id})
         
         # For regular chat, get document context to include with the message
         document_context = ""
         if doc_id:
-            # Get a summary of the document to include as context
-            document_context = get_document_segments_for_context(doc_id)
+            # Get the parts of the document relevant to the question to include as context
+            document_context = get_document_segments_for_context(doc_id, query=message)
         
         # Add document context to the user message if available
         enhanced_message = message
         if document_context:
             enhanced_message = f"{message}\n\nContext from uploaded document:\n{document_context}"
         
+        if stream:
+            # Send tokens as server-sent events as they arrive, then a final event with the full response
+            def generate():
+                tokens = []
+                for token in iterate_async(career_advisor_stream(enhanced_message, chat_history)):
+                    tokens.append(token)
+                    yield server_sent_event({"token": token})
+                response = "".join(tokens).strip()
+                record_turn(session_id, message, response)
+                yield server_sent_event({"done": True, "response": response, "session_id": session_id})
+            
+            return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        
         # Get response from career advisor
         response = await career_advisor_response(enhanced_message, chat_history)
         
         # Update session
-        chat_sessions[session_id].append(ChatMessage(role="user", content=message))
-        chat_sessions[session_id].append(ChatMessage(role="assistant", content=response))
+        record_turn(session_id, message, response)
         
         return jsonify({"response": response, "session_id": session_id})
         
@@ -178,7 +227,7 @@ async def upload_file():
             return jsonify({"error": "No file selected"}), 400
             
         # Get session ID or create new one
-        session_id = request.form.get('session_id', str(uuid.uuid4()))
+        session_id = request.form.get('session_id') or session_store.new_id()
         
         if file and allowed_file(file.filename):
             # Secure the filename and save to temp location
@@ -189,25 +238,16 @@ async def upload_file():
             # Process the document and get analysis
             result = await process_document(file_path, filename)
             
-            # Initialize session if doesn't exist
-            if session_id not in chat_sessions:
-                chat_sessions[session_id] = []
-                
             # Add file upload message to history
-            chat_sessions[session_id].append(
+            session_store.add_messages(session_id, [
                 ChatMessage(role="user", content=f"I've uploaded a file: {filename}")
-            )
+            ])
             
-            # Store document reference in a system message
-            doc_reference = {
-                "doc_id": result.get("doc_id"),
-                "document_type": result.get("document_type", "general"),
-                "file_name": filename
-            }
-            
-            chat_sessions[session_id].append(
-                ChatMessage(role="system", content=f"DOCUMENT_REFERENCE: {json.dumps(doc_reference)}")
-            )
+            # Index the document in the session so later messages can refer to it
+            if result.get("doc_id"):
+                session_store.attach_document(
+                    session_id, result["doc_id"], result.get("document_type", "general"), filename
+                )
             
             # Create assistant response
             if "error" in result:
@@ -221,9 +261,9 @@ async def upload_file():
                 assistant_msg = f"I've received your {doc_type} \"{filename}\" and analyzed it. Here's what I found:\n\n{analysis}\n\nYou can ask me specific questions about this {doc_type}, or request to see specific sections."
             
             # Add assistant response to history
-            chat_sessions[session_id].append(
+            session_store.add_messages(session_id, [
                 ChatMessage(role="assistant", content=assistant_msg)
-            )
+            ])
             
             # Clean up temp file
             try:
@@ -235,7 +275,8 @@ async def upload_file():
                 "response": assistant_msg,
                 "session_id": session_id,
                 "document_type": result.get("document_type", "general"),
-                "doc_id": result.get("doc_id")
+                "doc_id": result.get("doc_id"),
+                "cached": result.get("cached", False)
             })
             
         else:
@@ -287,6 +328,42 @@ def get_document_metadata():
         logger.error(f"Error getting document metadata: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/document/cache/stats', methods=['GET'])
+def get_document_cache_stats():
+    """
+    Get document and analysis cache size and eviction statistics
+    """
+    return jsonify({**document_cache.stats(), "analysis_cache": analysis_cache.stats()})
+
+@app.route('/api/session/stats', methods=['GET'])
+def get_session_stats():
+    """
+    Get chat session store size and eviction statistics
+    """
+    return jsonify(session_store.stats())
+
+@app.route('/api/session/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """
+    Get the stored history and documents of a chat session
+    """
+    if not session_store.exists(session_id):
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify({
+        "session_id": session_id,
+        "history": [{"role": msg.role, "content": msg.content} for msg in session_store.get_history(session_id)],
+        "documents": session_store.get_documents(session_id)
+    })
+
+@app.route('/api/session/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """
+    Forget a chat session
+    """
+    if not session_store.delete(session_id):
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify({"deleted": session_id})
+
 @app.route('/')
 def home():
     return {"message": "Career Advisor Chatbot API is running."}
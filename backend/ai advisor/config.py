@@ -1,7 +1,38 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# Maximum number of Groq calls the advisor runs at once
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "16"))
 MODEL_NAME = "llama-3.3-70b-versatile"
+
+# Uploaded documents are kept in memory up to this many bytes of text, least recently used evicted first
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DOCUMENT_CACHE_EXPIRATION_HOURS = float(os.getenv("DOCUMENT_CACHE_EXPIRATION_HOURS", "24"))
+DOCUMENT_CACHE_SWEEP_SECONDS = float(os.getenv("DOCUMENT_CACHE_SWEEP_SECONDS", "60"))
+# Where uploaded documents live: memory (per worker), sqlite (shared on one host) or redis (shared everywhere)
+DOCUMENT_CACHE_BACKEND = os.getenv("DOCUMENT_CACHE_BACKEND", "memory")
+DOCUMENT_CACHE_PATH = os.getenv("DOCUMENT_CACHE_PATH", os.path.join(tempfile.gettempdir(), "advisor_documents.db"))
+DOCUMENT_CACHE_REDIS_URL = os.getenv("DOCUMENT_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Chat questions about an uploaded document get its top-k most relevant segments, within a token budget
+# that fits top-k full segments (about 1000 tokens each) and their section labels
+ADVISOR_EMBEDDING_MODEL = os.getenv("ADVISOR_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+ADVISOR_CONTEXT_TOP_K = int(os.getenv("ADVISOR_CONTEXT_TOP_K", "3"))
+ADVISOR_CONTEXT_TOKEN_BUDGET = int(os.getenv("ADVISOR_CONTEXT_TOKEN_BUDGET", "3200"))
+
+# Analyses of uploaded documents are reused when the same text is uploaded again. They use the
+# DOCUMENT_CACHE_BACKEND too, so with sqlite or redis every worker reuses them
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+ANALYSIS_CACHE_TTL_HOURS = float(os.getenv("ANALYSIS_CACHE_TTL_HOURS", "24"))
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", os.path.join(tempfile.gettempdir(), "advisor_analyses.db"))
+
+# Advisor chat sessions: idle sessions expire, the least recently used are evicted from memory, and
+# with ADVISOR_SESSION_DB set they persist in SQLite across restarts and workers
+ADVISOR_SESSION_LIMIT = int(os.getenv("ADVISOR_SESSION_LIMIT", "1000"))
+ADVISOR_SESSION_MAX_MESSAGES = int(os.getenv("ADVISOR_SESSION_MAX_MESSAGES", "20"))
+ADVISOR_SESSION_TTL_HOURS = float(os.getenv("ADVISOR_SESSION_TTL_HOURS", "24"))
+ADVISOR_SESSION_DB = os.getenv("ADVISOR_SESSION_DB", "")
@@ -1,7 +1,15 @@
 import logging
+import threading
 import uuid
+import zlib
 from typing import Dict, Any, List, Optional
 import time
+from config import DOCUMENT_CACHE_MAX_BYTES, DOCUMENT_CACHE_EXPIRATION_HOURS, DOCUMENT_CACHE_SWEEP_SECONDS
+from document_store import DocumentStore, create_document_store
+from segment_ranker import (
+    SECTION_LABEL_TOKENS, embed_texts, embeddings_to_bytes, embeddings_from_bytes, estimate_tokens, keyword_scores,
+    select_segments
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -9,20 +17,41 @@ logger = logging.getLogger(__name__)
 
 class DocumentCache:
     """
-    Cache for document storage and retrieval, with segmentation for large documents
+    Cache for document storage and retrieval, with segmentation for large documents.
+    
+    Segments are compressed and kept in a DocumentStore backend (memory, SQLite or
+    Redis, see DOCUMENT_CACHE_BACKEND), and fetched one at a time when needed. With a
+    shared backend, a doc_id returned by one worker is valid on every other worker.
+    The backend holds at most max_bytes of compressed segments, evicting the least
+    recently used documents beyond that. Expired documents are removed by a background
+    sweeper thread and on every insert.
     """
     
-    def __init__(self, max_segment_size: int = 4000, expiration_hours: int = 24):
+    def __init__(self, max_segment_size: int = 4000, expiration_hours: float = DOCUMENT_CACHE_EXPIRATION_HOURS,
+                 max_bytes: int = DOCUMENT_CACHE_MAX_BYTES, sweep_interval_seconds: float = DOCUMENT_CACHE_SWEEP_SECONDS,
+                 store: Optional[DocumentStore] = None):
         """
         Initialize the document cache
         
         Args:
             max_segment_size: Maximum size of each document segment in characters
             expiration_hours: Hours after which documents expire from cache
+            max_bytes: Total size of stored (compressed) segments before least recently used documents are evicted
+            sweep_interval_seconds: How often the background sweeper removes expired documents
+            store: Storage backend; defaults to the one configured by DOCUMENT_CACHE_BACKEND
         """
-        self.documents = {}  # Document storage
+        self.store = store if store is not None else create_document_store()
         self.max_segment_size = max_segment_size
         self.expiration_seconds = expiration_hours * 3600
+        self.max_bytes = max_bytes
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop_sweeper = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
     
     def add_document(self, file_name: str, content: str, document_type: str) -> str:
         """
@@ -35,28 +64,39 @@ class DocumentCache:
             
         Returns:
             Document ID for future reference
+            
+        Raises:
+            ValueError: If the document alone is larger than the cache
         """
         try:
             # Generate unique document ID
             doc_id = str(uuid.uuid4())
             
-            # Split content into segments
-            segments = self._segment_content(content)
+            # Split content into segments, stored compressed and embedded once for relevance ranking
+            texts = self._segment_content(content)
+            segments = [zlib.compress(text.encode("utf-8"), 6) for text in texts]
             segment_count = len(segments)
+            embeddings = embeddings_to_bytes(embed_texts(texts)) if segment_count > 1 else None
+            size = sum(len(segment) for segment in segments) + len(embeddings or b"")
+            if size > self.max_bytes:
+                raise ValueError(f"Document is {size} bytes compressed, larger than the {self.max_bytes}-byte document cache")
+            
+            now = time.time()
+            self._record("expirations", self.store.remove_expired(now))
             
             # Store document metadata
-            self.documents[doc_id] = {
-                "metadata": {
-                    "file_name": file_name,
-                    "document_type": document_type,
-                    "created_at": time.time(),
-                    "segment_count": segment_count,
-                    "total_length": len(content)
-                },
-                "segments": segments
+            metadata = {
+                "file_name": file_name,
+                "document_type": document_type,
+                "created_at": now,
+                "segment_count": segment_count,
+                "total_length": len(content),
+                "segment_tokens": [estimate_tokens(text) for text in texts]
             }
+            self.store.put(doc_id, metadata, segments, now + self.expiration_seconds, embeddings)
+            self._record("evictions", self.store.evict_to_budget(self.max_bytes))
             
-            logger.info(f"Added document to cache: {file_name} (ID: {doc_id}, {segment_count} segments)")
+            logger.info(f"Added document to cache: {file_name} (ID: {doc_id}, {segment_count} segments, {size} bytes)")
             return doc_id
             
         except Exception as e:
@@ -73,15 +113,9 @@ class DocumentCache:
         Returns:
             Document metadata or None if not found
         """
-        if doc_id not in self.documents:
-            return None
-            
-        # Check if document has expired
-        if self._is_expired(doc_id):
-            self._remove_expired_document(doc_id)
-            return None
-            
-        return self.documents[doc_id]["metadata"]
+        metadata = self.store.get_metadata(doc_id)
+        self._record("hits" if metadata else "misses")
+        return metadata
     
     def get_document_segment(self, doc_id: str, segment_index: int) -> Optional[str]:
         """
@@ -94,19 +128,8 @@ class DocumentCache:
         Returns:
             Segment content or None if not found
         """
-        if doc_id not in self.documents:
-            return None
-            
-        # Check if document has expired
-        if self._is_expired(doc_id):
-            self._remove_expired_document(doc_id)
-            return None
-            
-        segments = self.documents[doc_id]["segments"]
-        if 0 <= segment_index < len(segments):
-            return segments[segment_index]
-        
-        return None
+        segment = self.store.get_segment(doc_id, segment_index)
+        return zlib.decompress(segment).decode("utf-8") if segment is not None else None
     
     def get_document_summary(self, doc_id: str, max_segments: int = 2) -> str:
         """
@@ -119,28 +142,62 @@ class DocumentCache:
         Returns:
             Summary content or empty string if not found
         """
-        if doc_id not in self.documents:
-            return ""
-            
-        # Check if document has expired
-        if self._is_expired(doc_id):
-            self._remove_expired_document(doc_id)
+        metadata = self.store.get_metadata(doc_id)
+        if not metadata:
             return ""
-            
-        segments = self.documents[doc_id]["segments"]
-        metadata = self.documents[doc_id]["metadata"]
         
         # Get the first few segments
-        summary_segments = segments[:min(max_segments, len(segments))]
+        segment_count = metadata.get("segment_count", 0)
+        summary_segments = [
+            segment for segment in (self.get_document_segment(doc_id, i) for i in range(min(max_segments, segment_count)))
+            if segment is not None
+        ]
         
         # Add truncation notice if needed
         summary = "\n\n".join(summary_segments)
-        if len(segments) > max_segments:
+        if segment_count > max_segments:
             doc_type = metadata.get("document_type", "document")
-            summary += f"\n\n[This is a summary of the {doc_type}. The full document has {len(segments)} sections.]"
+            summary += f"\n\n[This is a summary of the {doc_type}. The full document has {segment_count} sections.]"
         
         return summary
     
+    def get_relevant_segments(self, doc_id: str, query: str, top_k: int, token_budget: int) -> List[int]:
+        """
+        Rank a document's segments against a query and pick the best ones within a token budget
+        
+        Args:
+            doc_id: Document ID
+            query: The user's question
+            top_k: Maximum number of segments
+            token_budget: Maximum estimated tokens of the selected segments
+            
+        Returns:
+            Selected segment indices in document order, or an empty list if not found
+        """
+        metadata = self.store.get_metadata(doc_id)
+        if not metadata:
+            return []
+        segment_count = metadata.get("segment_count", 0)
+        if segment_count <= 1:
+            return list(range(segment_count))
+        segment_tokens = metadata.get("segment_tokens")
+        
+        embeddings = embeddings_from_bytes(self.store.get_embeddings(doc_id), segment_count)
+        query_embedding = embed_texts([query]) if embeddings is not None else None
+        if query_embedding is not None and query_embedding.shape[1] == embeddings.shape[1]:
+            scores = embeddings @ query_embedding[0]
+        else:
+            # Single-segment documents and documents stored without embeddings are ranked by keywords
+            texts = [self.get_document_segment(doc_id, i) or "" for i in range(segment_count)]
+            scores = keyword_scores(query, texts)
+            if segment_tokens is None:
+                segment_tokens = [estimate_tokens(text) for text in texts]
+        if segment_tokens is None:
+            segment_tokens = [estimate_tokens(self.get_document_segment(doc_id, i) or "") for i in range(segment_count)]
+        # Each selected segment goes into the context with a section label, which counts against the budget
+        segment_tokens = [tokens + SECTION_LABEL_TOKENS for tokens in segment_tokens]
+        return select_segments(scores, segment_tokens, top_k, token_budget)
+    
     def clear_expired_documents(self) -> int:
         """
         Clear all expired documents from cache
@@ -148,21 +205,66 @@ class DocumentCache:
         Returns:
             Number of documents removed
         """
-        docs_to_remove = []
-        
-        # Find expired documents
-        for doc_id in self.documents:
-            if self._is_expired(doc_id):
-                docs_to_remove.append(doc_id)
-        
-        # Remove them
-        for doc_id in docs_to_remove:
-            self._remove_expired_document(doc_id)
+        removed = self.store.remove_expired(time.time())
+        self._record("expirations", removed)
         
-        if docs_to_remove:
-            logger.info(f"Cleared {len(docs_to_remove)} expired documents from cache")
+        if removed:
+            logger.info(f"Cleared {removed} expired documents from cache")
             
-        return len(docs_to_remove)
+        return removed
+    
+    def start_sweeper(self) -> None:
+        """
+        Start the background thread that clears expired documents every sweep interval
+        """
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._stop_sweeper.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="document-cache-sweeper", daemon=True)
+            self._sweeper.start()
+    
+    def stop_sweeper(self) -> None:
+        """
+        Stop the background sweeper thread
+        """
+        self._stop_sweeper.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache size and eviction statistics
+        
+        Returns:
+            Dictionary of entry counts and bytes from the backend, plus this worker's hits,
+            evictions and expirations
+        """
+        stats = self.store.stats()
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats.update({
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "sweeper_running": self._sweeper is not None and self._sweeper.is_alive()
+            })
+        return stats
+    
+    def _record(self, counter: str, count: int = 1) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + count)
+    
+    def _sweep_loop(self) -> None:
+        while not self._stop_sweeper.wait(self.sweep_interval_seconds):
+            try:
+                self.clear_expired_documents()
+            except Exception as e:
+                logger.error(f"Error sweeping document cache: {str(e)}")
     
     def _segment_content(self, content: str) -> List[str]:
         """
@@ -264,34 +366,6 @@ class DocumentCache:
             segments.append(current_segment)
         
         return segments
-    
-    def _is_expired(self, doc_id: str) -> bool:
-        """
-        Check if a document has expired
-        
-        Args:
-            doc_id: Document ID
-            
-        Returns:
-            True if document has expired
-        """
-        if doc_id not in self.documents:
-            return True
-            
-        created_at = self.documents[doc_id]["metadata"].get("created_at", 0)
-        return (time.time() - created_at) > self.expiration_seconds
-    
-    def _remove_expired_document(self, doc_id: str) -> None:
-        """
-        Remove an expired document from cache
-        
-        Args:
-            doc_id: Document ID
-        """
-        if doc_id in self.documents:
-            file_name = self.documents[doc_id]["metadata"].get("file_name", "Unknown")
-            logger.info(f"Removing expired document from cache: {file_name} (ID: {doc_id})")
-            del self.documents[doc_id]
 
 # Create a singleton instance
 document_cache = DocumentCache()
\ No newline at end of file
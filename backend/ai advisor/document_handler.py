@@ -1,6 +1,7 @@
 from document_cache import document_cache
-from groq_client import groq_client
-from config import MODEL_NAME
+from analysis_cache import analysis_cache
+from groq_client import get_async_groq_client
+from config import MODEL_NAME, ADVISOR_CONTEXT_TOP_K, ADVISOR_CONTEXT_TOKEN_BUDGET
 import logging
 import os
 from docx import Document as DocxDocument
@@ -13,6 +14,12 @@ import uuid
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Part of the analysis cache key; bump it whenever the analysis prompts change
+ANALYSIS_PROMPT_VERSION = "1"
+
+DOCUMENT_NOT_FOUND_MESSAGE = "Document not found in cache."
+ANALYSIS_ERROR_MESSAGE = "Sorry, I encountered an error analyzing the document. Please try again."
+
 def extract_text_from_docx(file_path: str) -> str:
     """
     Extract text from a .docx file
@@ -89,7 +96,7 @@ async def analyze_document_with_ai(doc_id: str, doc_type: str) -> str:
         # Get metadata to know how many segments
         metadata = document_cache.get_document_metadata(doc_id)
         if not metadata:
-            return "Document not found in cache."
+            return DOCUMENT_NOT_FOUND_MESSAGE
             
         # Get all segments
         segments = []
@@ -148,7 +155,7 @@ async def analyze_document_with_ai(doc_id: str, doc_type: str) -> str:
         ]
 
         logger.info(f"Sending {doc_type} document for analysis")
-        completion = groq_client.chat.completions.create(
+        completion = await get_async_groq_client().chat.completions.create(
             messages=messages,
             model=MODEL_NAME,
             temperature=0.5,
@@ -161,7 +168,7 @@ async def analyze_document_with_ai(doc_id: str, doc_type: str) -> str:
         
     except Exception as e:
         logger.error(f"Error in analyze_document_with_ai: {str(e)}")
-        return "Sorry, I encountered an error analyzing the document. Please try again."
+        return ANALYSIS_ERROR_MESSAGE
 
 async def process_document(file_path: str, file_name: str) -> Dict[str, Any]:
     """
@@ -192,18 +199,40 @@ async def process_document(file_path: str, file_name: str) -> Dict[str, Any]:
         doc_type = detect_document_type(file_name, text_content)
         logger.info(f"Detected document type: {doc_type} for {file_name}")
         
+        # The same text uploaded again reuses its document and analysis
+        analysis_key = analysis_cache.make_key(text_content, doc_type, ANALYSIS_PROMPT_VERSION)
+        cached = analysis_cache.get(analysis_key)
+        if cached:
+            doc_id = cached["doc_id"]
+            if document_cache.get_document_metadata(doc_id) is None:
+                # The document itself was evicted or expired; store it again but keep the analysis
+                doc_id = document_cache.add_document(file_name, text_content, doc_type)
+                analysis_cache.set_doc_id(analysis_key, doc_id)
+            logger.info(f"Reusing cached analysis for {file_name} (ID: {doc_id})")
+            return {
+                "document_type": doc_type,
+                "file_name": file_name,
+                "content_length": len(text_content),
+                "doc_id": doc_id,
+                "analysis": cached["analysis"],
+                "cached": True
+            }
+        
         # Store in cache
         doc_id = document_cache.add_document(file_name, text_content, doc_type)
         
         # Analyze with AI
         analysis = await analyze_document_with_ai(doc_id, doc_type)
+        if analysis not in (DOCUMENT_NOT_FOUND_MESSAGE, ANALYSIS_ERROR_MESSAGE):
+            analysis_cache.put(analysis_key, doc_id, analysis)
         
         return {
             "document_type": doc_type,
             "file_name": file_name,
             "content_length": len(text_content),
             "doc_id": doc_id,
-            "analysis": analysis
+            "analysis": analysis,
+            "cached": False
         }
         
     except Exception as e:
@@ -215,13 +244,16 @@ async def process_document(file_path: str, file_name: str) -> Dict[str, Any]:
             "analysis": "I encountered an error while processing your document. Please try again or upload a different file format."
         }
 
-def get_document_segments_for_context(doc_id: str, segment_indices: List[int] = None) -> str:
+def get_document_segments_for_context(doc_id: str, segment_indices: List[int] = None,
+                                      query: Optional[str] = None) -> str:
     """
     Get document segments for context inclusion
     
     Args:
         doc_id: Document ID in cache
-        segment_indices: Specific segment indices to retrieve (None for summary)
+        segment_indices: Specific segment indices to retrieve (None for summary or relevant segments)
+        query: The user's question; without segment_indices, the segments most relevant to it
+            are selected within ADVISOR_CONTEXT_TOKEN_BUDGET instead of the first ones
         
     Returns:
         Document content for context
@@ -241,6 +273,18 @@ def get_document_segments_for_context(doc_id: str, segment_indices: List[int] =
             if segment:
                 segments.append(segment)
         return "\n\n".join(segments)
+    elif query:
+        # Only the segments relevant to the question, labelled so the model knows where they come from
+        selected = document_cache.get_relevant_segments(doc_id, query, ADVISOR_CONTEXT_TOP_K, ADVISOR_CONTEXT_TOKEN_BUDGET)
+        segment_count = metadata.get("segment_count", 0)
+        segments = []
+        for idx in selected:
+            segment = document_cache.get_document_segment(doc_id, idx)
+            if segment:
+                segments.append(segment if segment_count == 1 else f"[Section {idx + 1} of {segment_count}]\n{segment}")
+        context = "\n\n".join(segments)
+        # The best segment is always kept, so trim it if it alone exceeds the budget
+        return context[:ADVISOR_CONTEXT_TOKEN_BUDGET * 4]
     else:
         # Get summary (first few segments)
         return document_cache.get_document_summary(doc_id)
\ No newline at end of file
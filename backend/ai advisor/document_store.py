@@ -0,0 +1,451 @@
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from config import DOCUMENT_CACHE_BACKEND, DOCUMENT_CACHE_PATH, DOCUMENT_CACHE_REDIS_URL
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class DocumentStore(ABC):
+    """
+    Storage backend of the DocumentCache.
+
+    Documents are stored as metadata plus compressed segments, which are fetched
+    one at a time. Backends enforce expiry and the byte budget themselves, so that
+    a shared backend applies them across every worker using it.
+    """
+
+    @abstractmethod
+    def put(self, doc_id: str, metadata: Dict[str, Any], segments: List[bytes], expires_at: float,
+            embeddings: Optional[bytes] = None) -> None:
+        """
+        Store a document
+
+        Args:
+            doc_id: Document ID
+            metadata: Document metadata (JSON-serializable)
+            segments: Compressed segments
+            expires_at: Time after which the document is gone
+            embeddings: Segment embedding matrix, if the segments were embedded
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a live document's metadata and mark it as recently used
+
+        Args:
+            doc_id: Document ID
+
+        Returns:
+            Document metadata or None if missing or expired
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_segment(self, doc_id: str, segment_index: int) -> Optional[bytes]:
+        """
+        Get one compressed segment of a live document
+
+        Args:
+            doc_id: Document ID
+            segment_index: Index of the segment
+
+        Returns:
+            Compressed segment or None if not found
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_embeddings(self, doc_id: str) -> Optional[bytes]:
+        """
+        Get the segment embedding matrix of a live document
+
+        Args:
+            doc_id: Document ID
+
+        Returns:
+            Embedding matrix bytes or None if missing
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, doc_id: str) -> bool:
+        """
+        Remove a document and its segments
+
+        Args:
+            doc_id: Document ID
+
+        Returns:
+            True if the document was stored
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_expired(self, now: float) -> int:
+        """
+        Remove expired documents
+
+        Returns:
+            Number of documents removed
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def evict_to_budget(self, max_bytes: int) -> int:
+        """
+        Evict least recently used documents until the stored segments fit in max_bytes
+
+        Returns:
+            Number of documents evicted
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dictionary with the backend name, number of documents and stored bytes
+        """
+        raise NotImplementedError
+
+def _log_removal(action: str, doc_id: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+    file_name = (metadata or {}).get("file_name")
+    logger.info(f"{action} document from cache: {file_name} (ID: {doc_id})" if file_name
+                else f"{action} document from cache (ID: {doc_id})")
+
+class MemoryDocumentStore(DocumentStore):
+    """
+    Per-process store: documents in least-recently-used order, expiry times in a heap
+    """
+
+    def __init__(self):
+        self.documents: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+        self._expiry_heap: List[Tuple[float, str]] = []  # (expires_at, doc_id), may hold removed documents
+        self._lock = threading.RLock()
+
+    def put(self, doc_id: str, metadata: Dict[str, Any], segments: List[bytes], expires_at: float,
+            embeddings: Optional[bytes] = None) -> None:
+        size = sum(len(segment) for segment in segments) + len(embeddings or b"")
+        with self._lock:
+            self.delete(doc_id)
+            self.documents[doc_id] = {"metadata": metadata, "segments": segments, "embeddings": embeddings,
+                                      "size": size, "expires_at": expires_at}
+            self.total_bytes += size
+            heapq.heappush(self._expiry_heap, (expires_at, doc_id))
+
+    def _live_entry(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self.documents.get(doc_id)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.time():
+                self.delete(doc_id)
+                return None
+            self.documents.move_to_end(doc_id)
+            return entry
+
+    def get_metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._live_entry(doc_id)
+        return entry["metadata"] if entry else None
+
+    def get_segment(self, doc_id: str, segment_index: int) -> Optional[bytes]:
+        entry = self._live_entry(doc_id)
+        if entry and 0 <= segment_index < len(entry["segments"]):
+            return entry["segments"][segment_index]
+        return None
+
+    def get_embeddings(self, doc_id: str) -> Optional[bytes]:
+        entry = self._live_entry(doc_id)
+        return entry["embeddings"] if entry else None
+
+    def delete(self, doc_id: str) -> bool:
+        with self._lock:
+            entry = self.documents.pop(doc_id, None)
+            if entry is None:
+                return False
+            self.total_bytes -= entry["size"]
+            return True
+
+    def remove_expired(self, now: float) -> int:
+        removed = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, doc_id = heapq.heappop(self._expiry_heap)
+                # Evicted or replaced documents leave stale heap entries behind
+                entry = self.documents.get(doc_id)
+                if entry is not None and entry["expires_at"] == expires_at:
+                    _log_removal("Removing expired", doc_id, entry["metadata"])
+                    self.delete(doc_id)
+                    removed += 1
+
+            # Rebuild the heap when stale entries outnumber live documents
+            if len(self._expiry_heap) > 2 * len(self.documents) + 64:
+                self._expiry_heap = [item for item in self._expiry_heap if item[1] in self.documents]
+                heapq.heapify(self._expiry_heap)
+        return removed
+
+    def evict_to_budget(self, max_bytes: int) -> int:
+        evicted = 0
+        with self._lock:
+            while self.total_bytes > max_bytes and self.documents:
+                doc_id = next(iter(self.documents))
+                _log_removal("Evicting least recently used", doc_id, self.documents[doc_id]["metadata"])
+                self.delete(doc_id)
+                evicted += 1
+        return evicted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", "entries": len(self.documents), "bytes": self.total_bytes}
+
+class SQLiteDocumentStore(DocumentStore):
+    """
+    On-disk store shared by every worker on the host and kept across restarts.
+
+    Segments are separate rows, so reading one does not load the whole document.
+    """
+
+    def __init__(self, path: str = DOCUMENT_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    metadata TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    embeddings BLOB
+                );
+                CREATE INDEX IF NOT EXISTS ix_documents_expires_at ON documents (expires_at);
+                CREATE INDEX IF NOT EXISTS ix_documents_last_access ON documents (last_access);
+                CREATE TABLE IF NOT EXISTS segments (
+                    doc_id TEXT NOT NULL,
+                    segment_index INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (doc_id, segment_index)
+                );
+            """)
+            # Stores created before segment embeddings lack the column
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(documents)")}
+            if "embeddings" not in columns:
+                connection.execute("ALTER TABLE documents ADD COLUMN embeddings BLOB")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets other workers read while one writes
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def put(self, doc_id: str, metadata: Dict[str, Any], segments: List[bytes], expires_at: float,
+            embeddings: Optional[bytes] = None) -> None:
+        size = sum(len(segment) for segment in segments) + len(embeddings or b"")
+        with self._connect() as connection:
+            connection.execute("DELETE FROM segments WHERE doc_id = ?", (doc_id,))
+            connection.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, metadata, size, expires_at, last_access, embeddings) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (doc_id, json.dumps(metadata), size, expires_at, time.time(),
+                 sqlite3.Binary(embeddings) if embeddings else None)
+            )
+            connection.executemany(
+                "INSERT INTO segments (doc_id, segment_index, data) VALUES (?, ?, ?)",
+                [(doc_id, i, sqlite3.Binary(segment)) for i, segment in enumerate(segments)]
+            )
+
+    def get_metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT metadata FROM documents WHERE doc_id = ? AND expires_at > ?", (doc_id, now)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE documents SET last_access = ? WHERE doc_id = ?", (now, doc_id))
+        return json.loads(row[0])
+
+    def get_segment(self, doc_id: str, segment_index: int) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT s.data FROM segments s JOIN documents d ON d.doc_id = s.doc_id "
+            "WHERE s.doc_id = ? AND s.segment_index = ? AND d.expires_at > ?",
+            (doc_id, segment_index, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def get_embeddings(self, doc_id: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT embeddings FROM documents WHERE doc_id = ? AND expires_at > ?", (doc_id, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row and row[0] else None
+
+    def _delete_where(self, connection: sqlite3.Connection, doc_ids: List[str]) -> None:
+        connection.executemany("DELETE FROM segments WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+        connection.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def delete(self, doc_id: str) -> bool:
+        with self._connect() as connection:
+            found = connection.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            self._delete_where(connection, [doc_id])
+        return found is not None
+
+    def remove_expired(self, now: float) -> int:
+        with self._connect() as connection:
+            doc_ids = [row[0] for row in connection.execute(
+                "SELECT doc_id FROM documents WHERE expires_at <= ?", (now,)
+            )]
+            self._delete_where(connection, doc_ids)
+        for doc_id in doc_ids:
+            _log_removal("Removing expired", doc_id)
+        return len(doc_ids)
+
+    def evict_to_budget(self, max_bytes: int) -> int:
+        with self._connect() as connection:
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            doc_ids = []
+            for doc_id, size in connection.execute("SELECT doc_id, size FROM documents ORDER BY last_access"):
+                if total <= max_bytes:
+                    break
+                doc_ids.append(doc_id)
+                total -= size
+            self._delete_where(connection, doc_ids)
+        for doc_id in doc_ids:
+            _log_removal("Evicting least recently used", doc_id)
+        return len(doc_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents").fetchone()
+        return {"backend": "sqlite", "path": self.path, "entries": entries, "bytes": size}
+
+class RedisDocumentStore(DocumentStore):
+    """
+    Store shared by advisor workers on any host, backed by Redis.
+
+    Each document is a metadata key plus a hash of segments, both expiring with the
+    document. Sorted sets of last access and expiry times drive eviction and sweeping.
+    """
+
+    def __init__(self, url: str = DOCUMENT_CACHE_REDIS_URL, prefix: str = "advisor:documents"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis document cache backend needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def put(self, doc_id: str, metadata: Dict[str, Any], segments: List[bytes], expires_at: float,
+            embeddings: Optional[bytes] = None) -> None:
+        size = sum(len(segment) for segment in segments) + len(embeddings or b"")
+        ttl = max(1, int(expires_at - time.time()))
+        pipeline = self.client.pipeline()
+        pipeline.set(self._key("meta", doc_id), json.dumps(metadata), ex=ttl)
+        pipeline.delete(self._key("segments", doc_id), self._key("embeddings", doc_id))
+        if embeddings:
+            pipeline.set(self._key("embeddings", doc_id), embeddings, ex=ttl)
+        if segments:
+            pipeline.hset(self._key("segments", doc_id), mapping={str(i): segment for i, segment in enumerate(segments)})
+            pipeline.expire(self._key("segments", doc_id), ttl)
+        pipeline.hset(self._key("sizes"), doc_id, size)
+        pipeline.zadd(self._key("access"), {doc_id: time.time()})
+        pipeline.zadd(self._key("expiry"), {doc_id: expires_at})
+        pipeline.execute()
+
+    def get_metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self._key("meta", doc_id))
+        if raw is None:
+            return None
+        self.client.zadd(self._key("access"), {doc_id: time.time()}, xx=True)
+        return json.loads(raw)
+
+    def get_segment(self, doc_id: str, segment_index: int) -> Optional[bytes]:
+        return self.client.hget(self._key("segments", doc_id), str(segment_index))
+
+    def get_embeddings(self, doc_id: str) -> Optional[bytes]:
+        return self.client.get(self._key("embeddings", doc_id))
+
+    def _forget(self, doc_ids: List[str]) -> None:
+        if not doc_ids:
+            return
+        pipeline = self.client.pipeline()
+        for doc_id in doc_ids:
+            pipeline.delete(self._key("meta", doc_id), self._key("segments", doc_id), self._key("embeddings", doc_id))
+        pipeline.hdel(self._key("sizes"), *doc_ids)
+        pipeline.zrem(self._key("access"), *doc_ids)
+        pipeline.zrem(self._key("expiry"), *doc_ids)
+        pipeline.execute()
+
+    def delete(self, doc_id: str) -> bool:
+        found = self.client.exists(self._key("meta", doc_id)) > 0
+        self._forget([doc_id])
+        return found
+
+    def remove_expired(self, now: float) -> int:
+        # The document keys expire on their own; this drops their bookkeeping
+        doc_ids = [doc_id.decode() for doc_id in self.client.zrangebyscore(self._key("expiry"), "-inf", now)]
+        self._forget(doc_ids)
+        for doc_id in doc_ids:
+            _log_removal("Removing expired", doc_id)
+        return len(doc_ids)
+
+    def evict_to_budget(self, max_bytes: int) -> int:
+        sizes = {doc_id.decode(): int(size) for doc_id, size in self.client.hgetall(self._key("sizes")).items()}
+        total = sum(sizes.values())
+        if total <= max_bytes:
+            return 0
+        doc_ids = []
+        for doc_id in self.client.zrange(self._key("access"), 0, -1):
+            if total <= max_bytes:
+                break
+            doc_id = doc_id.decode()
+            doc_ids.append(doc_id)
+            total -= sizes.get(doc_id, 0)
+        self._forget(doc_ids)
+        for doc_id in doc_ids:
+            _log_removal("Evicting least recently used", doc_id)
+        return len(doc_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = self.client.hvals(self._key("sizes"))
+        return {"backend": "redis", "entries": len(sizes), "bytes": sum(int(size) for size in sizes)}
+
+DOCUMENT_STORES = {
+    "memory": MemoryDocumentStore,
+    "sqlite": SQLiteDocumentStore,
+    "redis": RedisDocumentStore,
+}
+
+def create_document_store(backend: str = DOCUMENT_CACHE_BACKEND, **options) -> DocumentStore:
+    """
+    Create the configured document store
+
+    Args:
+        backend: One of memory, sqlite or redis
+        **options: Backend arguments, e.g. path for sqlite or prefix for redis
+
+    Returns:
+        DocumentStore instance
+    """
+    if backend not in DOCUMENT_STORES:
+        raise ValueError(f"Unknown document cache backend {backend}; choose from {', '.join(DOCUMENT_STORES)}")
+    logger.info(f"Using {backend} document cache backend")
+    return DOCUMENT_STORES[backend](**options)
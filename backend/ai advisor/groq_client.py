@@ -1,7 +1,9 @@
+import asyncio
 import os
 import logging
-from groq import AsyncGroq, Groq
-from config import GROQ_API_KEY
+from concurrent.futures import ThreadPoolExecutor
+from groq import Groq
+from config import GROQ_API_KEY, GROQ_MAX_CONCURRENCY
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,7 +20,11 @@ try:
         # Create a dummy client class for testing without API key
         class DummyGroqClient:
             class ChatCompletions:
-                def create(self, **kwargs):
+                def __init__(self):
+                    # Callers go through client.chat.completions.create
+                    self.completions = self
+                    
+                def create(self, stream: bool = False, **kwargs):
                     class DummyResponse:
                         class Choice:
                             class Message:
@@ -31,20 +37,85 @@ try:
                         def __init__(self, choices):
                             self.choices = choices
                             
-                    return DummyResponse([DummyResponse.Choice(DummyResponse.Choice.Message("This is a dummy response. Please configure a valid Groq API key."))])
+                    response = DummyResponse([DummyResponse.Choice(DummyResponse.Choice.Message("This is a dummy response. Please configure a valid Groq API key."))])
+                    if not stream:
+                        return response
+                    
+                    def chunks():
+                        for word in response.choices[0].message.content.split(" "):
+                            class Chunk:
+                                class Choice:
+                                    class Delta:
+                                        content = word + " "
+                                    delta = Delta()
+                                choices = [Choice()]
+                            yield Chunk()
+                    return chunks()
                     
             def __init__(self):
                 self.chat = self.ChatCompletions()
                 
         groq_client = DummyGroqClient()
-        async_groq_client = DummyGroqClient()
         
     else:
-        # Create real Groq clients
+        # Create real Groq client
         groq_client = Groq(api_key=api_key)
-        async_groq_client = AsyncGroq(api_key=api_key)
         logger.info("Groq client initialized successfully")
         
 except Exception as e:
     logger.error(f"Error initializing Groq client: {str(e)}")
-    raise
\ No newline at end of file
+    raise
+
+# Under WSGI, Flask runs each async view in a new event loop, so an AsyncGroq client per loop would
+# open a new connection pool (and TLS handshake) for every request. Instead the shared sync client,
+# which keeps one pool, is called from a thread pool so coroutines don't block their loop.
+groq_executor = ThreadPoolExecutor(max_workers=GROQ_MAX_CONCURRENCY, thread_name_prefix="groq")
+
+async def _iterate_in_executor(stream):
+    """
+    Iterate a blocking Groq stream without blocking the event loop
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(stream)
+    done = object()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(groq_executor, next, iterator, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+
+class AsyncGroqAdapter:
+    """
+    Awaitable chat.completions.create over the shared sync client
+    """
+
+    class ChatCompletions:
+        def __init__(self, client):
+            self.client = client
+            self.completions = self
+
+        async def create(self, stream: bool = False, **kwargs):
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                groq_executor, lambda: self.client.chat.completions.create(stream=stream, **kwargs)
+            )
+            return _iterate_in_executor(response) if stream else response
+
+    def __init__(self, client):
+        self.chat = self.ChatCompletions(client)
+
+async_groq_client = AsyncGroqAdapter(groq_client)
+
+def get_async_groq_client():
+    """
+    Get the async Groq client
+    
+    Returns:
+        Adapter running the shared Groq client (or the dummy client without an API key) in a thread pool
+    """
+    return async_groq_client
@@ -0,0 +1,105 @@
+import logging
+import re
+import threading
+from typing import List, Optional
+import numpy as np
+from config import ADVISOR_EMBEDDING_MODEL
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DTYPE = np.float16
+# Tokens of the "[Section i of n]" label and blank line added around each segment put in context
+SECTION_LABEL_TOKENS = 8
+
+_model = None
+_model_lock = threading.Lock()
+_model_unavailable = False
+
+def _get_model():
+    """
+    Load the sentence embedding model on first use
+
+    Returns:
+        SentenceTransformer instance, or None if it cannot be loaded
+    """
+    global _model, _model_unavailable
+    if _model is not None or _model_unavailable:
+        return _model
+    with _model_lock:
+        if _model is None and not _model_unavailable:
+            try:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(ADVISOR_EMBEDDING_MODEL)
+            except Exception as e:
+                logger.warning(f"Segment embeddings unavailable, ranking segments by keywords: {str(e)}")
+                _model_unavailable = True
+    return _model
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the token count at ~4 characters per token
+    """
+    return (len(text) + 3) // 4
+
+def embed_texts(texts: List[str]) -> Optional[np.ndarray]:
+    """
+    Embed texts as unit-normalized vectors
+
+    Args:
+        texts: Texts to embed
+
+    Returns:
+        Matrix with one row per text, or None if no embedding model is available
+    """
+    model = _get_model()
+    if model is None or not texts:
+        return None
+    vectors = np.asarray(model.encode(texts), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def embeddings_to_bytes(embeddings: Optional[np.ndarray]) -> Optional[bytes]:
+    return embeddings.astype(EMBEDDING_DTYPE).tobytes() if embeddings is not None else None
+
+def embeddings_from_bytes(data: Optional[bytes], rows: int) -> Optional[np.ndarray]:
+    if not data or not rows:
+        return None
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE).reshape(rows, -1).astype(np.float32)
+
+def keyword_scores(query: str, texts: List[str]) -> np.ndarray:
+    """
+    Score texts by the share of query words they contain, for when there are no embeddings
+    """
+    words = set(re.findall(r"[a-z0-9]{3,}", query.lower()))
+    if not words:
+        return np.zeros(len(texts), dtype=np.float32)
+    return np.asarray([
+        len(words & set(re.findall(r"[a-z0-9]{3,}", text.lower()))) / len(words) for text in texts
+    ], dtype=np.float32)
+
+def select_segments(scores: np.ndarray, segment_tokens: List[int], top_k: int, token_budget: int) -> List[int]:
+    """
+    Pick the best-scoring segments that fit the token budget
+
+    Args:
+        scores: Relevance score of each segment
+        segment_tokens: Estimated tokens of each segment
+        top_k: Maximum number of segments
+        token_budget: Maximum total tokens
+
+    Returns:
+        Selected segment indices in document order; the best segment is always included
+    """
+    selected = []
+    used = 0
+    for index in np.argsort(-scores):
+        index = int(index)
+        if len(selected) >= top_k:
+            break
+        if selected and used + segment_tokens[index] > token_budget:
+            continue
+        selected.append(index)
+        used += segment_tokens[index]
+    return sorted(selected)
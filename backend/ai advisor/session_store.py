@@ -0,0 +1,359 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+from config import ADVISOR_SESSION_DB, ADVISOR_SESSION_LIMIT, ADVISOR_SESSION_MAX_MESSAGES, ADVISOR_SESSION_TTL_HOURS
+from schemas import ChatMessage
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class AdvisorSession:
+    """
+    Recent messages of one advisor session, plus the documents uploaded in it
+    """
+
+    __slots__ = ("messages", "documents", "last_active", "revision")
+
+    def __init__(self, max_messages: int):
+        self.messages = deque(maxlen=max_messages)
+        self.documents: List[Dict[str, Any]] = []  # Document references, oldest first
+        self.last_active = time.time()
+        self.revision = None  # Revision of the database row this copy was loaded at
+
+class AdvisorSessionStore:
+    """
+    Bounded store of advisor chat sessions keyed by session ID.
+
+    Only the last max_messages messages of a session are kept. Sessions idle for longer
+    than ttl_seconds expire, and the least recently used ones are evicted from memory
+    beyond max_sessions. Each session indexes the documents uploaded in it, so the
+    latest one is found without scanning the history.
+
+    With a database path, SQLite is the source of truth, so sessions survive restarts
+    and are shared by workers on the same host. Every write bumps the session's
+    revision; the in-memory copy is only a cache, reloaded whenever another worker
+    has changed the session since it was read.
+    """
+
+    def __init__(self, max_sessions: int = ADVISOR_SESSION_LIMIT, max_messages: int = ADVISOR_SESSION_MAX_MESSAGES,
+                 ttl_seconds: float = ADVISOR_SESSION_TTL_HOURS * 3600, path: Optional[str] = ADVISOR_SESSION_DB):
+        """
+        Initialize the session store
+
+        Args:
+            max_sessions: Maximum number of sessions kept in memory
+            max_messages: Maximum number of messages kept per session
+            ttl_seconds: Seconds of inactivity after which a session expires
+            path: SQLite database for persistence, or None to keep sessions in memory only
+        """
+        self.max_sessions = max(1, max_sessions)
+        self.max_messages = max(1, max_messages)
+        self.ttl_seconds = ttl_seconds
+        self.path = path or None
+        self._sessions: "OrderedDict[str, AdvisorSession]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._last_db_expiry = 0.0
+        self.evictions = 0
+        self.expirations = 0
+        if self.path:
+            self._connect().executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    last_active REAL NOT NULL,
+                    revision TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_sessions_last_active ON sessions (last_active);
+                CREATE TABLE IF NOT EXISTS session_messages (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                );
+                CREATE TABLE IF NOT EXISTS session_documents (
+                    session_id TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    document_type TEXT,
+                    file_name TEXT,
+                    PRIMARY KEY (session_id, doc_id)
+                );
+            """)
+
+    @staticmethod
+    def new_id() -> str:
+        return str(uuid.uuid4())
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets other workers read while one writes.
+        # Transactions are managed explicitly by _transaction.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so workers reading and then
+        # writing a session are serialized instead of racing on its revision and seq
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _expire(self, now: float) -> None:
+        # Sessions are kept in last-active order, so expired ones are at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self.expirations += 1
+            logger.info(f"Expired advisor session {session_id}")
+        # Expired sessions are removed from the database at most once a minute
+        if self.path and now - self._last_db_expiry >= 60:
+            self._last_db_expiry = now
+            with self._transaction() as connection:
+                expired = "SELECT session_id FROM sessions WHERE last_active < ?"
+                cutoff = (now - self.ttl_seconds,)
+                connection.execute(f"DELETE FROM session_messages WHERE session_id IN ({expired})", cutoff)
+                connection.execute(f"DELETE FROM session_documents WHERE session_id IN ({expired})", cutoff)
+                connection.execute("DELETE FROM sessions WHERE last_active < ?", cutoff)
+
+    def _remember(self, session_id: str, session: AdvisorSession) -> None:
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            evicted_id, _ = self._sessions.popitem(last=False)
+            self.evictions += 1
+            logger.info(f"Evicted advisor session {evicted_id} from memory")
+
+    def _load(self, connection: sqlite3.Connection, session_id: str) -> AdvisorSession:
+        """
+        Load the stored messages and documents of a session
+        """
+        session = AdvisorSession(self.max_messages)
+        session.messages.extend(connection.execute(
+            "SELECT role, content FROM (SELECT seq, role, content FROM session_messages WHERE session_id = ? "
+            "ORDER BY seq DESC LIMIT ?) ORDER BY seq", (session_id, self.max_messages)
+        ).fetchall())
+        session.documents = [
+            {"doc_id": doc_id, "document_type": document_type, "file_name": file_name}
+            for doc_id, document_type, file_name in connection.execute(
+                "SELECT doc_id, document_type, file_name FROM session_documents WHERE session_id = ? ORDER BY rowid",
+                (session_id,)
+            )
+        ]
+        return session
+
+    def _sync(self, connection: sqlite3.Connection, session_id: str, create: bool,
+              now: float) -> Optional[AdvisorSession]:
+        """
+        Get the current copy of a stored session inside a transaction, and mark it active
+
+        Args:
+            connection: Connection with an open transaction
+            session_id: Session ID
+            create: Whether to create the session if it is missing or expired
+            now: Current time
+
+        Returns:
+            Session, or None if it is missing and create is False
+        """
+        row = connection.execute(
+            "SELECT revision FROM sessions WHERE session_id = ? AND last_active >= ?",
+            (session_id, now - self.ttl_seconds)
+        ).fetchone()
+        if row is None:
+            if not create:
+                return None
+            # Start afresh, dropping anything left from an expired session with this ID
+            connection.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM session_documents WHERE session_id = ?", (session_id,))
+            revision = uuid.uuid4().hex
+            connection.execute(
+                "INSERT INTO sessions (session_id, last_active, revision) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_active = excluded.last_active, revision = excluded.revision",
+                (session_id, now, revision)
+            )
+            session = AdvisorSession(self.max_messages)
+            session.revision = revision
+        else:
+            connection.execute("UPDATE sessions SET last_active = ? WHERE session_id = ?", (now, session_id))
+            session = self._sessions.get(session_id)
+            if session is None or session.revision != row[0]:
+                session = self._load(connection, session_id)
+                session.revision = row[0]
+        session.last_active = now
+        self._remember(session_id, session)
+        return session
+
+    def _get(self, session_id: str, create: bool) -> Optional[AdvisorSession]:
+        now = time.time()
+        self._expire(now)
+        if self.path:
+            with self._transaction() as connection:
+                return self._sync(connection, session_id, create, now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = AdvisorSession(self.max_messages)
+        session.last_active = now
+        self._remember(session_id, session)
+        return session
+
+    def _modify(self, session_id: str, write) -> None:
+        """
+        Apply a change to a session, creating it if needed
+
+        Args:
+            session_id: Session ID
+            write: Called with the session and, when persistent, a connection with an open transaction
+        """
+        with self._lock:
+            if not self.path:
+                write(self._get(session_id, create=True), None)
+                return
+            now = time.time()
+            self._expire(now)
+            with self._transaction() as connection:
+                session = self._sync(connection, session_id, True, now)
+                write(session, connection)
+                session.revision = uuid.uuid4().hex
+                connection.execute("UPDATE sessions SET revision = ? WHERE session_id = ?",
+                                   (session.revision, session_id))
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return self._get(session_id, create=False) is not None
+
+    def get_history(self, session_id: str) -> List[ChatMessage]:
+        """
+        Get the stored messages of a session
+
+        Args:
+            session_id: Session ID
+
+        Returns:
+            Messages, oldest first; empty if the session is unknown
+        """
+        with self._lock:
+            session = self._get(session_id, create=False)
+            if not session:
+                return []
+            return [ChatMessage(role=role, content=content) for role, content in session.messages]
+
+    def add_messages(self, session_id: str, messages: List[ChatMessage]) -> None:
+        """
+        Append messages to a session, creating it if needed
+
+        Args:
+            session_id: Session ID
+            messages: Messages to append
+        """
+        def write(session, connection):
+            session.messages.extend((message.role, message.content) for message in messages)
+            if connection is not None and messages:
+                # seq is allocated inside the write transaction, so concurrent workers can't collide
+                last = connection.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM session_messages WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+                connection.executemany(
+                    "INSERT INTO session_messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                    [(session_id, last + i + 1, message.role, message.content) for i, message in enumerate(messages)]
+                )
+                connection.execute(
+                    "DELETE FROM session_messages WHERE session_id = ? AND seq <= ?",
+                    (session_id, last + len(messages) - self.max_messages)
+                )
+
+        self._modify(session_id, write)
+
+    def attach_document(self, session_id: str, doc_id: str, document_type: str, file_name: str) -> None:
+        """
+        Record a document uploaded in a session
+
+        Args:
+            session_id: Session ID
+            doc_id: Document ID in the document cache
+            document_type: Type of document
+            file_name: Uploaded file name
+        """
+        def write(session, connection):
+            session.documents = [document for document in session.documents if document["doc_id"] != doc_id]
+            session.documents.append({"doc_id": doc_id, "document_type": document_type, "file_name": file_name})
+            if connection is not None:
+                connection.execute("DELETE FROM session_documents WHERE session_id = ? AND doc_id = ?",
+                                   (session_id, doc_id))
+                connection.execute(
+                    "INSERT INTO session_documents (session_id, doc_id, document_type, file_name) VALUES (?, ?, ?, ?)",
+                    (session_id, doc_id, document_type, file_name)
+                )
+
+        self._modify(session_id, write)
+
+    def get_documents(self, session_id: str) -> List[Dict[str, Any]]:
+        """
+        Get the documents uploaded in a session, oldest first
+        """
+        with self._lock:
+            session = self._get(session_id, create=False)
+            return list(session.documents) if session else []
+
+    def latest_document(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the most recently uploaded document of a session, or None
+        """
+        documents = self.get_documents(session_id)
+        return documents[-1] if documents else None
+
+    def delete(self, session_id: str) -> bool:
+        """
+        Forget a session and its documents index
+
+        Returns:
+            True if the session existed
+        """
+        with self._lock:
+            found = self._sessions.pop(session_id, None) is not None
+            if self.path:
+                with self._transaction() as connection:
+                    found = connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0 or found
+                    connection.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+                    connection.execute("DELETE FROM session_documents WHERE session_id = ?", (session_id,))
+            return found
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get size and eviction statistics
+        """
+        with self._lock:
+            self._expire(time.time())
+            stats = {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "messages": sum(len(session.messages) for session in self._sessions.values()),
+                "documents": sum(len(session.documents) for session in self._sessions.values()),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "persistent": bool(self.path)
+            }
+            if self.path:
+                stats["stored_sessions"] = self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return stats
+
+# Create a singleton instance
+session_store = AdvisorSessionStore()
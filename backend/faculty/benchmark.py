@@ -0,0 +1,303 @@
+"""Offline benchmark for the faculty RAG pipeline.
+
+Generates a synthetic corpus, then measures ingestion (process_document),
+retrieval (get_relevant_chunks), topic extraction (local keyphrases vs. LLM),
+quiz generation (generate_quiz_for_document) and chat (chat_with_documents)
+against a stubbed LLM. Results are written as JSON so runs can be compared
+before deploy.
+
+    python benchmark.py --sizes 10,50,100 --output benchmark_results.json
+
+The sentence-transformers models must already be in the local Hugging Face
+cache; the benchmark forces offline mode and never calls Groq unless
+--live-llm is given, which sends the topic extraction stage to the real API.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+# Everything below must resolve without network access, and must not touch the real database
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+_benchmark_dir = tempfile.mkdtemp(prefix="faculty_benchmark_")
+os.environ["FACULTY_DATABASE_URL"] = f"sqlite:///{os.path.join(_benchmark_dir, 'benchmark.db')}"
+os.environ["EMBEDDING_CACHE_PATH"] = ""
+# The Groq clients are replaced by a stub, but the modules construct one at import time
+os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+
+from db_setup import Base, engine  # noqa: E402
+import document_processor  # noqa: E402
+import quiz_generator  # noqa: E402
+import rag_chatbot  # noqa: E402
+import summary_tree  # noqa: E402
+import topic_extractor  # noqa: E402
+
+TOPIC_WORDS = {
+    "Photosynthesis": ["chlorophyll", "light", "glucose", "carbon", "dioxide", "stomata", "leaf", "energy"],
+    "Thermodynamics": ["entropy", "heat", "temperature", "engine", "enthalpy", "work", "equilibrium", "pressure"],
+    "Data Structures": ["array", "tree", "graph", "hash", "queue", "stack", "pointer", "node"],
+    "World History": ["empire", "treaty", "revolution", "dynasty", "trade", "colonial", "war", "reform"],
+    "Microeconomics": ["demand", "supply", "price", "elasticity", "market", "cost", "utility", "firm"],
+    "Linear Algebra": ["matrix", "vector", "eigenvalue", "basis", "determinant", "rank", "span", "transform"],
+}
+FILLER_WORDS = ["the", "a", "of", "in", "is", "and", "which", "students", "study", "explains", "because", "when"]
+
+
+class StubGroqClient:
+    """Stands in for the Groq client and returns canned completions offline."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    def create(self, messages, model=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        if "main educational topics" in prompt:
+            content = json.dumps(list(TOPIC_WORDS)[:4])
+        elif "multiple-choice questions" in prompt:
+            topic = prompt.split("about '", 1)[-1].split("'", 1)[0]
+            content = json.dumps([
+                {
+                    "question": f"Which statement about {topic} is correct? ({i + 1})",
+                    "options": ["Option A", "Option B", "Option C", "Option D"],
+                    "correct_index": i % 4,
+                    "topic": topic,
+                }
+                for i in range(2)
+            ])
+        else:
+            content = "This is a stubbed answer generated offline for benchmarking."
+        return _StubCompletion(content)
+
+
+class _StubCompletion:
+    def __init__(self, content: str):
+        message = type("Message", (), {"content": content})()
+        choice = type("Choice", (), {"message": message})()
+        self.choices = [choice]
+
+
+def generate_document(rng: random.Random, words: int) -> str:
+    """Build a synthetic lecture-notes style document mixing two topics."""
+    topics = rng.sample(list(TOPIC_WORDS), 2)
+    vocabulary = TOPIC_WORDS[topics[0]] + TOPIC_WORDS[topics[1]]
+    sentences = []
+    count = 0
+    while count < words:
+        length = rng.randint(8, 20)
+        sentence = [rng.choice(vocabulary) if rng.random() < 0.4 else rng.choice(FILLER_WORDS) for _ in range(length)]
+        sentences.append(" ".join(sentence).capitalize() + ".")
+        count += length
+    return f"{topics[0]} and {topics[1]}\n\n" + " ".join(sentences)
+
+
+def generate_queries(rng: random.Random, count: int) -> List[str]:
+    """Build short questions that reference the synthetic vocabulary."""
+    queries = []
+    for _ in range(count):
+        topic = rng.choice(list(TOPIC_WORDS))
+        terms = rng.sample(TOPIC_WORDS[topic], 2)
+        queries.append(f"How does {terms[0]} relate to {terms[1]} in {topic.lower()}?")
+    return queries
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(latencies: List[float], units: int = None) -> Dict[str, float]:
+    """Summarize per-operation latencies (seconds) as throughput and percentiles (milliseconds)."""
+    total = sum(latencies)
+    operations = len(latencies)
+    return {
+        "operations": operations,
+        "total_seconds": round(total, 4),
+        "throughput_per_second": round((units if units is not None else operations) / total, 3) if total else 0.0,
+        "mean_ms": round(total / operations * 1000, 3) if operations else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def timed(fn: Callable, verbose: bool):
+    """Run fn, silencing the pipeline's progress output unless verbose, and return (result, seconds)."""
+    sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with sink:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def _with_client(fn: Callable, client) -> Callable:
+    """Wrap a quiz_generator function so it runs with the given Groq client."""
+    def wrapper(*args, **kwargs):
+        previous = quiz_generator.groq_client
+        quiz_generator.groq_client = client
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            quiz_generator.groq_client = previous
+    return wrapper
+
+
+def reset_corpus() -> None:
+    """Recreate all tables and clear in-process caches between corpus sizes."""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    document_processor.embedding_cache.clear()
+    document_processor.retrieval_cache.clear()
+    document_processor.retrieval_cache.bump_generation()
+
+
+def run_size(size: int, args, rng: random.Random, llm_topics: Callable) -> Dict:
+    """Run every stage against a fresh corpus of the given number of documents.
+
+    llm_topics is the LLM topic extractor timed by the topic stage; only that stage
+    uses it, so the rest of the pipeline keeps the stubbed client.
+    """
+    reset_corpus()
+    print(f"\n=== Corpus size: {size} documents ===")
+
+    ingest_latencies = []
+    document_ids = []
+    texts = []
+    total_chars = 0
+    for i in range(size):
+        text = generate_document(rng, args.words_per_doc)
+        texts.append(text)
+        total_chars += len(text)
+        data = io.BytesIO(text.encode("utf-8"))
+        doc_id, elapsed = timed(
+            lambda: document_processor.process_document(data, f"synthetic_{i}.txt", f"Synthetic document {i}"),
+            args.verbose
+        )
+        document_ids.append(doc_id)
+        ingest_latencies.append(elapsed)
+    ingest = summarize(ingest_latencies)
+    ingest["chars_per_second"] = round(total_chars / sum(ingest_latencies), 1) if ingest_latencies else 0.0
+    print(f"Ingestion: {ingest['throughput_per_second']} docs/s, p95 {ingest['p95_ms']} ms")
+
+    retrieval_latencies = []
+    for query in generate_queries(rng, args.queries):
+        _, elapsed = timed(lambda: rag_chatbot.get_relevant_chunks(query), args.verbose)
+        retrieval_latencies.append(elapsed)
+    retrieval = summarize(retrieval_latencies)
+    print(f"Retrieval: {retrieval['throughput_per_second']} queries/s, p95 {retrieval['p95_ms']} ms")
+
+    chat_latencies = []
+    for query in generate_queries(rng, args.chat_queries):
+        _, elapsed = timed(lambda: asyncio.run(rag_chatbot.chat_with_documents(query, [])), args.verbose)
+        chat_latencies.append(elapsed)
+    chat = summarize(chat_latencies)
+    print(f"Chat: {chat['throughput_per_second']} messages/s, p95 {chat['p95_ms']} ms")
+
+    local_latencies = []
+    llm_latencies = []
+    confidences = []
+    for text in rng.sample(texts, min(args.quiz_docs, len(texts))):
+        (_, confidence), elapsed = timed(lambda: topic_extractor.extract_topics_locally(text), args.verbose)
+        local_latencies.append(elapsed)
+        confidences.append(confidence)
+        _, elapsed = timed(lambda: llm_topics(text), args.verbose)
+        llm_latencies.append(elapsed)
+    topics = {
+        "local": summarize(local_latencies),
+        "llm": summarize(llm_latencies),
+        "mean_local_confidence": round(sum(confidences) / len(confidences), 3) if confidences else 0.0,
+        "llm_skipped_in_hybrid": sum(c >= quiz_generator.TOPIC_CONFIDENCE_THRESHOLD for c in confidences),
+    }
+    print(f"Topics: local p50 {topics['local']['p50_ms']} ms, LLM p50 {topics['llm']['p50_ms']} ms, "
+          f"{topics['llm_skipped_in_hybrid']}/{len(confidences)} confident enough to skip the LLM")
+
+    quiz_latencies = []
+    for doc_id in rng.sample(document_ids, min(args.quiz_docs, len(document_ids))):
+        _, elapsed = timed(lambda: quiz_generator.generate_quiz_for_document(doc_id), args.verbose)
+        quiz_latencies.append(elapsed)
+    quiz = summarize(quiz_latencies)
+    print(f"Quiz: {quiz['throughput_per_second']} quizzes/s, p95 {quiz['p95_ms']} ms")
+
+    return {
+        "corpus_size": size,
+        "corpus_chars": total_chars,
+        "ingest": ingest,
+        "retrieval": retrieval,
+        "chat": chat,
+        "topics": topics,
+        "quiz": quiz,
+        "embedding_cache": document_processor.embedding_cache.stats(),
+        "retrieval_cache": document_processor.retrieval_cache.stats(),
+    }
+
+
+def main(argv: List[str] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="Offline benchmark for the faculty RAG pipeline")
+    parser.add_argument("--sizes", default="10,50,100", help="Comma-separated corpus sizes (documents)")
+    parser.add_argument("--words-per-doc", type=int, default=1500, help="Approximate words per synthetic document")
+    parser.add_argument("--queries", type=int, default=20, help="Retrieval queries per corpus size")
+    parser.add_argument("--chat-queries", type=int, default=5, help="Chat messages per corpus size")
+    parser.add_argument("--quiz-docs", type=int, default=3, help="Documents to generate quizzes for per corpus size")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per stubbed LLM call")
+    parser.add_argument("--live-llm", action="store_true",
+                        help="Time topic extraction against the real Groq API instead of the stub")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.json", help="Path of the JSON report")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline progress output")
+    args = parser.parse_args(argv)
+
+    llm = StubGroqClient(latency=args.llm_latency)
+    live_client = quiz_generator.groq_client
+    quiz_generator.groq_client = llm
+    rag_chatbot.groq_client = llm
+    rag_chatbot.deadline_groq_client = llm
+    summary_tree.groq_client = llm
+    # Only the topic stage calls the live API; quiz generation's topic extraction stays stubbed
+    llm_topics = quiz_generator.extract_topics_with_llm
+    if args.live_llm:
+        llm_topics = _with_client(llm_topics, live_client)
+
+    rng = random.Random(args.seed)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = [run_size(size, args, rng, llm_topics) for size in sizes]
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "embedding_model": document_processor.EMBEDDING_MODEL_NAME,
+            "args": vars(args),
+            "llm_calls": llm.calls,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote benchmark report to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from db_setup import SessionLocal, Document
+from document_processor import split_text_into_chunks, index_new_chunks, embed_chunks, build_summaries, retrieval_cache
+from document_router import update_document_centroids
+from sentence_index import SENTENCE_INDEX_ENABLED, index_document_sentences
+from text_extraction import extract_text_from_bytes
+
+# Load environment variables
+load_dotenv()
+
+# Documents written per transaction; chunks of a whole group are embedded in one batch
+BULK_INGEST_GROUP_SIZE = int(os.getenv("BULK_INGEST_GROUP_SIZE", "10"))
+BULK_INGEST_WORKERS = int(os.getenv("BULK_INGEST_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def extract_texts_parallel(files: List[Tuple[str, bytes]], max_workers: int = None) -> List[Dict]:
+    """Extract text from (filename, bytes) pairs in a process pool, keeping input order."""
+    max_workers = min(max_workers or BULK_INGEST_WORKERS, len(files)) or 1
+    results = []
+    if max_workers == 1:
+        for filename, data in files:
+            try:
+                results.append({"text": extract_text_from_bytes(data, filename)})
+            except Exception as e:
+                results.append({"error": str(e)})
+        return results
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(extract_text_from_bytes, data, filename) for filename, data in files]
+        for future in futures:
+            try:
+                results.append({"text": future.result()})
+            except Exception as e:
+                results.append({"error": str(e)})
+    return results
+
+
+def _write_group(items: List[Dict]) -> None:
+    """Create documents and chunks for a group of files in one transaction, embedding all new chunks together."""
+    db = SessionLocal()
+    try:
+        pending = []
+        written = []
+        for item in items:
+            chunks = split_text_into_chunks(item["text"], chunk_size=1000, overlap=150)
+            document = Document(title=item["title"], content=item["text"], content_length=len(item["text"]),
+                                chunk_count=len(chunks))
+            db.add(document)
+            db.flush()
+            stats = index_new_chunks(db, document.id, list(enumerate(chunks)), pending_embeddings=pending)
+            written.append(dict(document_id=document.id, chunks=len(chunks), **stats))
+
+        print(f"Embedding {len(pending)} chunks for {len(items)} documents")
+        embed_chunks(pending)
+        db.flush()
+        for result in written:
+            update_document_centroids(db, result["document_id"])
+        db.commit()
+        retrieval_cache.bump_generation()
+        for item, result in zip(items, written):
+            item.update(status="processed", **result)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def ingest_documents(files: List[Tuple[str, str, bytes]], group_size: int = None) -> List[Dict]:
+    """Ingest many (filename, title, bytes) files and return a status entry per file, in input order."""
+    group_size = group_size or BULK_INGEST_GROUP_SIZE
+    start = time.time()
+
+    extracted = extract_texts_parallel([(filename, data) for filename, _, data in files])
+    print(f"Extracted {len(files)} files in {time.time() - start:.2f}s")
+
+    statuses = []
+    ready = []
+    for (filename, title, _), result in zip(files, extracted):
+        status = {"filename": filename, "title": title}
+        if "error" in result:
+            status.update(status="failed", error=f"Error extracting text: {result['error']}")
+        else:
+            status.update(status="pending", text=result["text"])
+            ready.append(status)
+        statuses.append(status)
+
+    for i in range(0, len(ready), group_size):
+        group = ready[i:i + group_size]
+        try:
+            _write_group(group)
+        except Exception as e:
+            # Retry files one by one so a single bad file doesn't fail its whole group
+            print(f"Group write failed ({str(e)}), retrying {len(group)} files individually")
+            for item in group:
+                try:
+                    _write_group([item])
+                except Exception as item_error:
+                    item.update(status="failed", error=f"Error storing document: {str(item_error)}")
+
+    for status in ready:
+        text = status.pop("text")
+        if status["status"] != "processed":
+            continue
+        if SENTENCE_INDEX_ENABLED:
+            index_document_sentences(status["document_id"], text)
+        # Best-effort, so one document's failed summary doesn't abort the batch
+        build_summaries(status["document_id"])
+
+    print(f"Bulk ingestion of {len(files)} files finished in {time.time() - start:.2f}s")
+    return statuses
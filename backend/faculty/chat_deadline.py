@@ -0,0 +1,45 @@
+import time
+from typing import Dict, Optional
+
+
+class ChatDeadline:
+    """Total time budget of one chat request, shared by its stages.
+
+    Each stage asks how much time is left, optionally keeping a reserve for the stages
+    after it, and records what it did, so the response can report which stages ran.
+    A budget of None or 0 means no deadline.
+    """
+
+    def __init__(self, budget_seconds: Optional[float] = None):
+        self.budget_seconds = budget_seconds if budget_seconds and budget_seconds > 0 else None
+        self.started = time.monotonic()
+        self.stages: Dict[str, str] = {}
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self, reserve: float = 0.0) -> float:
+        """Seconds left after keeping reserve seconds back; infinite without a budget."""
+        if self.budget_seconds is None:
+            return float("inf")
+        return self.budget_seconds - self.elapsed() - reserve
+
+    def allows(self, seconds: float, reserve: float = 0.0) -> bool:
+        """Whether a stage needing at least seconds can start and still leave reserve."""
+        return self.remaining(reserve) >= seconds
+
+    def timeout(self, reserve: float = 0.0) -> Optional[float]:
+        """Timeout for a stage that must leave reserve seconds, or None without a budget."""
+        if self.budget_seconds is None:
+            return None
+        return max(0.0, self.remaining(reserve))
+
+    def record(self, stage: str, outcome: str) -> None:
+        self.stages[stage] = outcome
+
+    def report(self) -> Dict:
+        return {
+            "budget_seconds": self.budget_seconds,
+            "elapsed_ms": round(self.elapsed() * 1000, 1),
+            "stages": dict(self.stages),
+        }
@@ -0,0 +1,153 @@
+import os
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character heuristic
+    tiktoken = None
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+DEFAULT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "2500"))
+
+# Llama 3 uses a tiktoken-style BPE vocabulary; cl100k_base is the closest encoding tiktoken ships
+MODEL_ENCODINGS = {
+    "llama-3.3-70b-versatile": "cl100k_base",
+    "llama3-70b-8192": "cl100k_base",
+    "llama3-8b-8192": "cl100k_base",
+}
+
+# Chunks whose remaining budget would be smaller than this are dropped rather than trimmed
+MIN_TRIMMED_TOKENS = 40
+MIN_OVERLAP_CHARS = 20
+
+_encoders = {}
+
+
+def _get_encoder(model: str):
+    """Return a cached tiktoken encoder for the model, or None if unavailable."""
+    if tiktoken is None:
+        return None
+    encoding_name = MODEL_ENCODINGS.get(model, "cl100k_base")
+    if encoding_name not in _encoders:
+        try:
+            _encoders[encoding_name] = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            print(f"Could not load tokenizer {encoding_name}: {str(e)}")
+            _encoders[encoding_name] = None
+    return _encoders[encoding_name]
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """Count tokens for the target model, approximating ~4 characters per token without tiktoken."""
+    if not text:
+        return 0
+    encoder = _get_encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def find_overlap(previous: str, current: str, min_overlap: int = MIN_OVERLAP_CHARS) -> int:
+    """Return the length of the longest suffix of previous that is also a prefix of current."""
+    for size in range(min(len(previous), len(current)), min_overlap - 1, -1):
+        if previous.endswith(current[:size]):
+            return size
+    return 0
+
+
+def trim_to_tokens(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """Trim text to at most max_tokens, preferring to cut at a sentence or word boundary."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+
+    # Binary search the longest prefix that fits
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid], model) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    trimmed = text[:low]
+
+    sentence_end = max(trimmed.rfind(". "), trimmed.rfind("? "), trimmed.rfind("! "))
+    if sentence_end > len(trimmed) // 2:
+        return trimmed[:sentence_end + 1]
+    word_end = trimmed.rfind(" ")
+    if word_end > 0:
+        return trimmed[:word_end]
+    return trimmed
+
+
+def _score(chunk: Dict) -> float:
+    return chunk.get("rerank_score", chunk.get("similarity", 0.0))
+
+
+def pack_context(chunks: List[Dict], token_budget: Optional[int] = None,
+                 model: str = DEFAULT_MODEL) -> Tuple[List[Dict], Dict[str, int]]:
+    """Pack retrieved chunks into a token budget ordered by rerank score.
+
+    Text overlapping with an already selected neighbouring chunk of the same
+    document is dropped, and the last chunk that does not fit is trimmed.
+    Returns the packed chunks (copies with reduced content) and token stats.
+    """
+    if token_budget is None:
+        token_budget = DEFAULT_TOKEN_BUDGET
+
+    ordered = sorted(chunks, key=_score, reverse=True)
+    tokens_before = sum(count_tokens(chunk["content"], model) for chunk in ordered)
+
+    packed = []
+    selected = {}  # (document_id, chunk_index) -> content as packed, after trimming
+    tokens_used = 0
+
+    for chunk in ordered:
+        text = chunk["content"]
+        doc_id = chunk.get("document_id")
+        chunk_index = chunk.get("chunk_index")
+
+        if chunk_index is not None:
+            previous = selected.get((doc_id, chunk_index - 1))
+            if previous is not None:
+                text = text[find_overlap(previous, text):]
+            following = selected.get((doc_id, chunk_index + 1))
+            if following is not None:
+                overlap = find_overlap(text, following)
+                if overlap:
+                    text = text[:-overlap]
+
+        text = text.strip()
+        if not text:
+            continue
+
+        tokens = count_tokens(text, model)
+        remaining = token_budget - tokens_used
+        if tokens > remaining:
+            if remaining < MIN_TRIMMED_TOKENS:
+                break
+            text = trim_to_tokens(text, remaining, model)
+            tokens = count_tokens(text, model)
+
+        packed.append({**chunk, "content": text})
+        if chunk_index is not None:
+            # Neighbours are matched against the text actually sent, so a trimmed
+            # chunk doesn't cost its neighbour the passage that was cut from it
+            selected[(doc_id, chunk_index)] = text
+        tokens_used += tokens
+
+        if tokens_used >= token_budget:
+            break
+
+    stats = {
+        "token_budget": token_budget,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_used,
+        "tokens_saved": tokens_before - tokens_used,
+        "chunks_before": len(chunks),
+        "chunks_after": len(packed),
+    }
+    return packed, stats
@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+
+class Conversation:
+    """Recent messages of one conversation as (role, content) tuples, plus its last query rewrite."""
+
+    __slots__ = ("messages", "last_rewrite", "last_active")
+
+    def __init__(self, max_messages: int):
+        self.messages = deque(maxlen=max_messages)
+        self.last_rewrite: Optional[Tuple[str, str]] = None
+        self.last_active = time.time()
+
+
+class ConversationStore:
+    """Bounded in-memory store of chat conversations keyed by conversation id.
+
+    Only the last max_messages messages of a conversation are kept, each cut to
+    max_message_chars. Conversations idle for longer than ttl_seconds expire, and the
+    least recently used ones are evicted beyond max_conversations.
+    """
+
+    def __init__(self, max_conversations: int = 1000, max_messages: int = 10,
+                 max_message_chars: int = 2000, ttl_seconds: float = 6 * 3600):
+        self.max_conversations = max(1, max_conversations)
+        self.max_messages = max(1, max_messages)
+        self.max_message_chars = max_message_chars
+        self.ttl_seconds = ttl_seconds
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+        self.rewrites_reused = 0
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def _expire(self, now: float) -> None:
+        # Conversations are kept in last-active order, so expired ones are at the front
+        while self._conversations:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if now - conversation.last_active <= self.ttl_seconds:
+                break
+            del self._conversations[conversation_id]
+            self.expirations += 1
+
+    def _get(self, conversation_id: str, create: bool) -> Optional[Conversation]:
+        now = time.time()
+        self._expire(now)
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            if not create:
+                return None
+            conversation = Conversation(self.max_messages)
+            self._conversations[conversation_id] = conversation
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self.evictions += 1
+        conversation.last_active = now
+        self._conversations.move_to_end(conversation_id)
+        return conversation
+
+    def get_history(self, conversation_id: str) -> List[Tuple[str, str]]:
+        """Return the stored (role, content) messages of a conversation, oldest first."""
+        with self._lock:
+            conversation = self._get(conversation_id, create=False)
+            return list(conversation.messages) if conversation else []
+
+    def add_messages(self, conversation_id: str, messages: List[Tuple[str, str]]) -> None:
+        """Append (role, content) messages, creating the conversation if needed."""
+        with self._lock:
+            conversation = self._get(conversation_id, create=True)
+            for role, content in messages:
+                conversation.messages.append((role, content[:self.max_message_chars]))
+
+    @staticmethod
+    def rewrite_fingerprint(message: str, history: List[Tuple[str, str]]) -> str:
+        """Hash what a query rewrite depends on: the message and the recent context it is rewritten against."""
+        payload = "\x00".join([message.strip().lower()] + [f"{role}:{content}" for role, content in history[-3:]])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_rewrite(self, conversation_id: str, fingerprint: str) -> Optional[str]:
+        """Return the last rewritten query if it was made for the same message and context."""
+        with self._lock:
+            conversation = self._get(conversation_id, create=False)
+            if conversation and conversation.last_rewrite and conversation.last_rewrite[0] == fingerprint:
+                self.rewrites_reused += 1
+                return conversation.last_rewrite[1]
+            return None
+
+    def set_rewrite(self, conversation_id: str, fingerprint: str, rewritten_query: str) -> None:
+        with self._lock:
+            self._get(conversation_id, create=True).last_rewrite = (fingerprint, rewritten_query)
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            return self._conversations.pop(conversation_id, None) is not None
+
+    def stats(self) -> Dict[str, int]:
+        """Return size and eviction statistics."""
+        with self._lock:
+            self._expire(time.time())
+            return {
+                "conversations": len(self._conversations),
+                "max_conversations": self.max_conversations,
+                "messages": sum(len(conversation.messages) for conversation in self._conversations.values()),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rewrites_reused": self.rewrites_reused,
+            }
@@ -0,0 +1,286 @@
+"""Export and import of a faculty corpus as a single snapshot file.
+
+A snapshot holds documents, chunks, near-duplicate references, routing
+centroids, sentences, summaries and banked questions together with their stored vectors, so a
+corpus can be moved between environments (or restored after the startup
+wipe) without re-extracting or re-embedding anything.
+
+    python corpus_snapshot.py export corpus.snap
+    python corpus_snapshot.py import corpus.snap
+
+File layout (all integers little-endian):
+
+    magic "FCSNAP01" | format version (u32) | header length (u32) | header crc32 (u32)
+    JSON header describing every section: offset, length, sha256, shape
+    sections, each aligned to 64 bytes
+
+Record sections are zlib-compressed JSON; vector sections are raw matrices
+that are memory-mapped on import rather than read into memory.
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+from sqlalchemy import DateTime
+from sqlalchemy.orm import undefer
+from db_setup import (
+    SessionLocal, Document, DocumentChunk, ChunkReference, ChunkLSHBand, DocumentSentence, DocumentSummary,
+    DocumentCentroid, QuestionBankEntry, VectorProjection, ensure_schema
+)
+from document_processor import EMBEDDING_MODEL_NAME, retrieval_cache
+from near_duplicates import bytes_to_minhash, lsh_band_keys
+from question_bank import forget_saturated_topics
+
+SNAPSHOT_MAGIC = b"FCSNAP01"
+SNAPSHOT_FORMAT_VERSION = 1
+SECTION_ALIGNMENT = 64
+_PREFIX = struct.Struct("<8sIII")
+
+# Exported tables in insert order, with the binary columns stored as vector sections
+SNAPSHOT_TABLES = [
+    ("documents", Document, []),
+    ("chunks", DocumentChunk, [("embedding", np.float32), ("minhash", np.uint32), ("reduced_embedding", np.float16)]),
+    ("chunk_references", ChunkReference, []),
+    ("centroids", DocumentCentroid, [("embedding", np.float32)]),
+    ("sentences", DocumentSentence, [("embedding", np.float32)]),
+    ("summaries", DocumentSummary, [("embedding", np.float32)]),
+    ("question_bank", QuestionBankEntry, [("embedding", np.float32)]),
+    ("projections", VectorProjection, [("mean", np.float32), ("components", np.float32)]),
+]
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is malformed, corrupted or incompatible."""
+
+
+def _pad(f) -> None:
+    remainder = f.tell() % SECTION_ALIGNMENT
+    if remainder:
+        f.write(b"\0" * (SECTION_ALIGNMENT - remainder))
+
+
+def _to_json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _collect_table(db, model, vector_columns) -> Dict:
+    """Read a table into plain records plus one matrix per binary column."""
+    binary = [name for name, _ in vector_columns]
+    columns = [column.name for column in model.__table__.columns if column.name not in binary]
+    records = []
+    vectors = {name: [] for name in binary}
+    for row in db.query(model).options(undefer("*")).order_by(model.id).yield_per(1000):
+        record = [_to_json(getattr(row, name)) for name in columns]
+        # Rows without a stored vector keep -1 so present vectors pack densely
+        for name in binary:
+            data = getattr(row, name)
+            record.append(len(vectors[name]) if data else -1)
+            if data:
+                vectors[name].append(data)
+        records.append(record)
+    return {"columns": columns + [f"{name}_row" for name in binary], "records": records, "vectors": vectors}
+
+
+def export_corpus(path: str) -> Dict:
+    """Write the whole corpus to a snapshot file and return its header."""
+    start = time.time()
+    header = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "sections": {},
+    }
+    payloads = []
+    db = SessionLocal()
+    try:
+        for name, model, vector_columns in SNAPSHOT_TABLES:
+            table = _collect_table(db, model, vector_columns)
+            body = json.dumps({"columns": table["columns"], "records": table["records"]}).encode("utf-8")
+            payloads.append((name, {"kind": "records", "rows": len(table["records"])}, zlib.compress(body, 6)))
+            for column, dtype in vector_columns:
+                rows = table["vectors"][column]
+                width = len(rows[0]) // np.dtype(dtype).itemsize if rows else 0
+                matrix = b"".join(rows)
+                if len(matrix) != len(rows) * width * np.dtype(dtype).itemsize:
+                    raise SnapshotError(f"{name}.{column} holds vectors of different lengths")
+                meta = {"kind": "vectors", "dtype": np.dtype(dtype).str, "shape": [len(rows), width]}
+                payloads.append((f"{name}.{column}", meta, matrix))
+    finally:
+        db.close()
+
+    # Section offsets are part of the header, so repeat the layout until the header length settles
+    for name, meta, data in payloads:
+        header["sections"][name] = dict(meta, offset=0, length=len(data), sha256=hashlib.sha256(data).hexdigest())
+    header_bytes = b""
+    while len(header_bytes) != len(json.dumps(header).encode("utf-8")):
+        header_bytes = json.dumps(header).encode("utf-8")
+        offset = _PREFIX.size + len(header_bytes)
+        for name, _, data in payloads:
+            offset += -offset % SECTION_ALIGNMENT
+            header["sections"][name]["offset"] = offset
+            offset += len(data)
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(header_bytes), zlib.crc32(header_bytes)))
+            f.write(header_bytes)
+            for name, _, data in payloads:
+                _pad(f)
+                if f.tell() != header["sections"][name]["offset"]:
+                    raise SnapshotError(f"Section {name} was laid out at the wrong offset")
+                f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    print(f"Exported corpus snapshot to {path} ({os.path.getsize(path)} bytes) in {time.time() - start:.2f}s")
+    return header
+
+
+def read_header(path: str) -> Dict:
+    """Read and validate a snapshot's header."""
+    with open(path, "rb") as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) != _PREFIX.size:
+            raise SnapshotError("File is too short to be a corpus snapshot")
+        magic, version, header_length, header_crc = _PREFIX.unpack(prefix)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError("Not a corpus snapshot")
+        if version > SNAPSHOT_FORMAT_VERSION:
+            raise SnapshotError(f"Snapshot format version {version} is newer than supported ({SNAPSHOT_FORMAT_VERSION})")
+        header_bytes = f.read(header_length)
+    if zlib.crc32(header_bytes) != header_crc:
+        raise SnapshotError("Snapshot header checksum mismatch")
+    return json.loads(header_bytes)
+
+
+def _load_sections(path: str, header: Dict) -> Dict:
+    """Verify every section's checksum and return decoded records and memory-mapped vectors."""
+    size = os.path.getsize(path)
+    sections = {}
+    with open(path, "rb") as f:
+        for name, meta in header["sections"].items():
+            if meta["offset"] + meta["length"] > size:
+                raise SnapshotError(f"Section {name} is truncated")
+            if meta["kind"] == "vectors":
+                rows, width = meta["shape"]
+                data = (
+                    np.memmap(path, dtype=np.dtype(meta["dtype"]), mode="r", offset=meta["offset"], shape=(rows, width))
+                    if rows else np.zeros((0, width), dtype=np.dtype(meta["dtype"]))
+                )
+                digest = hashlib.sha256(memoryview(data) if rows else b"").hexdigest()
+            else:
+                f.seek(meta["offset"])
+                raw = f.read(meta["length"])
+                digest = hashlib.sha256(raw).hexdigest()
+                data = json.loads(zlib.decompress(raw))
+            if digest != meta["sha256"]:
+                raise SnapshotError(f"Checksum mismatch in section {name}")
+            sections[name] = data
+    return sections
+
+
+def _clear_corpus(db) -> None:
+    """Delete every corpus table, children first."""
+    for model in (VectorProjection, QuestionBankEntry, DocumentCentroid, DocumentSummary, DocumentSentence, ChunkLSHBand, ChunkReference,
+                  DocumentChunk, Document):
+        db.query(model).delete(synchronize_session=False)
+
+
+def import_corpus(path: str, replace: bool = True) -> Dict[str, int]:
+    """Restore a snapshot into the database, keeping ids, vectors and signatures as exported.
+
+    With replace=False the import refuses to run against a non-empty corpus.
+    """
+    start = time.time()
+    header = read_header(path)
+    if header["embedding_model"] != EMBEDDING_MODEL_NAME:
+        raise SnapshotError(
+            f"Snapshot vectors come from {header['embedding_model']}, but this server embeds with {EMBEDDING_MODEL_NAME}"
+        )
+    sections = _load_sections(path, header)
+
+    ensure_schema()
+    db = SessionLocal()
+    try:
+        if db.query(Document).count():
+            if not replace:
+                raise SnapshotError("Corpus is not empty; import with replace to overwrite it")
+            _clear_corpus(db)
+
+        counts = {}
+        for name, model, vector_columns in SNAPSHOT_TABLES:
+            # Snapshots from before a table or vector column was added simply lack its section
+            if name not in sections:
+                continue
+            table = sections[name]
+            columns = table["columns"]
+            matrices = {column: sections.get(f"{name}.{column}") for column, _ in vector_columns}
+            timestamps = [column.name for column in model.__table__.columns if isinstance(column.type, DateTime)]
+            rows = []
+            for record in table["records"]:
+                row = dict(zip(columns, record))
+                for column in timestamps:
+                    if row.get(column):
+                        row[column] = datetime.fromisoformat(row[column])
+                for column, _ in vector_columns:
+                    index = row.pop(f"{column}_row", -1)
+                    row[column] = matrices[column][index].tobytes() if index >= 0 else None
+                rows.append(row)
+            if rows:
+                db.execute(model.__table__.insert(), rows)
+            counts[name] = len(rows)
+
+            if model is DocumentChunk:
+                # LSH buckets are derived data, so they are rebuilt from the signatures instead of shipped
+                bands = [
+                    {"chunk_id": row["id"], "band_key": key}
+                    for row in rows if row["minhash"]
+                    for key in lsh_band_keys(bytes_to_minhash(row["minhash"]))
+                ]
+                if bands:
+                    db.execute(ChunkLSHBand.__table__.insert(), bands)
+        db.commit()
+        retrieval_cache.bump_generation()
+        # Restored ids may match documents whose bank was just replaced
+        forget_saturated_topics()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    print(f"Imported corpus snapshot from {path} in {time.time() - start:.2f}s: {counts}")
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export or import a faculty corpus snapshot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write the corpus to a snapshot file")
+    export_parser.add_argument("path")
+    import_parser = subparsers.add_parser("import", help="Restore the corpus from a snapshot file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--no-replace", action="store_true", help="Fail instead of overwriting a non-empty corpus")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        export_corpus(args.path)
+    else:
+        import_corpus(args.path, replace=not args.no_replace)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey
+import os
+from datetime import datetime
+from sqlalchemy import (
+    create_engine, inspect, text, Column, Integer, Float, String, Text, LargeBinary, DateTime, ForeignKey, Index
+)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred
 
 # Create engine
-DATABASE_URL = "sqlite:///./learning_platform.db"  # Adjust this URL as needed
+DATABASE_URL = os.getenv("FACULTY_DATABASE_URL", "sqlite:///./learning_platform.db")  # Adjust this URL as needed
 engine = create_engine(DATABASE_URL)
 
 # Create declarative base
@@ -18,7 +22,14 @@ class Document(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    content = Column(Text)
+    # Full extracted text; only loaded when accessed, so listings stay cheap however large documents are
+    content = deferred(Column(Text))
+    
+    # Listing metadata, maintained whenever the document or its chunks are written
+    chunk_count = Column(Integer, default=0)
+    content_length = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship to chunks
     chunks = relationship("DocumentChunk", back_populates="document")
@@ -30,6 +41,111 @@ class DocumentChunk(Base):
     document_id = Column(Integer, ForeignKey("documents.id"))
     chunk_index = Column(Integer)
     content = Column(Text)
+    content_hash = Column(String, index=True)
+    embedding = Column(LargeBinary)  # float32 vector, see document_processor.embedding_to_bytes
+    minhash = Column(LargeBinary)  # uint32 MinHash signature, see near_duplicates.compute_minhash
+    reduced_embedding = Column(LargeBinary)  # float16 PCA projection, see vector_reduction.reduce_vectors
     
     # Relationship to document
-    document = relationship("Document", back_populates="chunks")
\ No newline at end of file
+    document = relationship("Document", back_populates="chunks")
+    # Other documents that contain a near-duplicate of this chunk
+    references = relationship("ChunkReference", back_populates="chunk")
+
+class ChunkReference(Base):
+    """Back-reference from a document to a canonical chunk owned by another position or document."""
+    __tablename__ = "chunk_references"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    chunk_id = Column(Integer, ForeignKey("document_chunks.id"), index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    chunk_index = Column(Integer)
+    
+    chunk = relationship("DocumentChunk", back_populates="references")
+
+class ChunkLSHBand(Base):
+    """LSH bucket membership of a chunk's MinHash signature."""
+    __tablename__ = "chunk_lsh_bands"
+    
+    id = Column(Integer, primary_key=True)
+    chunk_id = Column(Integer, ForeignKey("document_chunks.id"), index=True)
+    band_key = Column(String, index=True)
+
+class DocumentSentence(Base):
+    """Sentence-sized retrieval unit; neighbours are found through sentence_index and char offsets."""
+    __tablename__ = "document_sentences"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    sentence_index = Column(Integer)
+    start_char = Column(Integer)
+    end_char = Column(Integer)
+    content = Column(Text)
+    embedding = Column(LargeBinary)
+    
+    __table_args__ = (Index("ix_document_sentences_position", "document_id", "sentence_index"),)
+
+class QuestionBankEntry(Base):
+    """Validated quiz question kept for reuse, indexed by document, topic and difficulty."""
+    __tablename__ = "quiz_question_bank"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"))
+    topic = Column(String)
+    difficulty = Column(String)
+    question = Column(Text)
+    options = Column(Text)  # JSON array of 4 options
+    correct_index = Column(Integer)
+    embedding = Column(LargeBinary)
+    
+    __table_args__ = (Index("ix_quiz_question_bank_lookup", "document_id", "topic", "difficulty"),)
+
+class DocumentSummary(Base):
+    """Precomputed summary node: one per section of consecutive chunks plus one for the whole document."""
+    __tablename__ = "document_summaries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    level = Column(String)  # "section" or "document"
+    node_index = Column(Integer)
+    start_chunk = Column(Integer)
+    end_chunk = Column(Integer)
+    source_hash = Column(String)  # hash of the summarized text, so unchanged sections are reused on update
+    content = Column(Text)
+    embedding = Column(LargeBinary)
+
+class DocumentCentroid(Base):
+    """Centroid of a cluster of a document's chunk embeddings, used to route queries to documents."""
+    __tablename__ = "document_centroids"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    centroid_index = Column(Integer)
+    embedding = Column(LargeBinary)
+
+class VectorProjection(Base):
+    """PCA projection fitted on the corpus' chunk embeddings, used for reduced-dimension search."""
+    __tablename__ = "vector_projections"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    dimensions = Column(Integer)
+    fitted_chunks = Column(Integer)
+    explained_variance = Column(Float)
+    mean = Column(LargeBinary)  # float32 vector
+    components = Column(LargeBinary)  # float32 matrix, dimensions x embedding size
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+def ensure_schema():
+    """Create missing tables and add columns that were introduced after a table was created."""
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            missing = [column for column in table.columns if column.name not in existing]
+            for column in missing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                print(f"Adding column {table.name}.{column.name}")
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            if missing:
+                for index in table.indexes:
+                    index.create(bind=connection, checkfirst=True)
\ No newline at end of file
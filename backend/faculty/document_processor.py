@@ -1,37 +1,49 @@
 import os
-from typing import List, BinaryIO
-import PyPDF2
-import docx
+import atexit
+import hashlib
+from typing import List, BinaryIO, Dict, Optional, Tuple
+import numpy as np
 import re
+from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
-from db_setup import SessionLocal, Document, DocumentChunk
-from db_setup import Base, engine
+from db_setup import SessionLocal, Document, DocumentChunk, ChunkReference, QuestionBankEntry
+from db_setup import ensure_schema
+from embedding_cache import EmbeddingCache
+from retrieval_cache import RetrievalCache
+from vector_reduction import reduce_vectors
+from text_extraction import extract_text
+from near_duplicates import (
+    NEAR_DUPLICATE_DETECTION, compute_minhash, find_near_duplicate,
+    index_chunk_signature, remove_chunk_signature
+)
 from functools import lru_cache
 
+# Load environment variables
+load_dotenv()
+
 # Initialize database tables
-Base.metadata.create_all(engine)
+ensure_schema()
 
 # Load embedding model (using sentence-transformers instead of OpenAI)
-model = SentenceTransformer('all-MiniLM-L6-v2')
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+# Cache embeddings so repeated queries and quiz topics skip model inference
+embedding_cache = EmbeddingCache(
+    model_id=EMBEDDING_MODEL_NAME,
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "5000")),
+    persist_path=os.getenv("EMBEDDING_CACHE_PATH") or None
+)
+atexit.register(embedding_cache.save)
+
+# Memoize retrieval results; any write to the chunk index must call retrieval_cache.bump_generation()
+# after committing, which invalidates every entry
+retrieval_cache = RetrievalCache(max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1000")))
+
 @lru_cache(maxsize=1000)
 def extract_text_from_file(file: BinaryIO, filename: str) -> str:
     """Extract text from uploaded files based on file type."""
-    if filename.endswith('.pdf'):
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    elif filename.endswith('.docx'):
-        doc = docx.Document(file)
-        text = ""
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-        return text
-    elif filename.endswith('.txt'):
-        return file.read().decode('utf-8')
-    else:
-        raise ValueError(f"Unsupported file format: {filename}")
+    return extract_text(file, filename)
 
 def split_text_into_chunks(text: str, chunk_size: int = 1000, overlap: int = 150) -> List[str]:
     """Split text into overlapping chunks with a smaller size."""
@@ -98,13 +110,147 @@ def split_text_into_chunks(text: str, chunk_size: int = 1000, overlap: int = 150
 
 def generate_embedding(text: str) -> List[float]:
     """Generate embedding vector for text using sentence-transformers with caching."""
+    cached = embedding_cache.get(text)
+    if cached is not None:
+        return cached
     try:
-        return model.encode(text).tolist()
+        embedding = model.encode(text).tolist()
+        embedding_cache.put(text, embedding)
+        return embedding
     except Exception as e:
         print(f"Error generating embedding: {str(e)}")
         # Return a zero vector as fallback
         return [0.0] * 384  # Default dimension for 'all-MiniLM-L6-v2'
 
+def generate_embeddings(texts: List[str]) -> List[List[float]]:
+    """Generate embeddings for many texts in one batched model call."""
+    if not texts:
+        return []
+    try:
+        return model.encode(texts).tolist()
+    except Exception as e:
+        print(f"Error generating batch embeddings: {str(e)}")
+        return [generate_embedding(text) for text in texts]
+
+def embedding_to_bytes(embedding: List[float]) -> bytes:
+    """Serialize an embedding as float32 bytes for storage."""
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def bytes_to_embedding(data: bytes) -> List[float]:
+    """Deserialize an embedding stored by embedding_to_bytes."""
+    return np.frombuffer(data, dtype=np.float32).tolist()
+
+def get_chunk_embedding(chunk: DocumentChunk) -> List[float]:
+    """Return the stored embedding for a chunk, embedding it on the fly for chunks stored without one."""
+    if chunk.embedding:
+        return bytes_to_embedding(chunk.embedding)
+    return generate_embedding(chunk.content)
+
+def compute_content_hash(text: str) -> str:
+    """Hash chunk content so unchanged chunks can be recognised across document versions."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def get_document_chunks(db, document_id: int) -> List[Tuple[DocumentChunk, int]]:
+    """Return (chunk, position) pairs for every chunk of a document, including shared near-duplicates."""
+    occurrences = [
+        (chunk, chunk.chunk_index)
+        for chunk in db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).all()
+    ]
+    references = db.query(ChunkReference).filter(ChunkReference.document_id == document_id).all()
+    occurrences.extend((reference.chunk, reference.chunk_index) for reference in references)
+    occurrences.sort(key=lambda occurrence: occurrence[1])
+    return occurrences
+
+def get_chunk_sources(db, chunk_ids: List[int]) -> Dict[int, List[int]]:
+    """Map canonical chunk ids to every document that contains them."""
+    sources = {}
+    if not chunk_ids:
+        return sources
+    for chunk in db.query(DocumentChunk.id, DocumentChunk.document_id).filter(DocumentChunk.id.in_(chunk_ids)).all():
+        sources.setdefault(chunk.id, []).append(chunk.document_id)
+    for reference in db.query(ChunkReference).filter(ChunkReference.chunk_id.in_(chunk_ids)).all():
+        if reference.document_id not in sources.setdefault(reference.chunk_id, []):
+            sources[reference.chunk_id].append(reference.document_id)
+    return sources
+
+def index_new_chunks(db, document_id: int, new_chunks: List[Tuple[int, str]],
+                     pending_embeddings: Optional[List[DocumentChunk]] = None) -> Dict[str, int]:
+    """Add (position, text) chunks to a document, linking near-duplicates of indexed chunks instead of storing them.
+
+    New canonical chunks are embedded before returning, unless a pending_embeddings list is given, in which case
+    they are appended to it so the caller can embed chunks of many documents in one batch before committing.
+    """
+    created = []
+    linked = 0
+    for chunk_index, chunk_text in new_chunks:
+        signature = compute_minhash(chunk_text) if NEAR_DUPLICATE_DETECTION else None
+        if signature is not None:
+            duplicate = find_near_duplicate(db, signature)
+            if duplicate:
+                canonical, similarity = duplicate
+                print(f"Chunk {chunk_index} is a near-duplicate of chunk {canonical.id} (similarity {similarity:.2f})")
+                db.add(ChunkReference(chunk_id=canonical.id, document_id=document_id, chunk_index=chunk_index))
+                linked += 1
+                continue
+
+        chunk = DocumentChunk(
+            document_id=document_id,
+            chunk_index=chunk_index,
+            content=chunk_text,
+            content_hash=compute_content_hash(chunk_text)
+        )
+        db.add(chunk)
+        db.flush()  # Assign an id so later chunks in this batch can be matched against it
+        if signature is not None:
+            index_chunk_signature(db, chunk, signature)
+        created.append(chunk)
+
+    # Embed only canonical chunks, in one batch
+    if pending_embeddings is not None:
+        pending_embeddings.extend(created)
+    else:
+        embed_chunks(created)
+
+    return {"chunks_added": len(created), "duplicates_linked": linked}
+
+def embed_chunks(chunks: List[DocumentChunk]) -> None:
+    """Embed chunks in one batch and store the vectors on them."""
+    embeddings = generate_embeddings([chunk.content for chunk in chunks])
+    for chunk, embedding in zip(chunks, embeddings):
+        chunk.embedding = embedding_to_bytes(embedding)
+    # Keep reduced vectors in step once a projection has been fitted
+    reduced = reduce_vectors(embeddings)
+    if reduced:
+        for chunk, vector in zip(chunks, reduced):
+            chunk.reduced_embedding = vector
+
+def release_chunk(db, chunk: DocumentChunk) -> None:
+    """Remove a chunk from its owning document, handing it over to another document that shares it."""
+    reference = db.query(ChunkReference).filter(ChunkReference.chunk_id == chunk.id).order_by(ChunkReference.id).first()
+    if reference:
+        chunk.document_id = reference.document_id
+        chunk.chunk_index = reference.chunk_index
+        db.delete(reference)
+    else:
+        remove_chunk_signature(db, chunk.id)
+        db.delete(chunk)
+
+def remove_document_chunks(db, document_id: int) -> None:
+    """Remove every chunk occurrence of a document, keeping chunks still shared by other documents."""
+    db.query(ChunkReference).filter(ChunkReference.document_id == document_id).delete(synchronize_session=False)
+    for chunk in db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).all():
+        release_chunk(db, chunk)
+
+def build_summaries(document_id: int) -> None:
+    """Build the optional summary tree of a stored document; failures are logged, not raised."""
+    from summary_tree import SUMMARY_TREE_ENABLED, build_summary_tree
+    if not SUMMARY_TREE_ENABLED:
+        return
+    try:
+        build_summary_tree(document_id)
+    except Exception as e:
+        print(f"ERROR building summary tree for document ID {document_id}: {str(e)}")
+
 def process_document(file: BinaryIO, filename: str, title: str) -> int:
     """Process document, extract text, and store chunks without using Pinecone."""
     try:
@@ -120,7 +266,7 @@ def process_document(file: BinaryIO, filename: str, title: str) -> int:
         print("Creating document in database...")
         db = SessionLocal()
         try:
-            document = Document(title=title, content=text)
+            document = Document(title=title, content=text, content_length=len(text))
             db.add(document)
             db.commit()
             db.refresh(document)
@@ -136,6 +282,14 @@ def process_document(file: BinaryIO, filename: str, title: str) -> int:
             store_full_chunks(document.id, chunks)
             print("Chunks stored successfully")
             
+            # Build the optional sentence-level index used by sentence-window retrieval
+            from sentence_index import SENTENCE_INDEX_ENABLED, index_document_sentences
+            if SENTENCE_INDEX_ENABLED:
+                index_document_sentences(document.id, text)
+            
+            # Build the optional summary tree used to answer broad questions
+            build_summaries(document.id)
+            
             return document.id
         finally:
             db.close()
@@ -145,29 +299,122 @@ def process_document(file: BinaryIO, filename: str, title: str) -> int:
         traceback.print_exc()
         raise  # Re-raise the exception to be caught by the endpoint handler
 
+def update_document(document_id: int, file: BinaryIO, filename: str, title: Optional[str] = None) -> Optional[Dict[str, int]]:
+    """Replace a document with a new version, re-embedding only chunks whose content changed.
+
+    Returns re-indexing statistics, or None if the document does not exist.
+    """
+    print(f"Starting to update document ID {document_id} from {filename}")
+    text = extract_text_from_file(file, filename)
+    print(f"Extracted text length: {len(text)} characters")
+
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document:
+            print(f"Document ID {document_id} not found")
+            return None
+
+        new_chunks = split_text_into_chunks(text, chunk_size=1000, overlap=150)
+        new_hashes = [compute_content_hash(chunk) for chunk in new_chunks]
+
+        # Pool existing occurrences (owned chunks and shared references) by content hash,
+        # so identical chunks can be reused at their new position
+        existing_by_hash = {}
+        for chunk in db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).all():
+            content_hash = chunk.content_hash or compute_content_hash(chunk.content)
+            existing_by_hash.setdefault(content_hash, []).append(chunk)
+        for reference in db.query(ChunkReference).filter(ChunkReference.document_id == document_id).all():
+            chunk = reference.chunk
+            content_hash = chunk.content_hash or compute_content_hash(chunk.content)
+            existing_by_hash.setdefault(content_hash, []).append(reference)
+
+        reused = 0
+        added = []
+        for i, (chunk_text, content_hash) in enumerate(zip(new_chunks, new_hashes)):
+            pool = existing_by_hash.get(content_hash)
+            if pool:
+                occurrence = pool.pop()
+                occurrence.chunk_index = i
+                reused += 1
+            else:
+                added.append((i, chunk_text))
+
+        # Drop stale references before releasing owned chunks, so a chunk is never handed to a removed reference
+        stale = [occurrence for pool in existing_by_hash.values() for occurrence in pool]
+        for occurrence in stale:
+            if isinstance(occurrence, ChunkReference):
+                db.delete(occurrence)
+        db.flush()
+        for occurrence in stale:
+            if isinstance(occurrence, DocumentChunk):
+                release_chunk(db, occurrence)
+
+        print(f"Re-indexing {len(added)} changed chunks ({reused} reused, {len(stale)} removed)")
+        index_stats = index_new_chunks(db, document_id, added)
+
+        document.content = text
+        document.content_length = len(text)
+        document.chunk_count = len(new_chunks)
+        if title:
+            document.title = title
+        
+        # Banked quiz questions were written against the old version
+        db.query(QuestionBankEntry).filter(QuestionBankEntry.document_id == document_id).delete(synchronize_session=False)
+        db.flush()
+        from document_router import update_document_centroids
+        update_document_centroids(db, document_id)
+        db.commit()
+        retrieval_cache.bump_generation()
+        from question_bank import forget_saturated_topics
+        forget_saturated_topics(document_id)
+
+        from sentence_index import SENTENCE_INDEX_ENABLED, index_document_sentences
+        if SENTENCE_INDEX_ENABLED:
+            index_document_sentences(document_id, text)
+
+        # Only sections whose text changed are summarized again
+        build_summaries(document_id)
+
+        return {
+            "document_id": document_id,
+            "chunks_total": len(new_chunks),
+            "chunks_reused": reused,
+            "chunks_added": index_stats["chunks_added"],
+            "duplicates_linked": index_stats["duplicates_linked"],
+            "chunks_removed": len(stale)
+        }
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR in update_document: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise
+    finally:
+        db.close()
+
 def store_full_chunks(document_id: int, chunks: List[str]) -> None:
     """Store full text chunks in database for retrieval."""
     print(f"Storing {len(chunks)} chunks for document ID {document_id}")
     
     db = SessionLocal()
     try:
-        # Delete any existing chunks for this document
+        # Remove any existing chunks for this document
         print(f"Deleting existing chunks for document ID {document_id}")
-        db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
+        remove_document_chunks(db, document_id)
         
-        # Insert new chunks
+        # Insert new chunks, embedding canonical ones in one batch so retrieval never has to re-embed them
         print("Inserting new chunks...")
-        for i, chunk in enumerate(chunks):
-            print(f"Creating chunk record {i+1}/{len(chunks)} with length {len(chunk)}")
-            chunk_record = DocumentChunk(
-                document_id=document_id,
-                chunk_index=i,
-                content=chunk
-            )
-            db.add(chunk_record)
+        stats = index_new_chunks(db, document_id, list(enumerate(chunks)))
+        print(f"Added {stats['chunks_added']} chunks, linked {stats['duplicates_linked']} near-duplicates")
+        db.query(Document).filter(Document.id == document_id).update({Document.chunk_count: len(chunks)})
+        db.flush()
+        from document_router import update_document_centroids
+        update_document_centroids(db, document_id)
         
         print("Committing chunks to database...")
         db.commit()
+        retrieval_cache.bump_generation()
         print("Chunks committed successfully")
     except Exception as e:
         db.rollback()
@@ -178,6 +425,42 @@ def store_full_chunks(document_id: int, chunks: List[str]) -> None:
     finally:
         db.close()
 
+def cosine_similarities(query_embedding: List[float], matrix: np.ndarray) -> np.ndarray:
+    """Calculate cosine similarity between one vector and every row of a matrix."""
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = 1.0
+    return (matrix @ query) / norms
+
+def maximal_marginal_relevance(query_embedding: List[float], candidates: np.ndarray, k: int,
+                               diversity: float = 0.3, redundancy_threshold: Optional[float] = None) -> List[int]:
+    """Select up to k candidate rows balancing relevance to the query against similarity to rows already selected.
+
+    diversity=0 ranks purely by relevance, diversity=1 purely by novelty. Candidates whose similarity to a
+    selected row reaches redundancy_threshold are dropped, so fewer than k rows may be returned.
+    """
+    if len(candidates) == 0 or k <= 0:
+        return []
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = candidates / norms
+    relevance = cosine_similarities(query_embedding, candidates)
+    pairwise = vectors @ vectors.T
+
+    selected = []
+    available = np.ones(len(candidates), dtype=bool)
+    max_similarity = np.zeros(len(candidates), dtype=np.float32)
+    while len(selected) < k and available.any():
+        scores = relevance if not selected else (1 - diversity) * relevance - diversity * max_similarity
+        scores = np.where(available, scores, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, pairwise[best])
+        if redundancy_threshold is not None:
+            available &= max_similarity < redundancy_threshold
+    return selected
+
 def cosine_similarity(vec1, vec2):
     """Calculate cosine similarity between two vectors."""
     dot_product = sum(a*b for a, b in zip(vec1, vec2))
@@ -0,0 +1,105 @@
+import os
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from db_setup import Document, DocumentCentroid
+from document_processor import get_document_chunks, get_chunk_embedding, embedding_to_bytes
+
+# Load environment variables
+load_dotenv()
+
+# Route queries to the documents whose centroids are closest before scoring chunks
+DOCUMENT_ROUTING = os.getenv("DOCUMENT_ROUTING", "1") == "1"
+ROUTING_TOP_DOCUMENTS = int(os.getenv("ROUTING_TOP_DOCUMENTS", "20"))
+# Search every chunk when the routed documents yield fewer candidates than results requested
+ROUTING_FALLBACK = os.getenv("ROUTING_FALLBACK", "1") == "1"
+# One centroid per this many chunks, up to MAX_DOCUMENT_CENTROIDS, so long documents covering
+# several subjects are not averaged into a single vector that matches none of them
+CHUNKS_PER_CENTROID = int(os.getenv("CHUNKS_PER_CENTROID", "20"))
+MAX_DOCUMENT_CENTROIDS = int(os.getenv("MAX_DOCUMENT_CENTROIDS", "4"))
+
+KMEANS_ITERATIONS = 10
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def compute_centroids(embeddings: np.ndarray, k: int) -> List[np.ndarray]:
+    """Cluster unit-normalized embeddings with spherical k-means and return the cluster centroids.
+
+    Seeds are picked farthest-first from the mean direction, so results are deterministic.
+    """
+    vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+    k = max(1, min(k, len(vectors)))
+    if k == 1:
+        return [vectors.mean(axis=0)]
+
+    seeds = [int(np.argmax(vectors @ vectors.mean(axis=0)))]
+    while len(seeds) < k:
+        closest = (vectors @ vectors[seeds].T).max(axis=1)
+        seeds.append(int(np.argmin(closest)))
+    centroids = vectors[seeds]
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        updated = np.vstack([
+            vectors[assignment == i].mean(axis=0) if np.any(assignment == i) else centroids[i]
+            for i in range(k)
+        ])
+        updated = _normalize(updated)
+        if np.allclose(updated, centroids, atol=1e-5):
+            break
+        centroids = updated
+    return list(centroids)
+
+
+def update_document_centroids(db, document_id: int) -> int:
+    """Recompute a document's centroids from all of its chunk occurrences; the caller commits."""
+    db.query(DocumentCentroid).filter(DocumentCentroid.document_id == document_id).delete(synchronize_session=False)
+    chunks = get_document_chunks(db, document_id)
+    if not chunks:
+        return 0
+
+    embeddings = np.asarray([get_chunk_embedding(chunk) for chunk, _ in chunks], dtype=np.float32)
+    k = min(MAX_DOCUMENT_CENTROIDS, -(-len(chunks) // CHUNKS_PER_CENTROID))
+    centroids = compute_centroids(embeddings, k)
+    for i, centroid in enumerate(centroids):
+        db.add(DocumentCentroid(document_id=document_id, centroid_index=i, embedding=embedding_to_bytes(centroid)))
+    return len(centroids)
+
+
+def route_documents(db, query_embedding: List[float], top_n: Optional[int] = None) -> Optional[List[int]]:
+    """Return the ids of the top_n documents closest to the query, by their best centroid.
+
+    Returns None when routing would not narrow the search: routing is disabled, the corpus
+    has no more than top_n documents, or some documents have no centroids yet.
+    """
+    top_n = top_n or ROUTING_TOP_DOCUMENTS
+    if not DOCUMENT_ROUTING:
+        return None
+    rows = db.query(DocumentCentroid.document_id, DocumentCentroid.embedding).all()
+    document_ids = np.asarray([row.document_id for row in rows])
+    unique_ids = np.unique(document_ids)
+    if len(unique_ids) <= top_n or len(unique_ids) < db.query(Document.id).filter(Document.chunk_count > 0).count():
+        return None
+
+    matrix = _normalize(np.vstack([np.frombuffer(row.embedding, dtype=np.float32) for row in rows]))
+    query = np.asarray(query_embedding, dtype=np.float32)
+    scores = matrix @ (query / (np.linalg.norm(query) or 1))
+
+    # Best centroid score per document
+    best = np.full(len(unique_ids), -np.inf, dtype=np.float32)
+    np.maximum.at(best, np.searchsorted(unique_ids, document_ids), scores)
+    top = np.argsort(-best)[:top_n]
+    return [int(unique_ids[i]) for i in top]
+
+
+def routing_stats(db) -> Dict[str, int]:
+    """Report how many documents have centroids and how many centroids there are."""
+    return {
+        "routed_documents": db.query(DocumentCentroid.document_id).distinct().count(),
+        "centroids": db.query(DocumentCentroid).count(),
+        "routing_top_documents": ROUTING_TOP_DOCUMENTS if DOCUMENT_ROUTING else 0,
+    }
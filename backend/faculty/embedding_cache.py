@@ -0,0 +1,117 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class EmbeddingCache:
+    """Bounded LRU cache of embedding vectors keyed by model id and normalized text."""
+
+    def __init__(self, model_id: str, max_entries: int = 5000, persist_path: Optional[str] = None):
+        self.model_id = model_id
+        self.max_entries = max(1, max_entries)
+        self.persist_path = persist_path
+        # Vectors are held as tuples and copied out, so callers can't mutate a cached entry
+        self._entries: "OrderedDict[str, Tuple[float, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if persist_path:
+            self.load()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Collapse whitespace and lowercase (MiniLM is uncased, so casing never changes the vector)."""
+        return re.sub(r'\s+', ' ', text).strip().lower()
+
+    def make_key(self, text: str) -> str:
+        """Hash the model id together with the normalized text."""
+        payload = f"{self.model_id}\x00{self.normalize(text)}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Return the cached vector for text, or None on a miss."""
+        key = self.make_key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(vector)
+
+    def put(self, text: str, vector: List[float]) -> None:
+        """Store a vector, evicting the least recently used entries beyond the bound."""
+        key = self.make_key(text)
+        with self._lock:
+            self._entries[key] = tuple(vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all entries and reset statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Return size and hit-rate statistics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model_id": self.model_id,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def load(self) -> int:
+        """Load persisted entries for this model id; returns the number loaded."""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return 0
+        try:
+            with open(self.persist_path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            print(f"Could not load embedding cache from {self.persist_path}: {str(e)}")
+            return 0
+
+        if data.get("model_id") != self.model_id:
+            print(f"Ignoring embedding cache built for model {data.get('model_id')}")
+            return 0
+
+        with self._lock:
+            # Entries are saved oldest first, so replaying them restores LRU order
+            for key, vector in data.get("entries", [])[-self.max_entries:]:
+                self._entries[key] = tuple(vector)
+            loaded = len(self._entries)
+        print(f"Loaded {loaded} cached embeddings from {self.persist_path}")
+        return loaded
+
+    def save(self) -> None:
+        """Persist entries to disk atomically, if a persist path is configured."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            data = {"model_id": self.model_id, "entries": list(self._entries.items())}
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.persist_path)
+            print(f"Saved {len(data['entries'])} cached embeddings to {self.persist_path}")
+        except Exception as e:
+            print(f"Could not save embedding cache to {self.persist_path}: {str(e)}")
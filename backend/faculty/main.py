@@ -1,16 +1,26 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
+import tempfile
 from dotenv import load_dotenv
 from typing import List, Dict, Optional
 import traceback
 
 # Import our modules
-from db_setup import SessionLocal, Document, DocumentChunk, Base, engine
-from document_processor import process_document
-from quiz_generator import QuizQuestion, generate_quiz_for_document
-from rag_chatbot import ChatMessage, ChatResponse, chat_with_documents
+from db_setup import (
+    SessionLocal, Document, DocumentChunk, ChunkReference, ChunkLSHBand, DocumentSentence, QuestionBankEntry,
+    DocumentSummary, DocumentCentroid, VectorProjection, ensure_schema
+)
+from document_processor import process_document, update_document, embedding_cache, retrieval_cache
+from bulk_ingest import ingest_documents
+from near_duplicates import dedup_stats
+from document_router import routing_stats
+from vector_reduction import fit_projection, reduction_report
+from summary_tree import build_summary_tree, get_document_summary
+from corpus_snapshot import SnapshotError, export_corpus, import_corpus
+from quiz_generator import QuizQuestion, DIFFICULTIES, generate_quiz_for_document, get_quiz_from_bank
+from rag_chatbot import ChatMessage, ChatResponse, chat_in_conversation, conversation_store, RETRIEVAL_MODES
 
 # Load environment variables
 load_dotenv()
@@ -23,6 +33,7 @@ app.config['JSON_SORT_KEYS'] = False  # Maintain the order of JSON keys in respo
 CORS(app, origins=["http://localhost:3000", "http://localhost:5173", "http://localhost:8080"], 
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
      allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
+     expose_headers=["X-Total-Count", "X-Page", "X-Page-Size"],
      supports_credentials=True)
 
 # Create a function to get database session (similar to FastAPI's dependency)
@@ -45,22 +56,26 @@ def close_db(exception=None):
 # Use Flask 2.0+ approach with app context instead of before_first_request
 def setup_database():
     # Create SQL tables
-    Base.metadata.create_all(bind=engine)
+    ensure_schema()
 
     # Delete all documents and related chunks at startup
     db = SessionLocal()
     try:
+        db.query(VectorProjection).delete()
+        db.query(QuestionBankEntry).delete()
+        db.query(DocumentSummary).delete()
+        db.query(DocumentCentroid).delete()
+        db.query(DocumentSentence).delete()
+        db.query(ChunkLSHBand).delete()
+        db.query(ChunkReference).delete()
         db.query(DocumentChunk).delete()
         db.query(Document).delete()
         db.commit()
+        retrieval_cache.bump_generation()
         print("All documents and chunks deleted at startup.")
     finally:
         db.close()
 
-# Call setup_database with app context
-with app.app_context():
-    setup_database()
-
 # Document upload endpoint
 @app.route('/upload-document', methods=['POST'])
 def upload_document():
@@ -89,13 +104,133 @@ def upload_document():
         traceback.print_exc()
         return jsonify({"error": f"Error processing document: {str(e)}"}), 500
 
-# Get all documents endpoint
+# Bulk upload endpoint: many files per request, extracted in parallel and written in grouped transactions
+@app.route('/upload-documents', methods=['POST'])
+def upload_documents():
+    try:
+        files = request.files.getlist('files')
+        titles = request.form.getlist('titles')
+        
+        if not files:
+            return jsonify({"error": "No files provided"}), 400
+        
+        if titles and len(titles) != len(files):
+            return jsonify({"error": "Provide one title per file, or none to use the file names"}), 400
+        
+        uploads = []
+        for i, file in enumerate(files):
+            if file.filename == '':
+                return jsonify({"error": "No selected file"}), 400
+            title = titles[i] if titles and titles[i] else os.path.splitext(file.filename)[0]
+            uploads.append((file.filename, title, file.read()))
+        
+        results = ingest_documents(uploads)
+        processed = sum(1 for result in results if result["status"] == "processed")
+        
+        return jsonify({
+            "message": f"Processed {processed} of {len(results)} documents",
+            "processed": processed,
+            "failed": len(results) - processed,
+            "documents": results
+        })
+    except Exception as e:
+        print(f"Error in upload_documents: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": f"Error processing documents: {str(e)}"}), 500
+
+# Update document endpoint: only chunks whose content changed are re-embedded
+@app.route('/documents/<int:document_id>', methods=['PUT'])
+def update_document_endpoint(document_id):
+    try:
+        if 'file' not in request.files:
+            return jsonify({"error": "No file part"}), 400
+        
+        file = request.files['file']
+        title = request.form.get('title')
+        
+        if file.filename == '':
+            return jsonify({"error": "No selected file"}), 400
+        
+        stats = update_document(document_id, file, file.filename, title)
+        if stats is None:
+            return jsonify({"error": "Document not found"}), 404
+        
+        return jsonify({"message": "Document updated successfully", **stats})
+    except Exception as e:
+        print(f"Error in update_document: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": f"Error updating document: {str(e)}"}), 500
+
+# Document summary tree endpoints: GET returns the stored tree, POST builds (or refreshes) it
+@app.route('/documents/<int:document_id>/summary', methods=['GET'])
+def get_document_summary_endpoint(document_id):
+    summary = get_document_summary(document_id)
+    if summary is None:
+        return jsonify({"error": "No summary has been built for this document"}), 404
+    return jsonify(summary)
+
+@app.route('/documents/<int:document_id>/summary', methods=['POST'])
+def build_document_summary_endpoint(document_id):
+    try:
+        stats = build_summary_tree(document_id)
+        if not stats["sections"]:
+            return jsonify({"error": "Document not found or empty"}), 404
+        return jsonify({"message": "Summary tree built", **stats})
+    except Exception as e:
+        print(f"Error in build_document_summary: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": f"Error building summary: {str(e)}"}), 500
+
+# List documents endpoint: filterable by title, and paginated when page or page_size is given
+# (without them every match is returned, as before). The body stays a plain list; pagination
+# metadata is returned in the X-Total-Count, X-Page and X-Page-Size headers
+DOCUMENTS_PAGE_SIZE = 100
+DOCUMENTS_MAX_PAGE_SIZE = 500
+
 @app.route('/documents', methods=['GET'])
 def get_documents():
+    paginated = 'page' in request.args or 'page_size' in request.args
+    try:
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('page_size', DOCUMENTS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "page and page_size must be integers"}), 400
+    if page < 1 or not 1 <= page_size <= DOCUMENTS_MAX_PAGE_SIZE:
+        return jsonify({"error": f"page must be >= 1 and page_size between 1 and {DOCUMENTS_MAX_PAGE_SIZE}"}), 400
+    
     db = get_db()
     try:
-        documents = db.query(Document).all()
-        return jsonify([{"id": doc.id, "title": doc.title} for doc in documents])
+        # Select only listing columns so the extracted text is never read
+        query = db.query(
+            Document.id, Document.title, Document.chunk_count, Document.content_length,
+            Document.created_at, Document.updated_at
+        )
+        title = request.args.get('title')
+        if title:
+            # Match the title literally, so % and _ in it are not wildcards
+            escaped = title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.filter(Document.title.ilike(f"%{escaped}%", escape="\\"))
+        query = query.order_by(Document.id)
+        if paginated:
+            total = query.count()
+            documents = query.offset((page - 1) * page_size).limit(page_size).all()
+        else:
+            documents = query.all()
+            total = len(documents)
+        
+        response = jsonify([{
+            "id": doc.id,
+            "title": doc.title,
+            "chunk_count": doc.chunk_count,
+            "content_length": doc.content_length,
+            "created_at": doc.created_at.isoformat() if doc.created_at else None,
+            "updated_at": doc.updated_at.isoformat() if doc.updated_at else None,
+        } for doc in documents])
+        response.headers["X-Total-Count"] = str(total)
+        if paginated:
+            response.headers["X-Page"] = str(page)
+            response.headers["X-Page-Size"] = str(page_size)
+        return response
     finally:
         db.close()
 
@@ -104,12 +239,24 @@ def get_documents():
 def generate_quiz():
     data = request.json
     doc_id = data.get('doc_id')
+    mode = data.get('mode', 'generate')
+    difficulty = data.get('difficulty', 'medium')
     
     if not doc_id:
         return jsonify({"error": "Document ID is required"}), 400
     
-    print(f"Received quiz generation request for document ID: {doc_id}")
-    quiz = generate_quiz_for_document(doc_id)
+    if mode not in ('generate', 'bank'):
+        return jsonify({"error": "mode must be 'generate' or 'bank'"}), 400
+    
+    if difficulty not in DIFFICULTIES:
+        return jsonify({"error": f"difficulty must be one of: {', '.join(DIFFICULTIES)}"}), 400
+    
+    print(f"Received quiz generation request for document ID: {doc_id} (mode={mode}, difficulty={difficulty})")
+    if mode == 'bank':
+        # Serve from previously validated questions, generating only for topics that run low
+        quiz = get_quiz_from_bank(doc_id, difficulty=difficulty)
+    else:
+        quiz = generate_quiz_for_document(doc_id, difficulty=difficulty)
     
     if not quiz:
         return jsonify({"error": "Could not generate quiz for this document."}), 404
@@ -168,12 +315,21 @@ def chat():
     try:
         data = request.json
         user_message = data.get('message')
+        conversation_id = data.get('conversation_id') or conversation_store.new_id()
         conversation_history = data.get('conversation_history', [])
+        retrieval_mode = data.get('retrieval_mode')
+        time_budget = data.get('time_budget_seconds')
         
         if not user_message:
             return jsonify({"error": "Message is required"}), 400
         
-        # Convert the list of dictionaries to ChatMessage objects
+        if retrieval_mode and retrieval_mode not in RETRIEVAL_MODES:
+            return jsonify({"error": f"retrieval_mode must be one of: {', '.join(RETRIEVAL_MODES)}"}), 400
+        
+        if time_budget is not None and (not isinstance(time_budget, (int, float)) or time_budget < 0):
+            return jsonify({"error": "time_budget_seconds must be a non-negative number"}), 400
+        
+        # History sent by the client only seeds a conversation the server doesn't know yet
         if conversation_history:
             conversation_history = [ChatMessage(**msg) for msg in conversation_history]
         
@@ -182,13 +338,19 @@ def chat():
         import asyncio
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-        response = loop.run_until_complete(chat_with_documents(user_message, conversation_history))
+        response = loop.run_until_complete(
+            chat_in_conversation(conversation_id, user_message, retrieval_mode, seed_history=conversation_history,
+                                 time_budget=time_budget)
+        )
         loop.close()
         
         # Convert ChatResponse to dict for JSON serialization
         response_dict = {
             "response": response.response,
-            "sources": response.sources
+            "sources": response.sources,
+            "context_stats": response.context_stats,
+            "conversation_id": response.conversation_id,
+            "stages": response.stages
         }
             
         return jsonify(response_dict)
@@ -196,9 +358,104 @@ def chat():
         traceback.print_exc()
         return jsonify({"error": f"Error processing chat: {str(e)}"}), 500
 
+# Conversation endpoints: stored history of a /chat conversation, and deleting it
+@app.route('/chat/<conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    history = conversation_store.get_history(conversation_id)
+    if not history:
+        return jsonify({"error": "Conversation not found"}), 404
+    return jsonify({
+        "conversation_id": conversation_id,
+        "messages": [{"role": role, "content": content} for role, content in history]
+    })
+
+@app.route('/chat/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    if not conversation_store.delete(conversation_id):
+        return jsonify({"error": "Conversation not found"}), 404
+    return jsonify({"message": "Conversation deleted"})
+
+@app.route('/chat/stats', methods=['GET'])
+def get_conversation_stats():
+    return jsonify(conversation_store.stats())
+
+# Corpus snapshot endpoints: export the whole corpus, or restore one without re-embedding
+@app.route('/corpus/export', methods=['GET'])
+def export_corpus_endpoint():
+    try:
+        fd, path = tempfile.mkstemp(suffix=".snap")
+        os.close(fd)
+        export_corpus(path)
+        response = send_file(path, mimetype="application/octet-stream", as_attachment=True,
+                             download_name="corpus.snap")
+        response.call_on_close(lambda: os.remove(path))
+        return response
+    except Exception as e:
+        print(f"Error in export_corpus: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": f"Error exporting corpus: {str(e)}"}), 500
+
+@app.route('/corpus/import', methods=['POST'])
+def import_corpus_endpoint():
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    
+    replace = request.form.get('replace', 'true').lower() != 'false'
+    fd, path = tempfile.mkstemp(suffix=".snap")
+    os.close(fd)
+    try:
+        request.files['file'].save(path)
+        counts = import_corpus(path, replace=replace)
+        return jsonify({"message": "Corpus imported successfully", **counts})
+    except SnapshotError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error in import_corpus: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": f"Error importing corpus: {str(e)}"}), 500
+    finally:
+        os.remove(path)
+
+# Embedding cache statistics endpoint
+@app.route('/embedding-cache/stats', methods=['GET'])
+def get_embedding_cache_stats():
+    return jsonify(embedding_cache.stats())
+
+# Retrieval memo statistics endpoint
+@app.route('/retrieval-cache/stats', methods=['GET'])
+def get_retrieval_cache_stats():
+    return jsonify(retrieval_cache.stats())
+
+# Index statistics endpoint
+@app.route('/index/stats', methods=['GET'])
+def get_index_stats():
+    db = get_db()
+    try:
+        return jsonify({**dedup_stats(db), **routing_stats(db)})
+    finally:
+        db.close()
+
+# Fit the PCA projection used for first-stage search, or report its memory saving and recall loss
+@app.route('/index/reduction', methods=['GET', 'POST'])
+def index_reduction():
+    if request.method == 'GET':
+        return jsonify(reduction_report(
+            sample_queries=request.args.get('queries', 200, type=int), k=request.args.get('k', 10, type=int)
+        ))
+    data = request.get_json(silent=True) or {}
+    try:
+        projection = fit_projection(data.get('dimensions'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    retrieval_cache.bump_generation()
+    return jsonify({"projection": projection, "report": reduction_report()})
+
 @app.route('/')
 def index():
     return jsonify({"message": "Learning Platform API with Flask and Groq"})
 
 if __name__ == '__main__':
+    # Wipe only when started as the server; spawned bulk-ingest workers re-import this module
+    with app.app_context():
+        setup_database()
     app.run(debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from db_setup import DocumentChunk, ChunkLSHBand, ChunkReference
+
+# Load environment variables
+load_dotenv()
+
+NEAR_DUPLICATE_DETECTION = os.getenv("NEAR_DUPLICATE_DETECTION", "1") == "1"
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows put the LSH candidate threshold near Jaccard 0.7, below the confirmation threshold
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """Hash the word shingles of normalized text to 32-bit integers."""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def compute_minhash(text: str) -> np.ndarray:
+    """Compute a MinHash signature of the text's shingle set."""
+    hashes = shingle_hashes(text)
+    # Both operands stay below 2**32, so the products fit in uint64 without wrapping
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def minhash_to_bytes(signature: np.ndarray) -> bytes:
+    return signature.astype(np.uint32).tobytes()
+
+
+def bytes_to_minhash(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.uint32)
+
+
+def lsh_band_keys(signature: np.ndarray) -> List[str]:
+    """Hash each band of the signature into an LSH bucket key."""
+    keys = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()
+        keys.append(f"{band}:{hashlib.sha1(rows).hexdigest()[:16]}")
+    return keys
+
+
+def estimate_jaccard(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Estimate Jaccard similarity as the fraction of matching MinHash values."""
+    return float(np.mean(signature_a == signature_b))
+
+
+def find_near_duplicate(db, signature: np.ndarray,
+                        threshold: float = NEAR_DUPLICATE_THRESHOLD) -> Optional[Tuple[DocumentChunk, float]]:
+    """Return the most similar indexed chunk at or above the threshold, if any."""
+    keys = lsh_band_keys(signature)
+    candidate_ids = {
+        row.chunk_id for row in db.query(ChunkLSHBand.chunk_id).filter(ChunkLSHBand.band_key.in_(keys)).all()
+    }
+    if not candidate_ids:
+        return None
+
+    best = None
+    for chunk in db.query(DocumentChunk).filter(DocumentChunk.id.in_(candidate_ids)).all():
+        if not chunk.minhash:
+            continue
+        similarity = estimate_jaccard(signature, bytes_to_minhash(chunk.minhash))
+        if similarity >= threshold and (best is None or similarity > best[1]):
+            best = (chunk, similarity)
+    return best
+
+
+def index_chunk_signature(db, chunk: DocumentChunk, signature: np.ndarray) -> None:
+    """Store a chunk's signature and LSH bucket rows so later chunks can find it."""
+    chunk.minhash = minhash_to_bytes(signature)
+    for key in lsh_band_keys(signature):
+        db.add(ChunkLSHBand(chunk_id=chunk.id, band_key=key))
+
+
+def remove_chunk_signature(db, chunk_id: int) -> None:
+    """Delete a chunk's LSH bucket rows."""
+    db.query(ChunkLSHBand).filter(ChunkLSHBand.chunk_id == chunk_id).delete(synchronize_session=False)
+
+
+def dedup_stats(db) -> Dict[str, int]:
+    """Report how many chunk occurrences are served by shared canonical chunks."""
+    canonical = db.query(DocumentChunk).count()
+    references = db.query(ChunkReference).count()
+    return {
+        "canonical_chunks": canonical,
+        "duplicate_references": references,
+        "chunk_occurrences": canonical + references,
+    }
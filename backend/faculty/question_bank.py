@@ -0,0 +1,143 @@
+import json
+import os
+import random
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from db_setup import SessionLocal, QuestionBankEntry
+from document_processor import generate_embeddings, embedding_to_bytes, cosine_similarities
+
+# Load environment variables
+load_dotenv()
+
+# Questions at least this similar to a banked question of the same document are treated as duplicates
+QUESTION_DEDUP_THRESHOLD = float(os.getenv("QUESTION_DEDUP_THRESHOLD", "0.92"))
+# When a bank-mode quiz tops up a topic, it generates enough questions to bring the pool to this size
+QUESTION_BANK_MIN_POOL = int(os.getenv("QUESTION_BANK_MIN_POOL", "4"))
+
+# (document, topic, difficulty) whose last refill was rejected entirely as near-duplicates, so
+# bank-mode quizzes serve their existing pool; cleared whenever the document's bank is
+_saturated_topics: Set[Tuple[int, str, str]] = set()
+
+
+def _question_text(question) -> str:
+    """Text used to compare questions: the stem plus its options."""
+    return f"{question.question} {' '.join(question.options)}"
+
+
+def store_questions(document_id: int, questions: List, difficulty: str = "medium") -> int:
+    """Add validated questions to the bank, skipping near-duplicates of banked ones; returns the number stored."""
+    return _store_questions(document_id, questions, difficulty)[0]
+
+
+def _store_questions(document_id: int, questions: List, difficulty: str) -> Tuple[int, int]:
+    """Store questions and return (stored, rejected as near-duplicates); (0, 0) if the write fails."""
+    if not questions:
+        return 0, 0
+
+    db = SessionLocal()
+    try:
+        existing = (
+            db.query(QuestionBankEntry.embedding)
+            .filter(QuestionBankEntry.document_id == document_id, QuestionBankEntry.embedding.isnot(None))
+            .all()
+        )
+        known = [np.frombuffer(row.embedding, dtype=np.float32) for row in existing]
+
+        stored = duplicates = 0
+        for question, embedding in zip(questions, generate_embeddings([_question_text(q) for q in questions])):
+            if known and float(cosine_similarities(embedding, np.vstack(known)).max()) >= QUESTION_DEDUP_THRESHOLD:
+                print(f"Skipping near-duplicate question: {question.question[:60]}")
+                duplicates += 1
+                continue
+            db.add(QuestionBankEntry(
+                document_id=document_id,
+                topic=question.topic,
+                difficulty=difficulty,
+                question=question.question,
+                options=json.dumps(question.options),
+                correct_index=question.correct_index,
+                embedding=embedding_to_bytes(embedding)
+            ))
+            known.append(np.asarray(embedding, dtype=np.float32))
+            stored += 1
+
+        db.commit()
+        print(f"Stored {stored} of {len(questions)} questions in the bank for document ID {document_id}")
+        return stored, duplicates
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR storing questions in bank: {str(e)}")
+        return 0, 0
+    finally:
+        db.close()
+
+
+def refill_topic(document_id: int, topic: str, questions: List, difficulty: str = "medium") -> int:
+    """Store new questions for a low topic; returns the number stored.
+
+    Only a refill whose questions were all rejected as near-duplicates marks the topic
+    saturated. A failed generation (no questions) or write leaves it eligible for the next quiz.
+    """
+    stored, duplicates = _store_questions(document_id, questions, difficulty)
+    if questions and duplicates == len(questions):
+        _saturated_topics.add((document_id, topic, difficulty))
+    return stored
+
+
+def is_topic_saturated(document_id: int, topic: str, difficulty: str) -> bool:
+    return (document_id, topic, difficulty) in _saturated_topics
+
+
+def forget_saturated_topics(document_id: Optional[int] = None) -> None:
+    """Drop saturation marks of a document whose bank was cleared, or of every document."""
+    if document_id is None:
+        _saturated_topics.clear()
+        return
+    for key in [key for key in _saturated_topics if key[0] == document_id]:
+        _saturated_topics.discard(key)
+
+
+def get_bank_topics(document_id: int, difficulty: Optional[str] = None) -> Dict[str, int]:
+    """Return banked question counts per topic for a document."""
+    db = SessionLocal()
+    try:
+        query = db.query(QuestionBankEntry.topic).filter(QuestionBankEntry.document_id == document_id)
+        if difficulty:
+            query = query.filter(QuestionBankEntry.difficulty == difficulty)
+        counts = {}
+        for row in query.all():
+            counts[row.topic] = counts.get(row.topic, 0) + 1
+        return counts
+    finally:
+        db.close()
+
+
+def sample_questions(document_id: int, topic: str, count: int, difficulty: Optional[str] = None,
+                     rng: Optional[random.Random] = None) -> List[Dict]:
+    """Randomly pick banked questions for a topic, shuffling their options."""
+    rng = rng or random.Random()
+    db = SessionLocal()
+    try:
+        query = db.query(QuestionBankEntry).filter(
+            QuestionBankEntry.document_id == document_id, QuestionBankEntry.topic == topic
+        )
+        if difficulty:
+            query = query.filter(QuestionBankEntry.difficulty == difficulty)
+        pool = query.all()
+        picked = rng.sample(pool, min(count, len(pool)))
+
+        questions = []
+        for entry in picked:
+            options = json.loads(entry.options)
+            order = list(range(len(options)))
+            rng.shuffle(order)
+            questions.append({
+                "question": entry.question,
+                "options": [options[i] for i in order],
+                "correct_index": order.index(entry.correct_index),
+                "topic": entry.topic,
+            })
+        return questions
+    finally:
+        db.close()
@@ -1,9 +1,15 @@
 import json
 import re
-from typing import List
+import random
+import time
+from typing import List, Optional
 from pydantic import BaseModel
-from db_setup import SessionLocal, Document, DocumentChunk
-from document_processor import generate_embedding, cosine_similarity
+from db_setup import SessionLocal, Document
+from document_processor import generate_embedding, get_chunk_embedding, get_document_chunks, cosine_similarity
+from question_bank import (
+    QUESTION_BANK_MIN_POOL, store_questions, refill_topic, is_topic_saturated, get_bank_topics, sample_questions
+)
+from topic_extractor import extract_topics_locally
 import os
 from dotenv import load_dotenv
 
@@ -14,6 +20,13 @@ load_dotenv()
 from groq import Groq
 groq_client = Groq(api_key="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")
 
+# Topic extraction: "llm" always calls Groq, "local" never does, and "hybrid" calls Groq
+# only when the local keyphrase extractor's confidence is below the threshold
+TOPIC_EXTRACTION_MODE = os.getenv("TOPIC_EXTRACTION_MODE", "hybrid")
+TOPIC_CONFIDENCE_THRESHOLD = float(os.getenv("TOPIC_CONFIDENCE_THRESHOLD", "0.5"))
+
+DIFFICULTIES = ("easy", "medium", "hard")
+
 class QuizQuestion(BaseModel):
     question: str
     options: List[str]
@@ -77,7 +90,30 @@ def parse_llm_json(text: str, max_attempts: int = 3) -> any:
     # If all attempts fail, raise an exception
     raise ValueError("Failed to parse JSON from LLM output")
 
-def extract_topics_from_text(text: str) -> List[str]:
+def extract_topics_from_text(text: str, chunk_embeddings: Optional[List[List[float]]] = None,
+                             mode: Optional[str] = None) -> List[str]:
+    """Extract topics locally, with Groq, or locally falling back to Groq when confidence is low."""
+    mode = mode or TOPIC_EXTRACTION_MODE
+    if mode in ("local", "hybrid"):
+        start = time.perf_counter()
+        try:
+            topics, confidence = extract_topics_locally(text, chunk_embeddings)
+        except Exception as e:
+            print(f"Error extracting topics locally: {str(e)}")
+            topics, confidence = [], 0.0
+        print(f"Local topic extraction took {(time.perf_counter() - start) * 1000:.1f} ms "
+              f"(confidence {confidence:.2f}): {topics}")
+        if topics and (mode == "local" or confidence >= TOPIC_CONFIDENCE_THRESHOLD):
+            return topics
+        if mode == "local":
+            return ["General Knowledge"]
+    
+    start = time.perf_counter()
+    topics = extract_topics_with_llm(text)
+    print(f"LLM topic extraction took {(time.perf_counter() - start) * 1000:.1f} ms")
+    return topics
+
+def extract_topics_with_llm(text: str) -> List[str]:
     """Extract topics from text using Groq with improved prompting."""
     system_prompt = """You are an expert at identifying educational topics in text.
     Extract 3-5 main topics that would be suitable for quiz generation.
@@ -128,7 +164,7 @@ def repair_json(text: str) -> str:
         text = f"[{text}]"
     return text
 
-def generate_questions(topic: str, context: str, n: int) -> List[QuizQuestion]:
+def generate_questions(topic: str, context: str, n: int, difficulty: str = "medium") -> List[QuizQuestion]:
     """Generate quiz questions using Groq LLM with improved prompting for JSON output."""
     system_prompt = """You are an expert quiz generator. 
     You create clear, concise multiple-choice questions with exactly 4 options per question.
@@ -142,7 +178,7 @@ def generate_questions(topic: str, context: str, n: int) -> List[QuizQuestion]:
     
     """
 
-    user_prompt = f"""Generate {n} medium-difficulty multiple-choice questions about '{topic}' based on this content:
+    user_prompt = f"""Generate {n} {difficulty}-difficulty multiple-choice questions about '{topic}' based on this content:
 
     {context}
 
@@ -252,7 +288,22 @@ def generate_questions(topic: str, context: str, n: int) -> List[QuizQuestion]:
     return []
 
 
-def generate_quiz_for_document(doc_id: int, max_questions_per_topic: int = 2) -> List[QuizQuestion]:
+def build_topic_context(topic: str, chunk_contents: List[str], chunk_embeddings: List[List[float]]) -> str:
+    """Join the three chunks most similar to a topic into a question-generation context."""
+    topic_embedding = generate_embedding(topic)
+    
+    # Find relevant chunks for this topic
+    similarities = []
+    
+    for i, chunk_emb in enumerate(chunk_embeddings):
+        similarity = cosine_similarity(topic_embedding, chunk_emb)
+        similarities.append((similarity, i))
+    
+    similarities.sort(reverse=True)
+    top_chunks = [chunk_contents[idx] for _, idx in similarities[:3]]
+    return " ".join(top_chunks)
+
+def generate_quiz_for_document(doc_id: int, max_questions_per_topic: int = 2, difficulty: str = "medium") -> List[QuizQuestion]:
     """Generate a quiz for a document with improved error handling."""
     print(f"Starting quiz generation for document ID: {doc_id}")
     db = SessionLocal()
@@ -265,38 +316,29 @@ def generate_quiz_for_document(doc_id: int, max_questions_per_topic: int = 2) ->
             print("Document not found, returning empty list")
             return []
         
-        # Extract topics from the document content
-        print(f"Extracting topics from document content (first 100 chars): {doc.content[:100]}")
-        topics = extract_topics_from_text(doc.content)
-        print(f"Extracted topics: {topics}")
-        
-        chunks = db.query(DocumentChunk).filter(DocumentChunk.document_id == doc_id).all()
+        chunks = [chunk for chunk, _ in get_document_chunks(db, doc_id)]
         print(f"Found {len(chunks)} chunks for document")
         
         chunk_contents = [chunk.content for chunk in chunks]
+        chunk_embeddings = [get_chunk_embedding(chunk) for chunk in chunks]
         quiz = []
         
+        # Extract topics from the document content
+        print(f"Extracting topics from document content (first 100 chars): {doc.content[:100]}")
+        topics = extract_topics_from_text(doc.content, chunk_embeddings)
+        print(f"Extracted topics: {topics}")
+        
         for topic in topics:
             print(f"Processing topic: {topic}")
-            topic_embedding = generate_embedding(topic)
-            
-            # Find relevant chunks for this topic
-            chunk_embeddings = [generate_embedding(chunk) for chunk in chunk_contents]
-            similarities = []
-            
-            for i, chunk_emb in enumerate(chunk_embeddings):
-                similarity = cosine_similarity(topic_embedding, chunk_emb)
-                similarities.append((similarity, i))
-            
-            similarities.sort(reverse=True)
-            top_chunks = [chunk_contents[idx] for _, idx in similarities[:3]]
-            context = " ".join(top_chunks)
+            context = build_topic_context(topic, chunk_contents, chunk_embeddings)
             print(f"Created context with {len(context)} characters")
             
             # Generate questions for this topic
-            topic_questions = generate_questions(topic, context, max_questions_per_topic)
+            topic_questions = generate_questions(topic, context, max_questions_per_topic, difficulty)
             print(f"Generated {len(topic_questions)} questions for topic {topic}")
             
+            # Keep validated questions so later quizzes can be served from the bank
+            store_questions(doc_id, topic_questions, difficulty)
             quiz.extend(topic_questions)
         
         max_questions = max_questions_per_topic * len(topics)
@@ -311,4 +353,47 @@ def generate_quiz_for_document(doc_id: int, max_questions_per_topic: int = 2) ->
         return []
         
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_quiz_from_bank(doc_id: int, max_questions_per_topic: int = 2, difficulty: str = "medium",
+                       rng: Optional[random.Random] = None) -> List[QuizQuestion]:
+    """Assemble a randomized quiz from banked questions, generating only for topics whose pool runs low."""
+    print(f"Assembling quiz from question bank for document ID: {doc_id}")
+    topic_counts = get_bank_topics(doc_id, difficulty)
+    if not topic_counts:
+        print("Question bank is empty for this document, generating a new quiz")
+        return generate_quiz_for_document(doc_id, max_questions_per_topic, difficulty)
+    
+    # Only topics that can't fill the requested count are topped up, and topics whose last
+    # refill was entirely rejected as duplicates are served from what they have
+    min_pool = max(max_questions_per_topic, QUESTION_BANK_MIN_POOL)
+    low_topics = [
+        topic for topic, count in topic_counts.items()
+        if count < max_questions_per_topic and not is_topic_saturated(doc_id, topic, difficulty)
+    ]
+    if low_topics:
+        print(f"Topics with a low question pool: {low_topics}")
+        db = SessionLocal()
+        try:
+            chunks = [chunk for chunk, _ in get_document_chunks(db, doc_id)]
+            chunk_contents = [chunk.content for chunk in chunks]
+            chunk_embeddings = [get_chunk_embedding(chunk) for chunk in chunks]
+        finally:
+            db.close()
+        
+        for topic in low_topics:
+            context = build_topic_context(topic, chunk_contents, chunk_embeddings)
+            # One call brings the pool up to min_pool, so the next quizzes need no refill
+            needed = min_pool - topic_counts[topic]
+            refill_topic(doc_id, topic, generate_questions(topic, context, needed, difficulty), difficulty)
+            if is_topic_saturated(doc_id, topic, difficulty):
+                print(f"Only duplicate questions for topic {topic}, serving its existing pool from now on")
+    
+    quiz = []
+    for topic in topic_counts:
+        questions = sample_questions(doc_id, topic, max_questions_per_topic, difficulty, rng)
+        quiz.extend(QuizQuestion(**question) for question in questions)
+    
+    (rng or random).shuffle(quiz)
+    print(f"Assembled quiz with {len(quiz)} questions from the bank")
+    return quiz
@@ -1,12 +1,26 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from sqlalchemy import or_
 from pydantic import BaseModel
-from document_processor import generate_embedding, cosine_similarity
-from db_setup import SessionLocal, Document, DocumentChunk
+from document_processor import (
+    generate_embedding, get_chunk_embedding, get_chunk_sources, cosine_similarities,
+    maximal_marginal_relevance, retrieval_cache
+)
+from context_packer import pack_context
+from chat_deadline import ChatDeadline
+from conversation_store import ConversationStore
+from sentence_index import expand_sentence_windows
+from summary_tree import is_broad_query, get_relevant_summaries
+from document_router import DOCUMENT_ROUTING, ROUTING_FALLBACK, ROUTING_TOP_DOCUMENTS, route_documents
+import vector_reduction
+from vector_reduction import REDUCTION_SHORTLIST_FACTOR, shortlist_chunk_ids
+from db_setup import SessionLocal, Document, DocumentChunk, ChunkReference, DocumentSentence
 import os
 from dotenv import load_dotenv
 import random
 from sentence_transformers import CrossEncoder
 import asyncio
+import time
 from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
@@ -15,10 +29,43 @@ load_dotenv()
 # Groq setup
 from groq import Groq
 groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+deadline_groq_client = groq_client.with_options(max_retries=0)
 
 # Initialize reranker
 reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
 
+# Default retrieval unit for chat: "chunk" or "sentence" (sentence windows)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "chunk")
+RETRIEVAL_MODES = ("chunk", "sentence")
+
+# Maximal-marginal-relevance selection before reranking: 0 disables it, 1 favours novelty only
+MMR_DIVERSITY = float(os.getenv("MMR_DIVERSITY", "0.3"))
+# Candidates at least this similar to an already selected chunk are treated as copies and dropped
+MMR_REDUNDANCY_THRESHOLD = float(os.getenv("MMR_REDUNDANCY_THRESHOLD", "0.95"))
+MMR_CANDIDATE_POOL = int(os.getenv("MMR_CANDIDATE_POOL", "30"))
+
+# Total time budget of a /chat request in seconds (0 disables it). LLM stages that cannot finish in
+# time are dropped, degrading to the map answers already completed or to a single direct call
+CHAT_TIME_BUDGET_SECONDS = float(os.getenv("CHAT_TIME_BUDGET_SECONDS", "20"))
+# Time kept back for the answering call while rewriting and mapping
+CHAT_ANSWER_RESERVE_SECONDS = float(os.getenv("CHAT_ANSWER_RESERVE_SECONDS", "5"))
+CHAT_REWRITE_TIMEOUT_SECONDS = float(os.getenv("CHAT_REWRITE_TIMEOUT_SECONDS", "3"))
+# No LLM call is started with less time than this left
+CHAT_MIN_CALL_SECONDS = float(os.getenv("CHAT_MIN_CALL_SECONDS", "1"))
+OUT_OF_TIME_RESPONSE = ("Sorry, I couldn't put together an answer in time. "
+                        "The sources below look relevant; please try asking again.")
+
+# Blocking Groq calls run here, so map calls overlap and a stage can be abandoned at its deadline
+llm_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CHAT_LLM_WORKERS", "16")))
+
+# Server-side chat history, so clients send only the new message with a conversation id
+conversation_store = ConversationStore(
+    max_conversations=int(os.getenv("CONVERSATION_STORE_SIZE", "1000")),
+    max_messages=int(os.getenv("CONVERSATION_MAX_MESSAGES", "10")),
+    max_message_chars=int(os.getenv("CONVERSATION_MAX_MESSAGE_CHARS", "2000")),
+    ttl_seconds=float(os.getenv("CONVERSATION_TTL_SECONDS", "21600"))
+)
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -26,6 +73,9 @@ class ChatMessage(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     sources: List[Dict[str, str]]
+    context_stats: Optional[Dict[str, int]] = None
+    conversation_id: Optional[str] = None
+    stages: Optional[Dict] = None
 
 def analyze_sentiment(text: str) -> float:
     """Simple sentiment analysis to adapt response tone."""
@@ -40,64 +90,245 @@ def analyze_sentiment(text: str) -> float:
     # Return a score between -1 and 1
     return (positive_score - negative_score) / (positive_score + negative_score + 1)
 
-def get_relevant_chunks(query: str, limit: int = 10, final_limit: int = 5, similarity_threshold: float = 0.6) -> List[Dict[str, str]]:
-    """Get relevant document chunks with reranking for improved relevance."""
-    # Generate embedding for the query
-    query_embedding = generate_embedding(query)
+def load_candidate_chunks(db, document_ids: Optional[List[int]] = None,
+                          chunk_ids: Optional[List[int]] = None) -> List[Dict]:
+    """Load canonical chunks with their titles and embeddings, optionally only those of the given documents.
+
+    Restricting to documents includes chunks they share with other documents through references.
+    """
+    query = db.query(DocumentChunk, Document.title).join(Document, Document.id == DocumentChunk.document_id)
+    if chunk_ids is not None:
+        query = query.filter(DocumentChunk.id.in_(chunk_ids))
+    elif document_ids is not None:
+        referenced = db.query(ChunkReference.chunk_id).filter(ChunkReference.document_id.in_(document_ids))
+        query = query.filter(or_(DocumentChunk.document_id.in_(document_ids), DocumentChunk.id.in_(referenced)))
+    return [
+        {
+            "chunk_id": chunk.id,
+            "document_id": chunk.document_id,
+            "document_title": title,
+            "chunk_index": chunk.chunk_index,
+            "content": chunk.content,
+            "embedding": get_chunk_embedding(chunk)
+        }
+        for chunk, title in query.all()
+    ]
+
+def hydrate_chunk_results(db, memo: List[Dict]) -> Optional[List[Dict]]:
+    """Rebuild retrieval results from memoized chunk ids and scores; None if a chunk no longer exists."""
+    chunk_ids = [entry["chunk_id"] for entry in memo]
+    rows = {
+        chunk.id: (chunk, title)
+        for chunk, title in db.query(DocumentChunk, Document.title)
+        .join(Document, Document.id == DocumentChunk.document_id)
+        .filter(DocumentChunk.id.in_(chunk_ids)).all()
+    } if chunk_ids else {}
+    if len(rows) != len(chunk_ids):
+        return None
+    
+    sources = get_chunk_sources(db, chunk_ids)
+    results = []
+    for entry in memo:
+        chunk, title = rows[entry["chunk_id"]]
+        results.append({
+            "chunk_id": chunk.id,
+            "content": chunk.content,
+            "document_title": title,
+            "document_id": chunk.document_id,
+            "chunk_index": chunk.chunk_index,
+            **{key: value for key, value in entry.items() if key != "chunk_id"},
+            "source_document_ids": sources.get(chunk.id, [chunk.document_id])
+        })
+    return results
+
+def get_relevant_chunks(query: str, limit: int = 10, final_limit: int = 5, similarity_threshold: float = 0.6,
+                        diversity: Optional[float] = None) -> List[Dict[str, str]]:
+    """Get relevant document chunks with reranking for improved relevance.
+
+    Only chunks of the documents whose centroids are closest to the query are scored, falling back
+    to every chunk when those yield fewer than `final_limit` candidates. Candidates above the similarity
+    threshold are narrowed to `limit` chunks with maximal marginal relevance (weighted by `diversity`)
+    before the cross-encoder picks the final ones.
+
+    Results are memoized per normalized query and parameters until the corpus next changes.
+    """
+    if diversity is None:
+        diversity = MMR_DIVERSITY
+    params = {
+        "limit": limit, "final_limit": final_limit, "similarity_threshold": similarity_threshold,
+        "diversity": diversity, "routing": [DOCUMENT_ROUTING, ROUTING_TOP_DOCUMENTS, ROUTING_FALLBACK],
+        "reduction": [vector_reduction.VECTOR_REDUCTION, REDUCTION_SHORTLIST_FACTOR]
+    }
+    # Read the generation before searching, so results racing with an ingest are never stored as current
+    generation = retrieval_cache.generation
     
     db = SessionLocal()
     try:
-        # Get all documents and chunks
-        documents = db.query(Document).all()
-        all_chunks = []
+        memo = retrieval_cache.get(query, "chunks", params)
+        if memo is not None:
+            results = hydrate_chunk_results(db, memo)
+            if results is not None:
+                return results
+        
+        results = search_chunks(db, query, limit, final_limit, similarity_threshold, diversity)
+        retrieval_cache.put(query, "chunks", params, [
+            {key: chunk[key] for key in ("chunk_id", "similarity", "rerank_score") if key in chunk}
+            for chunk in results
+        ], generation)
+        return results
+    finally:
+        db.close()
+
+def search_chunks(db, query: str, limit: int, final_limit: int, similarity_threshold: float,
+                  diversity: float, timings: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """Score, diversify and rerank chunks for a query; see get_relevant_chunks.
+
+    If a timings dict is given, seconds spent in each stage are added to it.
+    """
+    timings = timings if timings is not None else {}
+    stage_start = time.perf_counter()
+    
+    def lap(stage: str) -> None:
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings[stage] = timings.get(stage, 0.0) + now - stage_start
+        stage_start = now
+    
+    # Generate embedding for the query
+    query_embedding = generate_embedding(query)
+    lap("embed")
+    
+    routed = route_documents(db, query_embedding)
+    lap("route")
+    pool_size = max(limit, MMR_CANDIDATE_POOL) if diversity > 0 else limit
+    while True:
+        # With a fitted projection, scan reduced vectors and re-score a shortlist with full ones
+        shortlist = shortlist_chunk_ids(db, query_embedding, pool_size * REDUCTION_SHORTLIST_FACTOR, routed)
+        lap("shortlist")
+        all_chunks = load_candidate_chunks(db, routed, chunk_ids=shortlist)
+        if not all_chunks:
+            ranked = []
+        else:
+            # Calculate similarities with one matrix product
+            matrix = np.asarray([chunk["embedding"] for chunk in all_chunks], dtype=np.float32)
+            similarities = cosine_similarities(query_embedding, matrix)
+            ranked = [i for i in np.argsort(-similarities)[:pool_size] if similarities[i] >= similarity_threshold]
+        if routed is None or len(ranked) >= final_limit or not ROUTING_FALLBACK:
+            break
+        print(f"Routed search over {len(routed)} documents found {len(ranked)} candidates, searching all chunks")
+        routed = None
+    lap("score")
+    
+    if not ranked:
+        return []
+    
+    # Pick a diverse subset of the candidates so near-copies don't each cost a map call
+    if diversity > 0 and len(ranked) > 1:
+        picked = maximal_marginal_relevance(query_embedding, matrix[ranked], limit,
+                                            diversity=diversity, redundancy_threshold=MMR_REDUNDANCY_THRESHOLD)
+        ranked = [ranked[i] for i in picked]
+    lap("mmr")
+    
+    initial_results = []
+    for i in ranked[:limit]:
+        chunk = all_chunks[i]
+        initial_results.append({
+            "chunk_id": chunk["chunk_id"],
+            "content": chunk["content"],
+            "document_title": chunk["document_title"],
+            "document_id": chunk["document_id"],
+            "chunk_index": chunk["chunk_index"],
+            "similarity": float(similarities[i])
+        })
+    
+    # Rerank with cross-encoder if we have results
+    if initial_results:
+        # Prepare pairs for reranking
+        pairs = [(query, chunk["content"]) for chunk in initial_results]
+        
+        # Get reranking scores
+        scores = reranker.predict(pairs)
         
-        for doc in documents:
-            chunks = db.query(DocumentChunk).filter(DocumentChunk.document_id == doc.id).all()
-            for chunk in chunks:
-                all_chunks.append({
-                    "document_id": doc.id,
-                    "document_title": doc.title,
-                    "content": chunk.content,
-                    "embedding": generate_embedding(chunk.content)
-                })
+        # Add scores to results
+        for i, score in enumerate(scores):
+            initial_results[i]["rerank_score"] = float(score)
         
-        # Calculate similarities
-        results = []
-        for chunk in all_chunks:
-            similarity = cosine_similarity(query_embedding, chunk["embedding"])
-            if similarity >= similarity_threshold:
-                results.append({
-                    "content": chunk["content"],
-                    "document_title": chunk["document_title"],
-                    "document_id": chunk["document_id"],
-                    "similarity": similarity
-                })
+        # Sort by reranking score
+        final_results = sorted(initial_results, key=lambda x: x["rerank_score"], reverse=True)[:final_limit]
+    else:
+        final_results = initial_results[:final_limit]
+    lap("rerank")
+    
+    # Near-duplicate chunks are stored once; list every document that contains them
+    sources = get_chunk_sources(db, [chunk["chunk_id"] for chunk in final_results])
+    for chunk in final_results:
+        chunk["source_document_ids"] = sources.get(chunk["chunk_id"], [chunk["document_id"]])
+    
+    return final_results
+
+def get_relevant_sentences(query: str, limit: int = 20, final_limit: int = 5, similarity_threshold: float = 0.5) -> List[Dict]:
+    """Get relevant sentences from the sentence index, reranked with the cross-encoder."""
+    query_embedding = generate_embedding(query)
+    
+    db = SessionLocal()
+    try:
+        sentences = db.query(
+            DocumentSentence.id, DocumentSentence.document_id, DocumentSentence.sentence_index,
+            DocumentSentence.content, DocumentSentence.embedding
+        ).filter(DocumentSentence.embedding.isnot(None)).all()
+        if not sentences:
+            return []
         
-        # Sort by similarity and get top initial results
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        initial_results = results[:limit]
+        # Score every sentence with one matrix product
+        matrix = np.vstack([np.frombuffer(sentence.embedding, dtype=np.float32) for sentence in sentences])
+        similarities = cosine_similarities(query_embedding, matrix)
+        top = [i for i in np.argsort(-similarities)[:limit] if similarities[i] >= similarity_threshold]
+        if not top:
+            return []
         
-        # Rerank with cross-encoder if we have results
-        if initial_results:
-            # Prepare pairs for reranking
-            pairs = [(query, chunk["content"]) for chunk in initial_results]
-            
-            # Get reranking scores
-            scores = reranker.predict(pairs)
-            
-            # Add scores to results
-            for i, score in enumerate(scores):
-                initial_results[i]["rerank_score"] = float(score)
-            
-            # Sort by reranking score
-            reranked_results = sorted(initial_results, key=lambda x: x["rerank_score"], reverse=True)
-            return reranked_results[:final_limit]
+        document_ids = {sentences[i].document_id for i in top}
+        titles = {doc.id: doc.title for doc in db.query(Document.id, Document.title).filter(Document.id.in_(document_ids)).all()}
+        results = [{
+            "sentence_id": sentences[i].id,
+            "document_id": sentences[i].document_id,
+            "document_title": titles.get(sentences[i].document_id, ""),
+            "sentence_index": sentences[i].sentence_index,
+            "content": sentences[i].content,
+            "similarity": float(similarities[i])
+        } for i in top]
         
-        return initial_results[:final_limit]
+        scores = reranker.predict([(query, result["content"]) for result in results])
+        for result, score in zip(results, scores):
+            result["rerank_score"] = float(score)
+        results.sort(key=lambda x: x["rerank_score"], reverse=True)
+        return results[:final_limit]
     finally:
         db.close()
 
-async def process_chunk_async(chunk: Dict, query: str, system_message: str) -> Dict:
+def _timeout_option(timeout: Optional[float]) -> Dict:
+    # Only pass a timeout when there is one, so unbounded calls keep the client default
+    return {"timeout": max(timeout, 0.1)} if timeout is not None else {}
+
+def complete_chat(messages: List[Dict], timeout: Optional[float] = None) -> str:
+    """Run one blocking chat completion and return its text."""
+    # Calls under a deadline are not retried: a retry would outlive the timeout and keep its
+    # executor thread busy long after the stage was abandoned
+    client = groq_client if timeout is None else deadline_groq_client
+    chat_completion = client.chat.completions.create(
+        messages=messages,
+        model="llama-3.3-70b-versatile",
+        **_timeout_option(timeout)
+    )
+    return chat_completion.choices[0].message.content
+
+async def complete_within(deadline: ChatDeadline, messages: List[Dict], reserve: float = 0.0) -> str:
+    """Run a completion in the LLM pool, raising asyncio.TimeoutError if it would eat into reserve."""
+    timeout = deadline.timeout(reserve)
+    future = asyncio.get_running_loop().run_in_executor(llm_executor, complete_chat, messages, timeout)
+    return await asyncio.wait_for(future, timeout)
+
+async def process_chunk_async(chunk: Dict, query: str, system_message: str,
+                              timeout: Optional[float] = None) -> Dict:
     """Process a single chunk asynchronously for hierarchical summarization."""
     chunk_content = chunk["content"]
     chunk_prompt = f"""
@@ -113,27 +344,50 @@ async def process_chunk_async(chunk: Dict, query: str, system_message: str) -> D
         {"role": "user", "content": chunk_prompt}
     ]
     
-    # Generate response for this chunk
-    chat_completion = groq_client.chat.completions.create(
-        messages=messages,
-        model="llama-3.3-70b-versatile",
-    )
-    
-    chunk_response = chat_completion.choices[0].message.content
+    # Generate response for this chunk in the LLM pool, so map calls run concurrently
+    chunk_response = await asyncio.get_running_loop().run_in_executor(llm_executor, complete_chat, messages, timeout)
     return {
         "chunk_response": chunk_response,
         "document_title": chunk["document_title"],
         "document_id": chunk["document_id"]
     }
 
-async def hierarchical_summarization(query: str, chunks: List[Dict], system_message: str) -> Dict:
-    """Process chunks in parallel and then combine the results."""
-    # Process all chunks in parallel
-    tasks = [process_chunk_async(chunk, query, system_message) for chunk in chunks]
-    chunk_results = await asyncio.gather(*tasks)
+async def hierarchical_summarization(query: str, chunks: List[Dict], system_message: str,
+                                     deadline: Optional[ChatDeadline] = None) -> Optional[Dict]:
+    """Process chunks in parallel and then combine the results.
+
+    Map calls still running when only the synthesis reserve is left are dropped. If
+    there is no time left to synthesize, the completed map answers are returned as
+    they are. Returns None when no map call finished.
+    """
+    if deadline is None:
+        deadline = ChatDeadline()
+    # Process all chunks in parallel, keeping the results that arrive before the deadline
+    map_timeout = deadline.timeout(CHAT_ANSWER_RESERVE_SECONDS)
+    tasks = [
+        asyncio.ensure_future(process_chunk_async(chunk, query, system_message, map_timeout))
+        for chunk in chunks
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=map_timeout)
+    for task in pending:
+        task.cancel()
+    chunk_results = []
+    for task in tasks:
+        if task in done and task.exception() is None:
+            chunk_results.append(task.result())
+        elif task in done:
+            print(f"Map call failed: {task.exception()}")
+    deadline.record("map", f"{len(chunk_results)}/{len(chunks)}")
+    if not chunk_results:
+        return None
+    
+    sources = answer_sources(chunk_results)
     
     # Combine the chunk responses
     combined_context = "\n\n".join([result["chunk_response"] for result in chunk_results])
+    if len(chunk_results) == 1 or not deadline.allows(CHAT_MIN_CALL_SECONDS):
+        deadline.record("synthesis", "skipped")
+        return {"response": combined_context, "sources": sources}
     
     # Final synthesis prompt
     synthesis_prompt = f"""
@@ -152,21 +406,60 @@ async def hierarchical_summarization(query: str, chunks: List[Dict], system_mess
         {"role": "user", "content": synthesis_prompt}
     ]
     
-    # Generate final synthesized response
-    chat_completion = groq_client.chat.completions.create(
-        messages=messages,
-        model="llama-3.3-70b-versatile",
+    # Generate final synthesized response, falling back to the map answers if it runs out of time
+    try:
+        final_response = await complete_within(deadline, messages)
+        deadline.record("synthesis", "ran")
+    except asyncio.TimeoutError:
+        deadline.record("synthesis", "timed out")
+        final_response = combined_context
+    except Exception as e:
+        print(f"Error in synthesis: {str(e)}")
+        deadline.record("synthesis", "failed")
+        final_response = combined_context
+    
+    # Return the final response and sources
+    return {"response": final_response, "sources": sources}
+
+def answer_sources(items: List[Dict]) -> List[Dict[str, str]]:
+    """List the documents of retrieved chunks or summaries once each, in order."""
+    sources = []
+    for item in items:
+        source = {"document_title": item["document_title"], "document_id": str(item["document_id"])}
+        if source not in sources:
+            sources.append(source)
+    return sources
+
+async def answer_from_summaries(query: str, summaries: List[Dict], system_message: str,
+                                conversation_history: List[ChatMessage],
+                                deadline: Optional[ChatDeadline] = None) -> Dict:
+    """Answer a broad question with one LLM call over precomputed summary nodes."""
+    if deadline is None:
+        deadline = ChatDeadline()
+    context = "\n\n".join(
+        f"[{summary['document_title']} - {summary['summary_level']} summary]\n{summary['content']}"
+        for summary in summaries
     )
+    prompt = f"""
+    Answer the following question using these summaries of the course material:
     
-    final_response = chat_completion.choices[0].message.content
+    {context}
     
-    # Return the final response and sources
-    sources = [{"document_title": result["document_title"], "document_id": result["document_id"]} 
-               for result in chunk_results]
+    Question: {query}
+    """
     
-    return {"response": final_response, "sources": sources}
+    messages = [{"role": "system", "content": system_message}]
+    for msg in conversation_history[-5:]:
+        messages.append({"role": msg.role, "content": msg.content})
+    messages.append({"role": "user", "content": prompt})
+    
+    response = await complete_within(deadline, messages)
+    deadline.record("summary_answer", "ran")
+    
+    return {"response": response, "sources": answer_sources(summaries)}
 
-def generate_improved_query(original_query: str, conversation_history: List[ChatMessage]) -> str:
+def generate_improved_query(original_query: str, conversation_history: List[ChatMessage],
+                            timeout: Optional[float] = None) -> str:
     """Generate an improved query based on the original query and conversation history."""
     # Extract recent conversation context
     recent_context = "\n".join([f"{msg.role}: {msg.content}" 
@@ -191,12 +484,7 @@ def generate_improved_query(original_query: str, conversation_history: List[Chat
     
     # Generate improved query
     try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=messages,
-            model="llama-3.3-70b-versatile",
-        )
-        
-        improved_query = chat_completion.choices[0].message.content.strip()
+        improved_query = complete_chat(messages, timeout).strip()
         # Remove quotes if present
         improved_query = improved_query.strip('"\'')
         return improved_query
@@ -204,6 +492,27 @@ def generate_improved_query(original_query: str, conversation_history: List[Chat
         print(f"Error generating improved query: {str(e)}")
         return original_query
 
+async def improve_query_within(deadline: ChatDeadline, original_query: str,
+                               conversation_history: List[ChatMessage]) -> Optional[str]:
+    """Rewrite the query if the deadline leaves time for it; None when the rewrite is dropped."""
+    if not deadline.allows(CHAT_MIN_CALL_SECONDS, reserve=CHAT_ANSWER_RESERVE_SECONDS):
+        deadline.record("rewrite", "skipped")
+        return None
+    # The rewrite gets a bounded share of the budget, leaving the rest for answering
+    timeout = deadline.timeout(CHAT_ANSWER_RESERVE_SECONDS)
+    if timeout is not None:
+        timeout = min(timeout, CHAT_REWRITE_TIMEOUT_SECONDS)
+    future = asyncio.get_running_loop().run_in_executor(
+        llm_executor, generate_improved_query, original_query, conversation_history, timeout
+    )
+    try:
+        improved_query = await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        deadline.record("rewrite", "timed out")
+        return None
+    deadline.record("rewrite", "ran")
+    return improved_query
+
 def add_human_touch(response: str) -> str:
     """Add human-like touches to the response."""
     # List of cognitive pauses and filler phrases
@@ -232,20 +541,90 @@ def add_human_touch(response: str) -> str:
     
     return response
 
-async def chat_with_documents(message: str, conversation_history: List[ChatMessage] = None) -> ChatResponse:
-    """Chat with documents using RAG approach."""
+async def chat_in_conversation(conversation_id: str, message: str, retrieval_mode: Optional[str] = None,
+                               seed_history: Optional[List[ChatMessage]] = None,
+                               time_budget: Optional[float] = None) -> ChatResponse:
+    """Chat using the server-side history of a conversation, recording the new turn.
+
+    seed_history is only used when the store holds nothing for the conversation yet,
+    e.g. for a client that still sends its history or after a server restart.
+    time_budget defaults to CHAT_TIME_BUDGET_SECONDS.
+    """
+    deadline = ChatDeadline(CHAT_TIME_BUDGET_SECONDS if time_budget is None else time_budget)
+    history = conversation_store.get_history(conversation_id)
+    if not history and seed_history:
+        history = [(msg.role, msg.content) for msg in seed_history]
+        conversation_store.add_messages(conversation_id, history)
+    
+    # Reuse the last rewrite when it was made for the same message and context
+    fingerprint = conversation_store.rewrite_fingerprint(message, history)
+    improved_query = conversation_store.get_rewrite(conversation_id, fingerprint)
+    conversation_history = [ChatMessage(role=role, content=content) for role, content in history]
+    if improved_query is None:
+        improved_query = await improve_query_within(deadline, message, conversation_history)
+        if improved_query is not None:
+            conversation_store.set_rewrite(conversation_id, fingerprint, improved_query)
+    else:
+        deadline.record("rewrite", "cached")
+    
+    response = await chat_with_documents(message, conversation_history, retrieval_mode,
+                                         improved_query=improved_query or message, deadline=deadline)
+    conversation_store.add_messages(conversation_id, [("user", message), ("assistant", response.response)])
+    response.conversation_id = conversation_id
+    return response
+
+def retrieve_chunk_context(query: str, retrieval_mode: str) -> Tuple[List[Dict], Dict[str, int]]:
+    """Retrieve chunks for a query and pack them into the prompt token budget."""
+    relevant_chunks = []
+    if retrieval_mode == "sentence":
+        # Match single sentences, then expand each hit to its neighbouring sentences for the prompt
+        sentence_hits = get_relevant_sentences(query)
+        relevant_chunks = expand_sentence_windows(sentence_hits)
+        if not relevant_chunks:
+            print("No sentence index matches, falling back to chunk retrieval")
+    if not relevant_chunks:
+        relevant_chunks = get_relevant_chunks(query)
+    
+    # Pack chunks into the prompt token budget, dropping overlap between neighbouring chunks
+    relevant_chunks, context_stats = pack_context(relevant_chunks)
+    print(f"Context packing: {context_stats['tokens_after']} tokens "
+          f"({context_stats['tokens_saved']} saved, {context_stats['chunks_after']}/{context_stats['chunks_before']} chunks)")
+    return relevant_chunks, context_stats
+
+async def chat_with_documents(message: str, conversation_history: List[ChatMessage] = None,
+                              retrieval_mode: Optional[str] = None,
+                              improved_query: Optional[str] = None,
+                              deadline: Optional[ChatDeadline] = None) -> ChatResponse:
+    """Chat with documents using RAG approach.
+
+    With a deadline, LLM stages that cannot finish in time are dropped: the rewrite is
+    skipped, unfinished map calls are left out, and the answer falls back to the map
+    results or a single direct call. The response reports which stages ran.
+    """
     if conversation_history is None:
         conversation_history = []
+    if retrieval_mode is None:
+        retrieval_mode = RETRIEVAL_MODE
+    if deadline is None:
+        deadline = ChatDeadline(CHAT_TIME_BUDGET_SECONDS)
     # Analyze sentiment to adapt response tone
     sentiment = analyze_sentiment(message)
     
-    # Generate improved query based on conversation history
-    improved_query = generate_improved_query(message, conversation_history)
+    # Generate improved query based on conversation history, unless the caller already has one
+    if improved_query is None:
+        improved_query = await improve_query_within(deadline, message, conversation_history) or message
     print(f"Original query: {message}")
     print(f"Improved query: {improved_query}")
     
+    # Broad questions are answered in one call from precomputed summaries when they exist
+    summaries = get_relevant_summaries(improved_query) if is_broad_query(message) else []
+    
     # Get relevant chunks using the improved query
-    relevant_chunks = get_relevant_chunks(improved_query)
+    relevant_chunks = []
+    context_stats = {"summary_nodes": len(summaries)}
+    if not summaries:
+        relevant_chunks, context_stats = retrieve_chunk_context(improved_query, retrieval_mode)
+    deadline.record("retrieval", "summaries" if summaries else "chunks")
     
     # Prepare system message with tone adaptation based on sentiment
     system_message = """You are a helpful, conversational assistant that answers questions based on the provided document context.
@@ -261,59 +640,86 @@ async def chat_with_documents(message: str, conversation_history: List[ChatMessa
     elif sentiment > 0.5:
         system_message += "\nThe user seems enthusiastic. Match their positive energy in your response."
     
-    # Use hierarchical summarization for processing chunks
-    try:
-        result = await hierarchical_summarization(message, relevant_chunks, system_message)
-        
+    if summaries and deadline.allows(CHAT_MIN_CALL_SECONDS):
+        print(f"Answering broad question from {len(summaries)} summary nodes")
+        try:
+            result = await answer_from_summaries(message, summaries, system_message, conversation_history, deadline)
+            return ChatResponse(response=add_human_touch(result["response"]), sources=result["sources"],
+                                context_stats=context_stats, stages=deadline.report())
+        except asyncio.TimeoutError:
+            deadline.record("summary_answer", "timed out")
+        except Exception as e:
+            print(f"Error answering from summaries: {str(e)}")
+            deadline.record("summary_answer", "failed")
+            # Answer from retrieved chunks instead, as if there were no summaries
+            summaries = []
+            relevant_chunks, context_stats = retrieve_chunk_context(improved_query, retrieval_mode)
+            deadline.record("retrieval", "chunks")
+    
+    # Use hierarchical summarization for processing chunks, if there is time for a map round and a synthesis
+    result = None
+    if relevant_chunks and deadline.allows(CHAT_MIN_CALL_SECONDS, reserve=CHAT_ANSWER_RESERVE_SECONDS):
+        try:
+            result = await hierarchical_summarization(message, relevant_chunks, system_message, deadline)
+        except Exception as e:
+            print(f"Error in hierarchical summarization: {str(e)}")
+    elif relevant_chunks:
+        deadline.record("map", "skipped")
+    if result is not None:
         # Add human-like touches to the response
         enhanced_response = add_human_touch(result["response"])
         
-        return ChatResponse(response=enhanced_response, sources=result["sources"])
-    except Exception as e:
-        # Fallback to traditional approach if async processing fails
-        print(f"Error in hierarchical summarization: {str(e)}")
-        
-        # Prepare context from chunks
+        return ChatResponse(response=enhanced_response, sources=result["sources"], context_stats=context_stats,
+                            stages=deadline.report())
+    
+    # Fallback to a single direct call with whatever time is left
+    if summaries:
+        context = "\n\n".join(summary["content"] for summary in summaries)
+        sources = answer_sources(summaries)
+    else:
         context = "\n\n".join([chunk["content"] for chunk in relevant_chunks])
-        
-        # Prepare prompt with context and chain-of-thought guidance
-        prompt = f"""
-        Answer the following question based on this context:
-        
-        Context: {context}
-        
-        Question: {message}
-        
-        Think through your response step by step
-        """
-        
-        # Prepare conversation history for the API
-        messages = [{"role": "system", "content": system_message}]
-        
-        # Add conversation history (limited to last 5 messages)
-        for msg in conversation_history[-5:]:
-            messages.append({"role": msg.role, "content": msg.content})
-        
-        # Add the current prompt
-        messages.append({"role": "user", "content": prompt})
-        
-        # Generate response using Groq LLM
-        chat_completion = groq_client.chat.completions.create(
-            messages=messages,
-            model="llama-3.3-70b-versatile",
-        )
-        
-        response = chat_completion.choices[0].message.content
-        
-        # Add human-like touches
-        enhanced_response = add_human_touch(response)
-        
-        # Prepare sources information
-        sources = []
-        for chunk in relevant_chunks:
-            sources.append({
-                "document_title": chunk["document_title"],
-                "document_id": str(chunk["document_id"])
-            })
-        
-        return ChatResponse(response=enhanced_response, sources=sources)
\ No newline at end of file
+        sources = answer_sources(relevant_chunks)
+    
+    # Prepare prompt with context and chain-of-thought guidance
+    prompt = f"""
+    Answer the following question based on this context:
+    
+    Context: {context}
+    
+    Question: {message}
+    
+    Think through your response step by step
+    """
+    
+    # Prepare conversation history for the API
+    messages = [{"role": "system", "content": system_message}]
+    
+    # Add conversation history (limited to last 5 messages)
+    for msg in conversation_history[-5:]:
+        messages.append({"role": msg.role, "content": msg.content})
+    
+    # Add the current prompt
+    messages.append({"role": "user", "content": prompt})
+    
+    # Generate response using Groq LLM
+    response = None
+    if deadline.allows(CHAT_MIN_CALL_SECONDS):
+        try:
+            response = await complete_within(deadline, messages)
+            deadline.record("direct_answer", "ran")
+        except asyncio.TimeoutError:
+            deadline.record("direct_answer", "timed out")
+        except Exception as e:
+            print(f"Error in direct answer: {str(e)}")
+            deadline.record("direct_answer", "failed")
+    else:
+        deadline.record("direct_answer", "skipped")
+    if response is None:
+        return ChatResponse(response=OUT_OF_TIME_RESPONSE, sources=sources, context_stats=context_stats,
+                            stages=deadline.report())
+    
+    # Add human-like touches
+    enhanced_response = add_human_touch(response)
+    
+    return ChatResponse(response=enhanced_response, sources=sources, context_stats=context_stats,
+                        stages=deadline.report())
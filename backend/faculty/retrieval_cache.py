@@ -0,0 +1,87 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class RetrievalCache:
+    """Bounded LRU memo of retrieval results, valid for one corpus generation.
+
+    Every write to the corpus bumps the generation, which invalidates all entries at
+    once; stale entries are dropped lazily when they are next looked up or evicted.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max(1, max_entries)
+        self.generation = 0
+        self._entries: "OrderedDict[str, Tuple[int, List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Collapse whitespace, lowercase and drop trailing punctuation."""
+        return re.sub(r'\s+', ' ', query).strip().lower().rstrip('?!.')
+
+    def make_key(self, query: str, scope: str, params: Dict) -> str:
+        """Hash the normalized query with the retrieval scope and parameters."""
+        payload = json.dumps([self.normalize(query), scope, params], sort_keys=True).encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def bump_generation(self) -> int:
+        """Mark the corpus as changed, invalidating every cached result."""
+        with self._lock:
+            self.generation += 1
+            return self.generation
+
+    def get(self, query: str, scope: str, params: Dict) -> Optional[List[Dict]]:
+        """Return results cached for the current generation, or None on a miss."""
+        key = self.make_key(query, scope, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self.generation:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, scope: str, params: Dict, results: List[Dict], generation: int) -> None:
+        """Store results computed against the given generation, unless the corpus has changed since."""
+        key = self.make_key(query, scope, params)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (generation, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all entries and reset statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Return size, generation and hit-rate statistics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "generation": self.generation,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,264 @@
+"""Offline tuning harness for faculty chunk retrieval.
+
+Ingests a labelled corpus once per chunking configuration, then sweeps the
+retrieval parameters of get_relevant_chunks and the index backend, and
+reports recall@k, MRR and per-stage latency for every configuration.
+
+    python retrieval_tuning.py labelled.json --limits 5,10,20 --final-limits 3,5 \\
+        --thresholds 0.3,0.45,0.6 --chunking 1000:150,600:100 --backends flat,routed \\
+        --min-recall 0.9 --output tuning_results.json
+
+The labelled set is JSON:
+
+    {
+      "documents": [{"title": "Unit 3", "path": "unit3.pdf"}, {"title": "Notes", "text": "..."}],
+      "questions": [{"question": "What does the second law state?", "document": "Unit 3",
+                     "answer": "entropy of an isolated system never decreases"}]
+    }
+
+Relevance is labelled by answer text rather than chunk id, so labels stay
+valid when the chunk size changes: a chunk is relevant when it contains the
+answer, or, if the answer straddles a chunk boundary, half of it. Like
+benchmark.py, the harness runs offline against a temporary database.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Set
+
+# Everything below must resolve without network access, and must not touch the real database
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+_tuning_dir = tempfile.mkdtemp(prefix="faculty_tuning_")
+os.environ["FACULTY_DATABASE_URL"] = f"sqlite:///{os.path.join(_tuning_dir, 'tuning.db')}"
+os.environ["EMBEDDING_CACHE_PATH"] = ""
+os.environ.setdefault("GROQ_API_KEY", "offline-tuning")
+
+from db_setup import Base, engine, SessionLocal, Document  # noqa: E402
+import document_processor  # noqa: E402
+import document_router  # noqa: E402
+import rag_chatbot  # noqa: E402
+from text_extraction import extract_text_from_bytes  # noqa: E402
+
+BACKENDS = ("flat", "routed")
+STAGES = ("embed", "route", "shortlist", "score", "mmr", "rerank")
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def load_dataset(path: str) -> Dict:
+    """Read the labelled set, loading document files relative to it."""
+    with open(path) as f:
+        dataset = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for document in dataset["documents"]:
+        if "text" not in document:
+            file_path = os.path.join(base, document["path"])
+            with open(file_path, "rb") as f:
+                document["text"] = extract_text_from_bytes(f.read(), os.path.basename(file_path))
+    titles = {document["title"] for document in dataset["documents"]}
+    unknown = [q["document"] for q in dataset["questions"] if q["document"] not in titles]
+    if unknown:
+        raise ValueError(f"Questions reference unknown documents: {sorted(set(unknown))}")
+    return dataset
+
+
+def ingest(dataset: Dict, chunk_size: int, overlap: int) -> Dict[str, int]:
+    """Recreate the corpus with the given chunking; returns document ids by title."""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    document_processor.retrieval_cache.bump_generation()
+    document_ids = {}
+    db = SessionLocal()
+    try:
+        for document in dataset["documents"]:
+            row = Document(title=document["title"], content=document["text"], content_length=len(document["text"]))
+            db.add(row)
+            db.commit()
+            document_ids[document["title"]] = row.id
+    finally:
+        db.close()
+    for document in dataset["documents"]:
+        chunks = document_processor.split_text_into_chunks(document["text"], chunk_size=chunk_size, overlap=overlap)
+        document_processor.store_full_chunks(document_ids[document["title"]], chunks)
+    return document_ids
+
+
+def label_questions(dataset: Dict, document_ids: Dict[str, int]) -> List[Set[int]]:
+    """Find the ids of the chunks that answer each question under the current chunking."""
+    labels = []
+    db = SessionLocal()
+    try:
+        for question in dataset["questions"]:
+            document_id = document_ids[question["document"]]
+            chunks = [
+                (chunk.id, _normalize(chunk.content))
+                for chunk, _ in document_processor.get_document_chunks(db, document_id)
+            ]
+            answer = _normalize(question["answer"])
+            relevant = {chunk_id for chunk_id, content in chunks if answer in content}
+            if not relevant:
+                halves = (answer[:len(answer) // 2], answer[len(answer) // 2:])
+                relevant = {chunk_id for chunk_id, content in chunks if any(half in content for half in halves)}
+            labels.append(relevant)
+    finally:
+        db.close()
+    return labels
+
+
+def evaluate(questions: List[Dict], labels: List[Set[int]], limit: int, final_limit: int,
+             threshold: float, diversity: float) -> Dict:
+    """Run every question through search_chunks and score the results against the labels."""
+    hits = 0
+    reciprocal_ranks = 0.0
+    stage_totals = {stage: 0.0 for stage in STAGES}
+    latencies = []
+    document_processor.embedding_cache.clear()
+    db = SessionLocal()
+    try:
+        for question, relevant in zip(questions, labels):
+            timings = {}
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = rag_chatbot.search_chunks(db, question["question"], limit, final_limit, threshold,
+                                                    diversity, timings=timings)
+            latencies.append(time.perf_counter() - start)
+            for stage, seconds in timings.items():
+                stage_totals[stage] += seconds
+            rank = next((i + 1 for i, chunk in enumerate(results) if chunk["chunk_id"] in relevant), None)
+            if rank:
+                hits += 1
+                reciprocal_ranks += 1.0 / rank
+    finally:
+        db.close()
+
+    count = len(questions) or 1
+    latencies.sort()
+    return {
+        f"recall@{final_limit}": round(hits / count, 4),
+        "mrr": round(reciprocal_ranks / count, 4),
+        "mean_ms": round(sum(latencies) / count * 1000, 3),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 3) if latencies else 0.0,
+        "stage_mean_ms": {stage: round(total / count * 1000, 3) for stage, total in stage_totals.items()},
+    }
+
+
+def routing_narrows() -> bool:
+    """Whether routing restricts the search on the ingested corpus, rather than falling back to a flat scan."""
+    db = SessionLocal()
+    try:
+        probe = document_processor.generate_embedding("routing probe")
+        return document_router.route_documents(db, probe) is not None
+    finally:
+        db.close()
+
+
+def sweep(dataset: Dict, args) -> List[Dict]:
+    results = []
+    for chunking in args.chunking.split(","):
+        chunk_size, overlap = (int(value) for value in chunking.split(":"))
+        print(f"\n=== Chunking {chunk_size}/{overlap} ===")
+        with contextlib.redirect_stdout(io.StringIO()):
+            document_ids = ingest(dataset, chunk_size, overlap)
+        labels = label_questions(dataset, document_ids)
+        unlabelled = sum(1 for relevant in labels if not relevant)
+        if unlabelled:
+            print(f"Warning: {unlabelled} questions have no chunk containing their answer")
+
+        for backend in args.backends.split(","):
+            if backend not in BACKENDS:
+                raise ValueError(f"Unknown backend {backend}; choose from {', '.join(BACKENDS)}")
+            document_router.DOCUMENT_ROUTING = backend == "routed"
+            # route_documents gives up on corpora of routing_top documents or fewer, so those
+            # "routed" rows would just repeat the flat numbers
+            routed = backend == "routed" and routing_narrows()
+            if backend == "routed" and not routed:
+                print(f"Warning: routing is inactive with {len(document_ids)} documents and --routing-top "
+                      f"{args.routing_top}; routed rows are flat scans and are marked routed=false")
+            grid = itertools.product(
+                [int(v) for v in args.limits.split(",")],
+                [int(v) for v in args.final_limits.split(",")],
+                [float(v) for v in args.thresholds.split(",")],
+            )
+            for limit, final_limit, threshold in grid:
+                if final_limit > limit:
+                    continue
+                metrics = evaluate(dataset["questions"], labels, limit, final_limit, threshold, args.diversity)
+                config = {
+                    "chunk_size": chunk_size, "overlap": overlap, "backend": backend,
+                    "routing_top": args.routing_top if backend == "routed" else None, "routed": routed,
+                    "limit": limit,
+                    "final_limit": final_limit, "similarity_threshold": threshold, "diversity": args.diversity,
+                }
+                results.append({"config": config, "metrics": metrics})
+                recall = metrics[f"recall@{final_limit}"]
+                label = backend if routed or backend == "flat" else "routed*"
+                print(f"{label:>7} limit={limit:<3} final={final_limit:<2} threshold={threshold:<5} "
+                      f"recall={recall:.3f} mrr={metrics['mrr']:.3f} mean={metrics['mean_ms']:.1f}ms")
+    return results
+
+
+def cheapest_meeting(results: List[Dict], min_recall: float) -> Optional[Dict]:
+    """Return the lowest-latency configuration whose recall reaches the bar."""
+    passing = [
+        result for result in results
+        if result["metrics"][f"recall@{result['config']['final_limit']}"] >= min_recall
+    ]
+    return min(passing, key=lambda result: result["metrics"]["mean_ms"]) if passing else None
+
+
+def main(argv: List[str] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="Sweep faculty retrieval parameters against a labelled set")
+    parser.add_argument("dataset", help="Labelled question set (JSON)")
+    parser.add_argument("--limits", default="5,10,20", help="Candidates kept before reranking")
+    parser.add_argument("--final-limits", default="3,5", help="Results returned after reranking (k in recall@k)")
+    parser.add_argument("--thresholds", default="0.3,0.45,0.6", help="Cosine similarity thresholds")
+    parser.add_argument("--chunking", default="1000:150", help="Comma-separated chunk_size:overlap pairs")
+    parser.add_argument("--backends", default="flat,routed", help=f"Index backends: {', '.join(BACKENDS)}")
+    parser.add_argument("--routing-top", type=int, default=document_router.ROUTING_TOP_DOCUMENTS,
+                        help="Documents searched by the routed backend")
+    parser.add_argument("--diversity", type=float, default=rag_chatbot.MMR_DIVERSITY, help="MMR diversity")
+    parser.add_argument("--min-recall", type=float, default=None, help="Quality bar for picking a configuration")
+    parser.add_argument("--output", default="tuning_results.json", help="Path of the JSON report")
+    args = parser.parse_args(argv)
+    document_router.ROUTING_TOP_DOCUMENTS = args.routing_top
+
+    dataset = load_dataset(args.dataset)
+    print(f"Loaded {len(dataset['documents'])} documents and {len(dataset['questions'])} questions")
+    results = sweep(dataset, args)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "embedding_model": document_processor.EMBEDDING_MODEL_NAME,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.min_recall is not None:
+        best = cheapest_meeting(results, args.min_recall)
+        report["recommended"] = best
+        if best:
+            print(f"\nCheapest configuration with recall >= {args.min_recall}: {best['config']} "
+                  f"({best['metrics']['mean_ms']} ms)")
+        else:
+            print(f"\nNo configuration reached recall {args.min_recall}")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote tuning report to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
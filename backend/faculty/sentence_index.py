@@ -0,0 +1,144 @@
+import os
+import re
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from db_setup import SessionLocal, DocumentSentence
+from document_processor import generate_embeddings, embedding_to_bytes
+
+# Load environment variables
+load_dotenv()
+
+SENTENCE_INDEX_ENABLED = os.getenv("SENTENCE_INDEX_ENABLED", "0") == "1"
+SENTENCE_WINDOW = int(os.getenv("SENTENCE_WINDOW", "2"))
+
+MIN_SENTENCE_CHARS = 25
+MAX_SENTENCE_CHARS = 400
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def split_into_sentences(text: str) -> List[Tuple[str, int, int]]:
+    """Split text into (sentence, start, end) spans over the original text.
+
+    Fragments shorter than MIN_SENTENCE_CHARS are merged into the following
+    sentence and sentences longer than MAX_SENTENCE_CHARS are split at spaces.
+    """
+    spans = []
+    start = 0
+    for match in _SENTENCE_BOUNDARY.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+
+    merged = []
+    pending_start = None
+    for span_start, span_end in spans:
+        if text[span_start:span_end].strip() == "":
+            continue
+        if pending_start is not None:
+            span_start = pending_start
+            pending_start = None
+        if span_end - span_start < MIN_SENTENCE_CHARS:
+            pending_start = span_start
+            continue
+        merged.append((span_start, span_end))
+    if pending_start is not None:
+        if merged:
+            merged[-1] = (merged[-1][0], len(text.rstrip()))
+        else:
+            merged.append((pending_start, len(text.rstrip())))
+
+    sentences = []
+    for span_start, span_end in merged:
+        while span_end - span_start > MAX_SENTENCE_CHARS:
+            cut = text.rfind(" ", span_start, span_start + MAX_SENTENCE_CHARS)
+            if cut <= span_start:
+                cut = span_start + MAX_SENTENCE_CHARS
+            sentences.append((text[span_start:cut].strip(), span_start, cut))
+            span_start = cut
+        sentence = text[span_start:span_end].strip()
+        if sentence:
+            sentences.append((sentence, span_start, span_end))
+    return sentences
+
+
+def index_document_sentences(document_id: int, text: str) -> int:
+    """(Re)build the sentence index of a document, reusing embeddings of unchanged sentences."""
+    sentences = split_into_sentences(text)
+    db = SessionLocal()
+    try:
+        existing = db.query(DocumentSentence).filter(DocumentSentence.document_id == document_id).all()
+        known_embeddings = {sentence.content: sentence.embedding for sentence in existing if sentence.embedding}
+        for sentence in existing:
+            db.delete(sentence)
+
+        to_embed = [content for content, _, _ in sentences if content not in known_embeddings]
+        for content, embedding in zip(to_embed, generate_embeddings(to_embed)):
+            known_embeddings[content] = embedding_to_bytes(embedding)
+
+        for i, (content, start, end) in enumerate(sentences):
+            db.add(DocumentSentence(
+                document_id=document_id,
+                sentence_index=i,
+                start_char=start,
+                end_char=end,
+                content=content,
+                embedding=known_embeddings[content]
+            ))
+        db.commit()
+        print(f"Indexed {len(sentences)} sentences for document ID {document_id} ({len(to_embed)} embedded)")
+        return len(sentences)
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR indexing sentences: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+
+def expand_sentence_windows(hits: List[Dict], window: int = None) -> List[Dict]:
+    """Expand sentence hits to their surrounding window, merging overlapping windows of the same document."""
+    if window is None:
+        window = SENTENCE_WINDOW
+
+    # Merge overlapping or adjacent windows per document; hits arrive best first, so the first hit of a window wins
+    by_document = {}
+    for rank, hit in enumerate(hits):
+        low = max(0, hit["sentence_index"] - window)
+        high = hit["sentence_index"] + window
+        by_document.setdefault(hit["document_id"], []).append((low, high, rank, hit))
+
+    windows = []
+    for spans in by_document.values():
+        spans.sort(key=lambda span: span[0])
+        current = None
+        for low, high, rank, hit in spans:
+            if current and low <= current["high"] + 1:
+                current["high"] = max(current["high"], high)
+                if rank < current["rank"]:
+                    current.update({**hit, "rank": rank, "low": current["low"], "high": current["high"]})
+            else:
+                current = {**hit, "rank": rank, "low": low, "high": high}
+                windows.append(current)
+    windows.sort(key=lambda item: item["rank"])
+
+    db = SessionLocal()
+    try:
+        expanded = []
+        for item in windows:
+            sentences = (
+                db.query(DocumentSentence.content)
+                .filter(DocumentSentence.document_id == item["document_id"],
+                        DocumentSentence.sentence_index >= item["low"],
+                        DocumentSentence.sentence_index <= item["high"])
+                .order_by(DocumentSentence.sentence_index)
+                .all()
+            )
+            result = {key: value for key, value in item.items() if key not in ("low", "high", "rank")}
+            result["matched_sentence"] = item["content"]
+            result["content"] = " ".join(sentence.content for sentence in sentences)
+            result["window"] = [item["low"], item["high"]]
+            expanded.append(result)
+        return expanded
+    finally:
+        db.close()
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from db_setup import SessionLocal, Document, DocumentSummary
+from document_processor import (
+    generate_embedding, generate_embeddings, embedding_to_bytes, cosine_similarities, get_document_chunks
+)
+from context_packer import find_overlap, trim_to_tokens
+
+# Load environment variables
+load_dotenv()
+
+# Groq setup
+from groq import Groq
+groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+SUMMARY_TREE_ENABLED = os.getenv("SUMMARY_TREE_ENABLED", "0") == "1"
+# Consecutive chunks summarized together as one section
+SUMMARY_SECTION_CHUNKS = int(os.getenv("SUMMARY_SECTION_CHUNKS", "5"))
+SUMMARY_SIMILARITY_THRESHOLD = float(os.getenv("SUMMARY_SIMILARITY_THRESHOLD", "0.3"))
+
+SECTION_INPUT_TOKENS = 3000
+SUMMARY_MODEL = "llama-3.3-70b-versatile"
+
+_BROAD_QUERY = re.compile(
+    r"\b(summari[sz]e|summary|overview|outline|recap|main (points|ideas|topics)|key (points|ideas|takeaways)"
+    r"|what (is|are) (this|the) (document|chapter|unit|module|notes?) about|tl;?dr|gist)\b",
+    re.IGNORECASE
+)
+
+
+def is_broad_query(query: str) -> bool:
+    """Whether a question asks about a document as a whole rather than a specific fact."""
+    return bool(_BROAD_QUERY.search(query))
+
+
+def _summarize(text: str, instruction: str) -> str:
+    messages = [
+        {"role": "system", "content": "You write concise, faithful summaries of educational material."},
+        {"role": "user", "content": f"{instruction}\n\n{trim_to_tokens(text, SECTION_INPUT_TOKENS)}"}
+    ]
+    chat_completion = groq_client.chat.completions.create(messages=messages, model=SUMMARY_MODEL)
+    return chat_completion.choices[0].message.content.strip()
+
+
+def _join_chunks(contents: List[str]) -> str:
+    """Concatenate consecutive chunks, dropping the overlap between neighbours."""
+    text = contents[0] if contents else ""
+    for content in contents[1:]:
+        overlap = find_overlap(text, content)
+        text += content[overlap:] if overlap else "\n" + content
+    return text
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_summary_tree(document_id: int, section_chunks: Optional[int] = None) -> Dict[str, int]:
+    """(Re)build the section and document summaries of a document.
+
+    Sections whose text is unchanged since the last build keep their summary, so
+    after an update only edited sections cost an LLM call.
+    """
+    section_chunks = section_chunks or SUMMARY_SECTION_CHUNKS
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document:
+            return {"sections": 0, "summarized": 0}
+        chunks = get_document_chunks(db, document_id)
+
+        existing = db.query(DocumentSummary).filter(DocumentSummary.document_id == document_id).all()
+        known = {node.source_hash: node for node in existing if node.level == "section"}
+
+        sections = []
+        for start in range(0, len(chunks), section_chunks):
+            group = chunks[start:start + section_chunks]
+            text = _join_chunks([chunk.content for chunk, _ in group])
+            sections.append({"start": group[0][1], "end": group[-1][1], "text": text, "hash": _hash(text)})
+
+        summarized = 0
+        for section in sections:
+            previous = known.get(section["hash"])
+            if previous:
+                section["content"], section["embedding"] = previous.content, previous.embedding
+                continue
+            section["content"] = _summarize(
+                section["text"], "Summarize this section of a course document in 3-5 sentences, keeping key terms:"
+            )
+            section["embedding"] = None
+            summarized += 1
+
+        to_embed = [section for section in sections if section["embedding"] is None]
+        for section, embedding in zip(to_embed, generate_embeddings([s["content"] for s in to_embed])):
+            section["embedding"] = embedding_to_bytes(embedding)
+
+        # Single-section documents reuse the section summary as the document summary
+        document_hash = _hash("".join(section["hash"] for section in sections))
+        previous_root = next((node for node in existing if node.level == "document"), None)
+        if previous_root and previous_root.source_hash == document_hash:
+            root_content, root_embedding = previous_root.content, previous_root.embedding
+        elif len(sections) == 1:
+            root_content, root_embedding = sections[0]["content"], sections[0]["embedding"]
+        elif sections:
+            outline = "\n\n".join(f"Section {i + 1}: {section['content']}" for i, section in enumerate(sections))
+            root_content = _summarize(
+                outline, f"Write an overview of the document '{document.title}' from these section summaries:"
+            )
+            root_embedding = embedding_to_bytes(generate_embedding(root_content))
+            summarized += 1
+
+        for node in existing:
+            db.delete(node)
+        for i, section in enumerate(sections):
+            db.add(DocumentSummary(
+                document_id=document_id, level="section", node_index=i,
+                start_chunk=section["start"], end_chunk=section["end"], source_hash=section["hash"],
+                content=section["content"], embedding=section["embedding"]
+            ))
+        if sections:
+            db.add(DocumentSummary(
+                document_id=document_id, level="document", node_index=0,
+                start_chunk=sections[0]["start"], end_chunk=sections[-1]["end"], source_hash=document_hash,
+                content=root_content, embedding=root_embedding
+            ))
+        db.commit()
+        print(f"Built summary tree for document ID {document_id}: {len(sections)} sections ({summarized} LLM calls)")
+        return {"sections": len(sections), "summarized": summarized}
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR building summary tree: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+
+def get_relevant_summaries(query: str, limit: int = 3,
+                           similarity_threshold: Optional[float] = None) -> List[Dict]:
+    """Return the summary nodes closest to the query, in the same shape as retrieved chunks."""
+    if similarity_threshold is None:
+        similarity_threshold = SUMMARY_SIMILARITY_THRESHOLD
+    db = SessionLocal()
+    try:
+        nodes = (
+            db.query(DocumentSummary, Document.title)
+            .join(Document, Document.id == DocumentSummary.document_id)
+            .filter(DocumentSummary.embedding.isnot(None))
+            .all()
+        )
+        if not nodes:
+            return []
+
+        matrix = np.vstack([np.frombuffer(node.embedding, dtype=np.float32) for node, _ in nodes])
+        similarities = cosine_similarities(generate_embedding(query), matrix)
+        results = []
+        for i in np.argsort(-similarities)[:limit]:
+            if similarities[i] < similarity_threshold:
+                break
+            node, title = nodes[i]
+            results.append({
+                "summary_id": node.id,
+                "content": node.content,
+                "document_title": title,
+                "document_id": node.document_id,
+                "chunk_index": node.start_chunk,
+                "summary_level": node.level,
+                "chunk_range": [node.start_chunk, node.end_chunk],
+                "similarity": float(similarities[i]),
+            })
+        return results
+    finally:
+        db.close()
+
+
+def get_document_summary(document_id: int) -> Optional[Dict]:
+    """Return a document's summary tree, or None if it has not been built."""
+    db = SessionLocal()
+    try:
+        nodes = (
+            db.query(DocumentSummary)
+            .filter(DocumentSummary.document_id == document_id)
+            .order_by(DocumentSummary.node_index)
+            .all()
+        )
+        root = next((node for node in nodes if node.level == "document"), None)
+        if not root:
+            return None
+        return {
+            "document_id": document_id,
+            "summary": root.content,
+            "sections": [
+                {"index": node.node_index, "chunk_range": [node.start_chunk, node.end_chunk], "summary": node.content}
+                for node in nodes if node.level == "section"
+            ],
+        }
+    finally:
+        db.close()
@@ -0,0 +1,29 @@
+import io
+from typing import BinaryIO
+import PyPDF2
+import docx
+
+
+def extract_text(file: BinaryIO, filename: str) -> str:
+    """Extract text from uploaded files based on file type."""
+    if filename.endswith('.pdf'):
+        pdf_reader = PyPDF2.PdfReader(file)
+        text = ""
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n"
+        return text
+    elif filename.endswith('.docx'):
+        doc = docx.Document(file)
+        text = ""
+        for para in doc.paragraphs:
+            text += para.text + "\n"
+        return text
+    elif filename.endswith('.txt'):
+        return file.read().decode('utf-8')
+    else:
+        raise ValueError(f"Unsupported file format: {filename}")
+
+
+def extract_text_from_bytes(data: bytes, filename: str) -> str:
+    """Extract text from raw file bytes; kept free of model imports so process-pool workers start quickly."""
+    return extract_text(io.BytesIO(data), filename)
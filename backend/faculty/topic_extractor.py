@@ -0,0 +1,112 @@
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from document_processor import generate_embeddings, cosine_similarities
+
+STOPWORDS = set("""
+a about above after again against all also am an and any are as at be because been before being below between both
+but by can could did do does doing down during each either else etc even ever every few for from further had has have
+having he her here hers herself him himself his how however i if in into is it its itself just let like made make
+many may me might more most much must my myself no nor not now of off often on once one only or other otherwise our
+ours ourselves out over own per rather same she should since so some such than that the their theirs them themselves
+then there therefore these they this those though through thus to too under until up upon us use used uses using very
+via was we well were what when where whereas whether which while who whom whose why will with within without would
+yet you your yours yourself yourselves example examples figure fig table chapter section page unit introduction
+summary conclusion see also first second third new called based given shown following various different important
+""".split())
+
+MAX_NGRAM = 3
+SHORTLIST_SIZE = 40
+SEGMENT_CHARS = 1000
+REDUNDANT_TOPIC_SIMILARITY = 0.8
+_WORD = re.compile(r"[A-Za-z][A-Za-z\-]{2,}")
+_PHRASE_BREAK = re.compile(r"[.,;:!?()\[\]{}\"\n]+")
+
+
+def _candidate_phrases(text: str) -> List[List[str]]:
+    """Split text into runs of content words between punctuation and stopwords."""
+    runs = []
+    for fragment in _PHRASE_BREAK.split(text):
+        run = []
+        for token in fragment.split():
+            word = token.lower()
+            if _WORD.fullmatch(token) and word not in STOPWORDS:
+                run.append(word)
+            else:
+                if run:
+                    runs.append(run)
+                run = []
+        if run:
+            runs.append(run)
+    return runs
+
+
+def score_candidates(text: str) -> Dict[str, float]:
+    """Score 1-3 word keyphrase candidates by term frequency weighted by how widely they spread over the text."""
+    segments = [text[i:i + SEGMENT_CHARS] for i in range(0, len(text), SEGMENT_CHARS)] or [text]
+    counts = {}
+    segment_hits = {}
+    for segment_index, segment in enumerate(segments):
+        for run in _candidate_phrases(segment):
+            for size in range(1, MAX_NGRAM + 1):
+                for start in range(len(run) - size + 1):
+                    phrase = " ".join(run[start:start + size])
+                    counts[phrase] = counts.get(phrase, 0) + 1
+                    segment_hits.setdefault(phrase, set()).add(segment_index)
+
+    scores = {}
+    for phrase, count in counts.items():
+        words = phrase.count(" ") + 1
+        if words > 1 and count < 2:
+            continue
+        spread = len(segment_hits[phrase]) / len(segments)
+        # Multi-word phrases are rarer but more descriptive, so boost them
+        scores[phrase] = (1 + math.log(count)) * math.sqrt(spread) * (1 + 0.5 * (words - 1))
+    return scores
+
+
+def extract_topics_locally(text: str, chunk_embeddings: Optional[List[List[float]]] = None,
+                           top_n: int = 5) -> Tuple[List[str], float]:
+    """Extract topic names with keyphrase statistics and the embedding model, without an LLM call.
+
+    Returns the topics and a confidence score: the mean similarity of the chosen
+    keyphrases to the document's mean embedding.
+    """
+    scores = score_candidates(text)
+    if not scores:
+        return [], 0.0
+
+    shortlist = sorted(scores, key=scores.get, reverse=True)[:SHORTLIST_SIZE]
+    # Drop phrases contained in a better-scoring longer phrase so "cell" and "cell membrane" don't both appear
+    shortlist = [
+        phrase for phrase in shortlist
+        if not any(phrase != other and f" {phrase} " in f" {other} " and scores[other] >= scores[phrase] * 0.8
+                   for other in shortlist)
+    ]
+
+    if chunk_embeddings:
+        document_vectors = np.asarray(chunk_embeddings, dtype=np.float32)
+    else:
+        segments = [text[i:i + SEGMENT_CHARS] for i in range(0, len(text), SEGMENT_CHARS)]
+        document_vectors = np.asarray(generate_embeddings(segments), dtype=np.float32)
+    document_embedding = document_vectors.mean(axis=0)
+
+    candidate_vectors = np.asarray(generate_embeddings(shortlist), dtype=np.float32)
+    semantic = cosine_similarities(document_embedding, candidate_vectors)
+    statistical = np.asarray([scores[phrase] for phrase in shortlist], dtype=np.float32)
+    statistical = statistical / statistical.max()
+    combined = 0.7 * semantic + 0.3 * statistical
+
+    # Take phrases by combined score, skipping ones that name nearly the same concept as a chosen topic
+    chosen = []
+    for i in np.argsort(-combined):
+        if len(chosen) == top_n:
+            break
+        if chosen and cosine_similarities(candidate_vectors[i], candidate_vectors[chosen]).max() >= REDUNDANT_TOPIC_SIMILARITY:
+            continue
+        chosen.append(int(i))
+
+    topics = [" ".join(word.capitalize() for word in shortlist[i].split()) for i in chosen]
+    confidence = float(np.mean(semantic[chosen])) if chosen else 0.0
+    return topics, confidence
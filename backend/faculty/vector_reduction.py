@@ -0,0 +1,275 @@
+"""Optional PCA reduction of chunk embeddings for cheaper first-stage search.
+
+A projection fitted on the corpus maps each 384-dim float32 embedding to a
+few dozen float16 components. Retrieval scores the reduced vectors, kept in
+memory for the current corpus generation, keeps a shortlist, and re-scores
+only the shortlist with the full vectors.
+
+    python vector_reduction.py fit --dims 64
+    python vector_reduction.py report
+"""
+import argparse
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import or_
+from db_setup import SessionLocal, DocumentChunk, ChunkReference, VectorProjection, ensure_schema
+
+# Load environment variables
+load_dotenv()
+
+# Use the fitted projection for first-stage search; set to 0 to always scan full vectors
+VECTOR_REDUCTION = os.getenv("VECTOR_REDUCTION", "1") == "1"
+VECTOR_REDUCTION_DIMS = int(os.getenv("VECTOR_REDUCTION_DIMS", "64"))
+# Shortlist re-scored with full vectors, as a multiple of the candidates retrieval needs
+REDUCTION_SHORTLIST_FACTOR = int(os.getenv("REDUCTION_SHORTLIST_FACTOR", "4"))
+
+REDUCED_DTYPE = np.float16
+
+_projection_cache: Dict[str, object] = {"id": None, "mean": None, "components": None}
+# Normalized reduced vectors of the whole corpus, valid for one projection and corpus generation
+_reduced_cache: Dict[str, object] = {"key": None, "chunk_ids": None, "matrix": None, "missing": None}
+_reduced_lock = threading.Lock()
+
+
+def _fitted_projection(db) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Return (mean, components) of the latest projection, cached by id and fit time."""
+    latest = db.query(VectorProjection.id, VectorProjection.created_at).order_by(VectorProjection.id.desc()).first()
+    if latest is None:
+        return None
+    # Ids restart after the corpus is wiped, so the fit time tells projections with the same id apart
+    if _projection_cache["id"] != (latest.id, latest.created_at):
+        projection = db.query(VectorProjection).filter(VectorProjection.id == latest.id).one()
+        mean = np.frombuffer(projection.mean, dtype=np.float32)
+        components = np.frombuffer(projection.components, dtype=np.float32).reshape(projection.dimensions, -1)
+        _projection_cache.update(id=(latest.id, latest.created_at), mean=mean, components=components)
+    return _projection_cache["mean"], _projection_cache["components"]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def project(vectors: np.ndarray, mean: np.ndarray, components: np.ndarray) -> np.ndarray:
+    """Project unit-normalized vectors onto the components."""
+    return (_normalize(np.asarray(vectors, dtype=np.float32)) - mean) @ components.T
+
+
+def reduce_vectors(vectors: List[List[float]]) -> Optional[List[bytes]]:
+    """Reduce embeddings with the fitted projection; None when no projection is fitted."""
+    if not vectors:
+        return []
+    db = SessionLocal()
+    try:
+        fitted = _fitted_projection(db)
+    finally:
+        db.close()
+    if fitted is None:
+        return None
+    reduced = project(np.asarray(vectors, dtype=np.float32), *fitted).astype(REDUCED_DTYPE)
+    return [row.tobytes() for row in reduced]
+
+
+def fit_projection(dims: Optional[int] = None) -> Dict:
+    """Fit a PCA projection on every chunk embedding and store reduced vectors for all chunks."""
+    dims = dims or VECTOR_REDUCTION_DIMS
+    start = time.time()
+    db = SessionLocal()
+    try:
+        rows = db.query(DocumentChunk.id, DocumentChunk.embedding).filter(DocumentChunk.embedding.isnot(None)).all()
+        if len(rows) <= dims:
+            raise ValueError(f"Need more than {dims} embedded chunks to fit a {dims}-dimension projection")
+
+        vectors = _normalize(np.vstack([np.frombuffer(row.embedding, dtype=np.float32) for row in rows]))
+        mean = vectors.mean(axis=0)
+        _, singular_values, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        components = vt[:dims].astype(np.float32)
+        explained = float((singular_values[:dims] ** 2).sum() / (singular_values ** 2).sum())
+
+        projection = VectorProjection(
+            dimensions=dims, fitted_chunks=len(rows), explained_variance=explained,
+            mean=mean.astype(np.float32).tobytes(), components=components.tobytes()
+        )
+        db.add(projection)
+        db.flush()
+        reduced = project(vectors, mean, components).astype(REDUCED_DTYPE)
+        db.bulk_update_mappings(DocumentChunk, [
+            {"id": row.id, "reduced_embedding": vector.tobytes()} for row, vector in zip(rows, reduced)
+        ])
+        # Only the latest projection is used
+        db.query(VectorProjection).filter(VectorProjection.id != projection.id).delete(synchronize_session=False)
+        db.commit()
+        from document_processor import retrieval_cache
+        retrieval_cache.bump_generation()
+        print(f"Fitted {dims}-dimension projection on {len(rows)} chunks in {time.time() - start:.2f}s "
+              f"({explained:.1%} variance kept)")
+        return {"dimensions": dims, "fitted_chunks": len(rows), "explained_variance": round(explained, 4)}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _corpus_reduced_vectors(db, fitted: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    """Return (chunk ids, normalized reduced matrix, ids without a reduced vector) of the whole corpus.
+
+    Loaded from the database once per projection and corpus generation, then held in memory.
+    """
+    from document_processor import retrieval_cache
+    # Read the generation before loading, so a write during the load leaves the entry stale
+    key = (_projection_cache["id"], retrieval_cache.generation)
+    with _reduced_lock:
+        if _reduced_cache["key"] == key:
+            return _reduced_cache["chunk_ids"], _reduced_cache["matrix"], _reduced_cache["missing"]
+        rows = db.query(DocumentChunk.id, DocumentChunk.reduced_embedding).all()
+        reduced = [row for row in rows if row.reduced_embedding]
+        matrix = (
+            _normalize(np.vstack([
+                np.frombuffer(row.reduced_embedding, dtype=REDUCED_DTYPE) for row in reduced
+            ]).astype(np.float32))
+            if reduced else np.zeros((0, fitted[1].shape[0]), dtype=np.float32)
+        )
+        chunk_ids = np.asarray([row.id for row in reduced], dtype=np.int64)
+        missing = [row.id for row in rows if not row.reduced_embedding]
+        _reduced_cache.update(key=key, chunk_ids=chunk_ids, matrix=matrix, missing=missing)
+        return chunk_ids, matrix, missing
+
+
+def load_reduced_vectors(db, document_ids: Optional[List[int]] = None):
+    """Return (mean, components, chunk ids, normalized reduced matrix, ids without a reduced vector), or None if inactive."""
+    if not VECTOR_REDUCTION:
+        return None
+    fitted = _fitted_projection(db)
+    if fitted is None:
+        return None
+    chunk_ids, matrix, missing = _corpus_reduced_vectors(db, fitted)
+    if document_ids is not None:
+        # Only chunk ids are read to scope the search; the vectors come from memory
+        referenced = db.query(ChunkReference.chunk_id).filter(ChunkReference.document_id.in_(document_ids))
+        scoped = {row.id for row in db.query(DocumentChunk.id).filter(
+            or_(DocumentChunk.document_id.in_(document_ids), DocumentChunk.id.in_(referenced))
+        )}
+        mask = np.isin(chunk_ids, list(scoped))
+        chunk_ids, matrix = chunk_ids[mask], matrix[mask]
+        missing = [chunk_id for chunk_id in missing if chunk_id in scoped]
+    return fitted[0], fitted[1], chunk_ids.tolist(), matrix, missing
+
+
+def shortlist_chunk_ids(db, query_embedding: List[float], size: int,
+                        document_ids: Optional[List[int]] = None) -> Optional[List[int]]:
+    """Ids of the chunks closest to the query in reduced space, plus any chunk not yet reduced.
+
+    Returns None when reduction is disabled or no projection has been fitted.
+    """
+    loaded = load_reduced_vectors(db, document_ids)
+    if loaded is None:
+        return None
+    mean, components, chunk_ids, matrix, missing = loaded
+    if not chunk_ids:
+        return missing
+    query = project(np.asarray([query_embedding], dtype=np.float32), mean, components)[0]
+    scores = matrix @ (query / (np.linalg.norm(query) or 1))
+    top = np.argsort(-scores)[:size]
+    return [chunk_ids[i] for i in top] + missing
+
+
+def reduction_report(sample_queries: int = 200, k: int = 10, shortlist_factor: Optional[int] = None,
+                     seed: int = 0) -> Dict:
+    """Measure memory saved and recall lost by reduced-vector search.
+
+    Uses a sample of chunk embeddings as queries, held out of the scanned set so a
+    query never finds itself, and compares the top-k found by shortlisting in reduced
+    space and re-scoring with full vectors against an exact full-vector scan. Both
+    scans run over float32 matrices in memory, as retrieval does.
+    """
+    shortlist_factor = shortlist_factor or REDUCTION_SHORTLIST_FACTOR
+    db = SessionLocal()
+    try:
+        fitted = _fitted_projection(db)
+        if fitted is None:
+            return {"fitted": False}
+        mean, components = fitted
+        rows = (
+            db.query(DocumentChunk.embedding, DocumentChunk.reduced_embedding)
+            .filter(DocumentChunk.embedding.isnot(None), DocumentChunk.reduced_embedding.isnot(None))
+            .all()
+        )
+        projection = db.query(VectorProjection).order_by(VectorProjection.id.desc()).first()
+    finally:
+        db.close()
+    if not rows:
+        return {"fitted": True, "chunks": 0}
+
+    full = _normalize(np.vstack([np.frombuffer(row.embedding, dtype=np.float32) for row in rows]))
+    reduced = _normalize(np.vstack([
+        np.frombuffer(row.reduced_embedding, dtype=REDUCED_DTYPE) for row in rows
+    ]).astype(np.float32))
+    if len(rows) < 2:
+        return {"fitted": True, "chunks": len(rows)}
+    rng = np.random.RandomState(seed)
+    # Keep at least half the chunks to search
+    sampled = rng.choice(len(rows), size=min(sample_queries, len(rows) // 2), replace=False)
+    scanned = np.setdiff1d(np.arange(len(rows)), sampled)
+    queries, full, reduced = full[sampled], full[scanned], reduced[scanned]
+    k = min(k, len(scanned))
+
+    recalled = 0
+    exact_seconds = reduced_seconds = 0.0
+    for query_full in queries:
+        start = time.perf_counter()
+        exact = set(np.argsort(-(full @ query_full))[:k])
+        exact_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        query = _normalize(project(query_full[None, :], mean, components))[0]
+        shortlist = np.argsort(-(reduced @ query))[:k * shortlist_factor]
+        found = set(shortlist[np.argsort(-(full[shortlist] @ query_full))[:k]])
+        reduced_seconds += time.perf_counter() - start
+        recalled += len(exact & found)
+
+    full_bytes = full.shape[1] * 4
+    stored_bytes = components.shape[0] * np.dtype(REDUCED_DTYPE).itemsize
+    # Retrieval holds the reduced vectors in memory as float32, for BLAS-speed scoring
+    scanned_bytes = components.shape[0] * 4
+    return {
+        "fitted": True,
+        "chunks": len(rows),
+        "query_chunks": len(queries),
+        "dimensions": components.shape[0],
+        "explained_variance": round(projection.explained_variance, 4),
+        "bytes_per_vector_full": full_bytes,
+        "bytes_per_vector_stored": stored_bytes,
+        "bytes_per_vector_scanned": scanned_bytes,
+        "scan_memory_saved_bytes": (full_bytes - scanned_bytes) * len(rows),
+        "scan_memory_saved_ratio": round(1 - scanned_bytes / full_bytes, 4),
+        f"recall@{k}": round(recalled / (len(queries) * k), 4),
+        "recall_lost": round(1 - recalled / (len(queries) * k), 4),
+        "shortlist_factor": shortlist_factor,
+        "exact_scan_ms_per_query": round(exact_seconds / len(queries) * 1000, 3),
+        "reduced_scan_ms_per_query": round(reduced_seconds / len(queries) * 1000, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Fit or evaluate the PCA projection of chunk embeddings")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fit_parser = subparsers.add_parser("fit", help="Fit a projection and reduce every chunk")
+    fit_parser.add_argument("--dims", type=int, default=VECTOR_REDUCTION_DIMS)
+    report_parser = subparsers.add_parser("report", help="Report memory saved and recall lost")
+    report_parser.add_argument("--queries", type=int, default=200)
+    report_parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    ensure_schema()
+    if args.command == "fit":
+        print(fit_projection(args.dims))
+    print(reduction_report(**({"sample_queries": args.queries, "k": args.k} if args.command == "report" else {})))
+
+
+if __name__ == "__main__":
+    main()
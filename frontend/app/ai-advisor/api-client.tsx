@@ -22,9 +22,10 @@ export interface ChatMessage {
   const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:5001';
   
   /**
-   * Get a response from the AI Advisor
+   * Get a response from the AI Advisor. Only the new message is sent; the server
+   * keeps the history and uploaded documents of the session.
    */
-  export async function getAdvisorResponse(message: string, history: ChatMessage[], sessionId?: string) {
+  export async function getAdvisorResponse(message: string, sessionId?: string, docId?: string) {
     try {
       const response = await fetch(`${API_BASE_URL}/api/advisor`, {
         method: 'POST',
@@ -33,8 +34,8 @@ export interface ChatMessage {
         },
         body: JSON.stringify({
           message,
-          history,
-          session_id: sessionId
+          session_id: sessionId,
+          doc_id: docId
         }),
       });
   
@@ -49,6 +50,72 @@ export interface ChatMessage {
     }
   }
   
+  /**
+   * Stream a response from the AI Advisor, calling onToken as tokens arrive.
+   * Resolves with the same shape as getAdvisorResponse once the response is complete.
+   */
+  export async function streamAdvisorResponse(
+    message: string,
+    sessionId: string | undefined,
+    docId: string | undefined,
+    onToken: (token: string) => void
+  ) {
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/advisor`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          message,
+          session_id: sessionId,
+          doc_id: docId,
+          stream: true
+        }),
+      });
+  
+      if (!response.ok) {
+        throw new Error(`Error: ${response.status}`);
+      }
+  
+      // Document commands are answered at once, as plain JSON
+      if (!response.headers.get('Content-Type')?.includes('text/event-stream') || !response.body) {
+        const result = await response.json();
+        onToken(result.response);
+        return result;
+      }
+  
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let result: any = null;
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop() || '';
+        for (const event of events) {
+          if (!event.startsWith('data: ')) continue;
+          const payload = JSON.parse(event.slice(6));
+          if (payload.done) {
+            result = payload;
+          } else if (payload.token) {
+            onToken(payload.token);
+          }
+        }
+      }
+  
+      if (!result) {
+        throw new Error('Advisor stream ended early');
+      }
+      return result;
+    } catch (error) {
+      console.error('Error streaming advisor response:', error);
+      throw error;
+    }
+  }
+  
   /**
    * Upload a file to the backend
    */
@@ -13,11 +13,10 @@ import EnhancedBackground from "@/components/enhanced-background"
 import { useMouse } from "@/hooks/use-mouse"
 import ScrollProgress from "@/components/scroll-progress"
 import {
-  getAdvisorResponse,
+  streamAdvisorResponse,
   uploadFile,
   getDocumentSegments,
   getDocumentMetadata,
-  type ChatMessage as ApiChatMessage,
   type DocumentMetadata
 } from "@/app/ai-advisor/api-client"
 
@@ -52,9 +51,6 @@ export default function AIAdvisorPage() {
   const [sessionId, setSessionId] = useState<string | undefined>()
   const [currentDocId, setCurrentDocId] = useState<string | undefined>()
   const [documentMetadata, setDocumentMetadata] = useState<DocumentMetadata | undefined>()
-  const [chatHistory, setChatHistory] = useState<ApiChatMessage[]>([
-    { role: "advisor", content: "Hello! I'm your AI Advisor. How can I help you with your learning journey today?" }
-  ])
 
   const messagesEndRef = useRef<HTMLDivElement>(null)
   const fileInputRef = useRef<HTMLInputElement>(null)
@@ -203,19 +199,20 @@ export default function AIAdvisorPage() {
         timestamp: new Date(),
       }
 
-      // Add message to state and update chat history
+      // Add message to state; the server keeps the chat history for the session
       setMessages((prev) => [...prev, newMessage])
       
-      // Update chat history for API request
-      const updatedHistory = [...chatHistory, { role: "user", content: inputMessage }]
-      setChatHistory(updatedHistory)
-      
       setInputMessage("")
       setIsGeneratingResponse(true)
 
       // Call API for response
       try {
-        const result = await getAdvisorResponse(inputMessage, updatedHistory, sessionId)
+        // Show the advisor's reply as it streams in
+        const responseId = Date.now().toString()
+        setMessages((prev) => [...prev, { id: responseId, content: "", sender: "advisor", timestamp: new Date() }])
+        const result = await streamAdvisorResponse(inputMessage, sessionId, currentDocId, (token) => {
+          setMessages((prev) => prev.map((msg) => (msg.id === responseId ? { ...msg, content: msg.content + token } : msg)))
+        })
         
         // Store or update session ID if provided
         if (result.session_id && !sessionId) {
@@ -227,17 +224,7 @@ export default function AIAdvisorPage() {
           setCurrentDocId(result.doc_id)
         }
         
-        const responseMessage: Message = {
-          id: Date.now().toString(),
-          content: result.response,
-          sender: "advisor",
-          timestamp: new Date(),
-        }
-
-        setMessages((prev) => [...prev, responseMessage])
-        
-        // Update history with advisor response
-        setChatHistory([...updatedHistory, { role: "advisor", content: result.response }])
+        setMessages((prev) => prev.map((msg) => (msg.id === responseId ? { ...msg, content: result.response } : msg)))
         
         // Speak the response
         speakText(result.response)
@@ -252,7 +239,8 @@ export default function AIAdvisorPage() {
           timestamp: new Date(),
         }
         
-        setMessages((prev) => [...prev, errorMessage])
+        // Replace the reply placeholder if nothing streamed into it
+        setMessages((prev) => [...prev.filter((msg) => msg.sender !== "advisor" || msg.content !== ""), errorMessage])
       } finally {
         setIsGeneratingResponse(false)
       }
@@ -336,7 +324,6 @@ export default function AIAdvisorPage() {
         }
 
         setMessages((prev) => [...prev, newMessage])
-        setChatHistory([...chatHistory, { role: "user", content: `I've uploaded a file: ${file.name}` }])
         
         setIsGeneratingResponse(true)
 
@@ -362,15 +349,6 @@ export default function AIAdvisorPage() {
           }
 
           setMessages((prev) => [...prev, responseMessage])
-          setChatHistory([...chatHistory, { role: "advisor", content: result.response }])
-          
-          // Add system message about document if appropriate
-          if (result.doc_id) {
-            setChatHistory((prev) => [...prev, { 
-              role: "system", 
-              content: `DOCUMENT_REFERENCE: {"doc_id":"${result.doc_id}","document_type":"${result.document_type || 'general'}","file_name":"${file.name}"}`
-            }])
-          }
           
           // Speak the response
           speakText(result.response)
@@ -419,7 +397,6 @@ export default function AIAdvisorPage() {
         }
         
         setMessages((prev) => [...prev, message])
-        setChatHistory((prev) => [...prev, { role: "advisor", content: message.content }])
       }
     } catch (error) {
       console.error("Error fetching document segments:", error)
@@ -59,6 +59,8 @@ export default function AIFacultyPage() {
     },
   ])
   const [inputMessage, setInputMessage] = useState("")
+  // Server-side conversation id; once known, only the new message is sent
+  const conversationIdRef = useRef<string | null>(null)
   const [isGeneratingQuiz, setIsGeneratingQuiz] = useState(false)
   const [questions, setQuestions] = useState<Question[]>([])
   const [quizData, setQuizData] = useState<any[]>([])
@@ -177,19 +179,24 @@ export default function AIFacultyPage() {
         const res = await fetch(`${BACKEND_URL}/chat`, {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({
-            message: inputMessage,
-            conversation_history: messages.map((m) => ({
-              role: m.sender === "user" ? "user" : "assistant",
-              content: m.content,
-            })),
-          }),
+          body: JSON.stringify(
+            conversationIdRef.current
+              ? { message: inputMessage, conversation_id: conversationIdRef.current }
+              : {
+                  message: inputMessage,
+                  conversation_history: messages.map((m) => ({
+                    role: m.sender === "user" ? "user" : "assistant",
+                    content: m.content,
+                  })),
+                },
+          ),
         })
         if (!res.ok) {
           const data = await res.json()
           throw new Error(data.detail || "Chat error")
         }
         const data = await res.json()
+        if (data.conversation_id) conversationIdRef.current = data.conversation_id
         handleBotResponse(data.response)
       } catch (err: any) {
         handleBotResponse("Chat error: " + (err?.message || "Unknown error"))